@@ -1,12 +1,31 @@
-from flask import Flask, jsonify, render_template, request, redirect, url_for
+from flask import Flask, jsonify, request, redirect, url_for
 import data_manager  # Import the new data_manager module
+import catalogue_store
+import tracing
+import wire_format
+import scan_coalescer
+import scanner_dictionary
+import static_assets
+import tenants
+import traffic_capture
+import log_index
+import log_format
+import price_alerts
+import atexit
 import json
 import logging
 import os  # Import os module to create directories
+import signal
+import sys
 from datetime import datetime, timedelta  # Import datetime and timedelta for log parsing and initial log generation
 
 
 app = Flask(__name__)
+tenants.init_app(app)
+tracing.init_app(app)
+wire_format.init_app(app)
+static_assets.init_app(app)
+traffic_capture.init_app(app)  # Last, so it records responses before compression
 
 # --- Logging Setup ---
 # Ensure log directories exist
@@ -17,14 +36,15 @@ if not os.path.exists(log_dir):
 # Define log file paths based on the logging setup for consistency
 SERVER_LOG_FILE_PATH = os.path.join(log_dir, 'server_logs.txt')
 SCANNER_LOG_FILE_PATH = os.path.join(log_dir, 'scanner_logs.txt')
+DATA_MANAGER_LOG_FILE_PATH = os.path.join(log_dir, 'data_manager_logs.txt')
 
 # Server Logger
 server_logger = logging.getLogger('server_logs')
 server_logger.setLevel(logging.INFO)
 # --- IMPORTANT CHANGE: Specify encoding='utf-8' for FileHandler ---
 server_handler = logging.FileHandler(SERVER_LOG_FILE_PATH, encoding='utf-8')
-server_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-server_handler.setFormatter(server_formatter)
+log_format.configure_handler(server_handler)  # Text or JSONL, depending on LOG_FORMAT
+tracing.trace_handler(server_handler)
 # Ensure handlers are not duplicated if the app is reloaded (e.g., with debug=True)
 if not server_logger.handlers:
     server_logger.addHandler(server_handler)
@@ -34,20 +54,34 @@ scanner_logger = logging.getLogger('scanner_logs')
 scanner_logger.setLevel(logging.INFO)
 # --- IMPORTANT CHANGE: Specify encoding='utf-8' for FileHandler ---
 scanner_handler = logging.FileHandler(SCANNER_LOG_FILE_PATH, encoding='utf-8')
-scanner_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-scanner_handler.setFormatter(scanner_formatter)
+log_format.configure_handler(scanner_handler)
+tracing.trace_handler(scanner_handler)
 # Ensure handlers are not duplicated
 if not scanner_logger.handlers:
     scanner_logger.addHandler(scanner_handler)
 
 
-def read_logs_from_file(file_path):
+# Search index over the log files, served by /api/logs/search
+log_search_index = log_index.LogIndex({
+    'server': SERVER_LOG_FILE_PATH,
+    'scanner': SCANNER_LOG_FILE_PATH,
+    'data_manager': DATA_MANAGER_LOG_FILE_PATH,
+})
+
+
+def read_logs_from_file(file_path, filters=None):
     """
-    Reads log entries from a specified file, parses them, and returns them
-    as a list of dictionaries, sorted by timestamp (latest first).
-    Assumes log format from logging.Formatter: "YYYY-MM-DD HH:MM:SS,ms - LEVELNAME - Message"
+    Reads log entries from a specified file and returns them as a list of dictionaries,
+    sorted by timestamp (latest first).
+    Lines may be text ("YYYY-MM-DD HH:MM:SS,ms - LEVELNAME - Message") or JSONL records (see
+    log_format.py); neither needs date parsing, as both carry a timestamp string that sorts
+    chronologically. Lines that do not start an entry, such as traceback lines of a text log, are
+    appended to the previous entry's message.
+    filters maps 'level' or a structured field (e.g. 'barcode', 'route') to the value entries must have;
+    text entries have no structured fields, so they only match level filters.
     """
     logs = []
+    filters = filters or {}
     if not os.path.exists(file_path):
         # Using print here as the loggers might not be fully available for this specific error check
         print(f"Warning: Log file not found at {file_path}")
@@ -56,34 +90,26 @@ def read_logs_from_file(file_path):
     try:
         # --- IMPORTANT: Ensure reading with utf-8 encoding as well ---
         with open(file_path, 'r', encoding='utf-8') as f:
+            entry = None
             for line in f:
-                line = line.strip()
-                if not line:
+                line = line.rstrip('\n')
+                if not line.strip():
                     continue
 
-                try:
-                    # Expected format example: "2025-06-16 23:42:15,123 - INFO - Server started."
-                    # Split into three main parts: timestamp, level, message
-                    parts = line.split(' - ', 2)
-                    if len(parts) == 3:
-                        timestamp_str_with_ms = parts[0]
-                        level = parts[1].lower()  # Convert to lowercase for CSS consistency
-                        message = parts[2]
-
-                        # Parse timestamp with milliseconds
-                        timestamp_obj = datetime.strptime(timestamp_str_with_ms, "%Y-%m-%d %H:%M:%S,%f")
-
-                        logs.append({
-                            "timestamp": timestamp_str_with_ms,  # Keep original string for display
-                            "level": level,
-                            "message": message
-                        })
+                parsed = log_format.parse_log_line(line)
+                if parsed is None:
+                    if entry is not None:
+                        entry['message'] += '\n' + line
                     else:
                         print(f"Warning: Malformed log line (expected 3 parts separated by ' - '): '{line}'")
-                except ValueError as e:
-                    print(f"Warning: Could not parse log line timestamp or format: '{line}' - Error: {e}")
-                except Exception as e:
-                    print(f"Warning: Unexpected error processing log line: '{line}' - Error: {e}")
+                    continue
+
+                entry = {"timestamp": parsed['timestamp'], "level": parsed['level'], "message": parsed['message']}
+                if parsed['fields']:
+                    entry['fields'] = parsed['fields']
+                if all(str(entry['level'] if key == 'level' else parsed['fields'].get(key)) == value
+                       for key, value in filters.items()):
+                    logs.append(entry)
 
     except IOError as e:
         print(f"Error reading file {file_path}: {e}")
@@ -92,8 +118,8 @@ def read_logs_from_file(file_path):
         print(f"An unexpected error occurred: {e}")
         return []
 
-    # Sort logs by the parsed datetime object in descending order (latest first)
-    return sorted(logs, key=lambda x: datetime.strptime(x['timestamp'], "%Y-%m-%d %H:%M:%S,%f"), reverse=True)
+    # Sort logs by timestamp in descending order (latest first)
+    return sorted(logs, key=lambda x: x['timestamp'], reverse=True)
 
 
 def create_initial_logs_if_empty():
@@ -123,7 +149,7 @@ def create_initial_logs_if_empty():
 @app.route('/')
 def index():
     server_logger.info('Accessed index page.')
-    return render_template('dash.html')
+    return static_assets.render_page_shell('dash.html')
 
 
 @app.route('/test')
@@ -135,7 +161,7 @@ def test():
 @app.route('/products')
 def products_page():
     server_logger.info('Accessed products page.')
-    return render_template('products.html')
+    return static_assets.render_page_shell('products.html')
 
 
 
@@ -144,13 +170,15 @@ def products_page():
 def tracking_page():
     product_name = request.args.get('name')
     barcode = request.args.get('barcode')
+    product_id = request.args.get('id')
 
-    if barcode:
-        server_logger.info(f'Accessed tracking page for product: {product_name} (Barcode: {barcode}).')
-        return render_template('tracking.html', show_details=True, product_name=product_name, barcode=barcode)
+    if barcode or product_id:
+        server_logger.info(f'Accessed tracking page for product: {product_name} (ID: {product_id}, Barcode: {barcode}).')
+        return static_assets.render_page_shell('tracking.html', show_details=True, product_name=product_name,
+                                               barcode=barcode)
     else:
         server_logger.info('Accessed general tracking page (no specific barcode provided).')
-        return render_template('tracking.html', show_details=False)
+        return static_assets.render_page_shell('tracking.html', show_details=False)
 
 
 @app.route('/scan', methods=['POST'])
@@ -158,7 +186,7 @@ def scan_barcode():
     payload = request.json
     barcode = payload.get('barcode')
     if barcode:
-        scanner_logger.info(f"Scanned barcode via '/scan' endpoint: {barcode}")
+        scanner_logger.info(f"Scanned barcode via '/scan' endpoint: {barcode}", extra={'barcode': barcode})
         return jsonify({"success": True, "message": "Barcode logged"}), 200
     scanner_logger.error("Failed to log barcode via '/scan' endpoint: No barcode provided.")
     return jsonify({"error": "No barcode provided"}), 400
@@ -166,15 +194,8 @@ def scan_barcode():
 
 # --- API Endpoints SCANNER---
 
-@app.route('/api/scanner/add_product', methods=['POST'])
-def scanner_add_product():
-    payload = request.json
-    barcode = payload.get('barcode')
-
-    if not barcode:
-        scanner_logger.error("Failed to add product (scanner): Barcode is missing in payload.")
-        return jsonify({"success": False, "error": "Barcode is missing"}), 400
-
+def add_scanned_product(barcode):
+    """Adds one unit of the scanned product to the shopping list. Returns (response body, status code)."""
     try:
         product_name_from_master, product_details_from_master = data_manager.get_product_from_master_by_barcode(barcode)
 
@@ -184,8 +205,8 @@ def scanner_add_product():
             quantity = 1
 
             data_manager.add_shopping_item(name, quantity, category, barcode)
-            scanner_logger.info(f"Product '{name}' (barcode: {barcode}) added/updated in shopping list by scanner.")
-            return jsonify({"success": True, "message": f"Product '{name}' added/updated in shopping list."})
+            scanner_logger.info(f"Product '{name}' (barcode: {barcode}) added/updated in shopping list by scanner.", extra={'barcode': barcode})
+            return {"success": True, "message": f"Product '{name}' added/updated in shopping list."}, 200
         else:
             default_name = f"מוצר חדש נסרק באמצעות ברקוד: {barcode}"
             default_category = "לא מקוטלג"
@@ -194,16 +215,97 @@ def scanner_add_product():
 
             if not success_master_add:
                 scanner_logger.error(
-                    f"Failed to add new product '{default_name}' (barcode: {barcode}) to master list by scanner.")
-                return jsonify({"success": False, "error": "Failed to add new product to master list."}), 500
+                    f"Failed to add new product '{default_name}' (barcode: {barcode}) to master list by scanner.", extra={'barcode': barcode})
+                return {"success": False, "error": "Failed to add new product to master list."}, 500
 
             data_manager.add_shopping_item(default_name, 1, default_category, barcode)
             scanner_logger.info(
-                f"New product '{default_name}' (barcode: {barcode}) added to master and shopping list by scanner.")
-            return jsonify(
-                {"success": True, "message": f"New product '{default_name}' added to master and shopping list."})
+                f"New product '{default_name}' (barcode: {barcode}) added to master and shopping list by scanner.", extra={'barcode': barcode})
+            return {"success": True, "message": f"New product '{default_name}' added to master and shopping list."}, 200
     except Exception as e:
-        scanner_logger.error(f"Error in scanner_add_product for barcode {barcode}: {e}", exc_info=True)
+        scanner_logger.error(f"Error in scanner_add_product for barcode {barcode}: {e}", exc_info=True, extra={'barcode': barcode})
+        return {"success": False, "error": f"An unexpected error occurred: {e}"}, 500
+
+
+def flush_scan_burst(burst_key, extra_scans):
+    """
+    Called when a burst of repeated scans closes; applies the extra scans as a single quantity update.
+    Bursts are keyed by (tenant, barcode), as the flush runs on a timer thread outside the request.
+    """
+    tenant, barcode = burst_key
+    if not scan_coalescer.SCAN_BURST_SUMS_QUANTITY:
+        scanner_logger.info(f"Ignored {extra_scans} duplicate scans of barcode {barcode} (scanner burst).", extra={'barcode': barcode})
+        return
+    try:
+        with tenants.use_tenant(tenant):
+            name, details = data_manager.get_product_from_master_by_barcode(barcode)
+            if details:
+                data_manager.add_shopping_item(name, extra_scans, details.get('category', 'לא מקוטלג'), barcode)
+        if details:
+            scanner_logger.info(f"Added {extra_scans} coalesced scans of '{name}' (barcode: {barcode}) in one update.", extra={'barcode': barcode})
+        else:
+            scanner_logger.error(f"Failed to flush {extra_scans} coalesced scans: barcode {barcode} not in master list.", extra={'barcode': barcode})
+    except Exception as e:
+        scanner_logger.error(f"Error flushing coalesced scans for barcode {barcode}: {e}", exc_info=True, extra={'barcode': barcode})
+
+
+scan_bursts = scan_coalescer.ScanCoalescer(flush_scan_burst)
+scan_responses = scan_coalescer.IdempotencyStore()
+
+
+@app.route('/api/scanner/add_product', methods=['POST'])
+def scanner_add_product():
+    payload = request.json
+    barcode = catalogue_store.normalize_barcode(payload.get('barcode'))
+    # Scanners resend after timeouts; the same key gets the same answer without touching the databases
+    idempotency_key = request.headers.get('Idempotency-Key') or payload.get('idempotency_key')
+
+    if not barcode:
+        scanner_logger.error("Failed to add product (scanner): Barcode is missing in payload.")
+        return jsonify({"success": False, "error": "Barcode is missing"}), 400
+
+    burst_key = (tenants.get_current_tenant(), barcode)
+    if idempotency_key:
+        idempotency_key = f"{burst_key[0]}:{idempotency_key}"
+        try:
+            # Claimed before processing, so a resend arriving meanwhile waits for this response
+            replayed = scan_responses.reserve(idempotency_key)
+        except scan_coalescer.RequestInProgress:
+            scanner_logger.error(f"Scan of barcode {barcode} resent while the original is still being processed.",
+                                 extra={'barcode': barcode})
+            return jsonify({"success": False, "error": "A request with this idempotency key is still in progress"}), 409
+        if replayed is not None:
+            body, status = replayed
+            return jsonify({**body, "replayed": True}), status
+
+    status = 500
+    try:
+        if scan_bursts.submit(burst_key):
+            body, status = add_scanned_product(barcode)
+            if status != 200:
+                scan_bursts.discard(burst_key)
+        else:
+            body, status = {"success": True, "coalesced": True,
+                            "message": f"Repeated scan of barcode {barcode} merged into the previous scan."}, 200
+    finally:
+        if idempotency_key and status == 200:
+            scan_responses.put(idempotency_key, (body, status))
+        elif idempotency_key:
+            scan_responses.release(idempotency_key)  # Failed: a resend is processed again
+    return jsonify(body), status
+
+
+@app.route('/api/scanner/dictionary', methods=['GET'])
+def scanner_dictionary_download():
+    """
+    Barcode -> (name, category) dictionary scanners resolve scans with locally. With ?since=<version> only
+    the changes since that version are sent (see scanner_dictionary for the format).
+    """
+    since = request.args.get('since')
+    try:
+        return scanner_dictionary.serve_dictionary(since)
+    except Exception as e:
+        scanner_logger.error(f"Error serving the scanner dictionary (since: {since}): {e}", exc_info=True)
         return jsonify({"success": False, "error": f"An unexpected error occurred: {e}"}), 500
 
 
@@ -231,19 +333,34 @@ def get_shopping_list():
     try:
         data = data_manager.get_all_shopping_items()
         server_logger.info("Successfully retrieved shopping list.")
+        if wire_format.wants_columnar(request.args):
+            return jsonify(wire_format.encode_columnar(wire_format.products_to_records(data['products']),
+                                                       ['id', 'name', 'quantity', 'category', 'barcode', 'done'],
+                                                       dictionary_columns=['category']))
         return jsonify(data)
     except Exception as e:
         server_logger.error(f"Failed to retrieve shopping list: {e}", exc_info=True)
         return jsonify({"error": f"Failed to retrieve shopping list: {e}"}), 500
 
 
+@app.route('/api/shoppinglist/grouped')
+def get_grouped_shopping_list():
+    try:
+        data = data_manager.get_grouped_shopping_items()
+        server_logger.info("Successfully retrieved grouped shopping list.")
+        return jsonify(data)
+    except Exception as e:
+        server_logger.error(f"Failed to retrieve grouped shopping list: {e}", exc_info=True)
+        return jsonify({"error": f"Failed to retrieve grouped shopping list: {e}"}), 500
+
+
 @app.route('/api/add_product', methods=['POST'])
 def add_product():
     payload = request.json
     name = payload.get('name')
     quantity = int(payload.get('quantity', 1))
     category = payload.get('category')
-    barcode = payload.get('barcode', '').strip()
+    barcode = catalogue_store.normalize_barcode(payload.get('barcode')).strip()
 
     if not name or not category:
         server_logger.error(f"Failed to add product: Missing product name ({name}) or category ({category}).")
@@ -296,15 +413,14 @@ def update_product():
                 server_logger.error(f"Failed to update done status for product '{name}'. Product not found.")
                 return jsonify({"error": "Product not found or failed to update status"}), 404
 
-            shopping_data = data_manager.get_all_shopping_items()
-            product_in_shopping = shopping_data['products'].get(name)
+            # Price history is keyed by product ID, so products without a barcode are tracked too
+            product_id = data_manager.get_product_id_by_name(name)
 
-            if product_in_shopping and product_in_shopping.get('barcode'):
-                barcode_for_tracking = product_in_shopping['barcode']
+            if product_id:
                 if done_status and price is not None and price != "":
-                    data_manager.record_product_price_entry(name, barcode_for_tracking, price)
+                    data_manager.record_product_price_entry(product_id, price)
                     server_logger.info(
-                        f"Product '{name}' marked as done and price '{price}' recorded (Barcode: {barcode_for_tracking}).")
+                        f"Product '{name}' marked as done and price '{price}' recorded (ID: {product_id}).")
                     return jsonify({"success": True, "message": "Product status and price updated"})
                 elif done_status:
                     server_logger.info(f"Product '{name}' marked as done (no price provided).")
@@ -313,9 +429,9 @@ def update_product():
                     server_logger.info(f"Product '{name}' marked as undone.")
                     return jsonify({"success": True, "message": "Product status updated"})
             else:
-                server_logger.warning(f"Product '{name}' status updated, but barcode not found for tracking.")
+                server_logger.warning(f"Product '{name}' status updated, but product not found for tracking.")
                 return jsonify(
-                    {"success": True, "message": "Product status updated, but barcode not found for tracking"}), 200
+                    {"success": True, "message": "Product status updated, but product not found for tracking"}), 200
 
         server_logger.error(f"Failed to update product '{name}': No valid update operation specified.")
         return jsonify({"error": "No valid update operation specified"}), 400
@@ -360,77 +476,141 @@ def clear_done_products():
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
 
+@app.route('/api/checkout', methods=['POST'])
+def checkout():
+    """
+    Finalizes a shopping trip: {"items": [{"name", "price", "quantity"}, ...], "clear_done": false}
+    (or just the list of items). Marks the items done, records their prices and returns the trip total.
+    """
+    payload = request.json
+    if isinstance(payload, list):
+        payload = {"items": payload}
+    items = (payload or {}).get('items')
+    clear_done = bool((payload or {}).get('clear_done', False))
+
+    if not isinstance(items, list) or not items:
+        server_logger.error("Failed to check out: Missing items.")
+        return jsonify({"error": "Missing items"}), 400
+
+    checkout_items = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('name'):
+            server_logger.error(f"Failed to check out: Item without a product name ({item}).")
+            return jsonify({"error": "Every item needs a product name"}), 400
+        price, quantity = item.get('price'), item.get('quantity')
+        try:
+            checkout_items.append({
+                "name": item['name'],
+                "price": float(price) if price is not None and price != "" else None,
+                "quantity": int(quantity) if quantity is not None and quantity != "" else None,
+            })
+        except (TypeError, ValueError):
+            server_logger.error(f"Failed to check out: Invalid price ({price}) or quantity ({quantity}) for '{item['name']}'.")
+            return jsonify({"error": f"Invalid price or quantity for '{item['name']}'"}), 400
+
+    try:
+        result = data_manager.checkout_shopping_items(checkout_items, clear_done=clear_done)
+        if result is None:
+            server_logger.error(f"Failed to check out {len(checkout_items)} items.")
+            return jsonify({"error": "Failed to check out"}), 500
+        server_logger.info(
+            f"Checked out {result['checked_out']} items, total {result['total']}"
+            f"{' (not in master list: ' + ', '.join(result['missing']) + ')' if result['missing'] else ''}.")
+        return jsonify({"success": True, **result})
+    except Exception as e:
+        server_logger.error(f"Error checking out: {e}", exc_info=True)
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+
 @app.route('/api/product_tracking')
 def get_product_tracking():
+    product_id = request.args.get('id')
     barcode = request.args.get('barcode')
     product_name_from_url = request.args.get('name')
 
-    if not barcode:
-        server_logger.error("Failed to get product tracking: Barcode not provided.")
-        return jsonify({"error": "Barcode not provided"}), 400
+    if not product_id and not barcode:
+        server_logger.error("Failed to get product tracking: Product ID or barcode not provided.")
+        return jsonify({"error": "Product ID or barcode not provided"}), 400
 
     try:
-        product_master_name, product_details_from_master = data_manager.get_product_from_master_by_barcode(barcode)
+        if product_id:
+            product_master_name, product_details_from_master = data_manager.get_product_from_master_by_id(product_id)
+        else:
+            product_master_name, product_details_from_master = data_manager.get_product_from_master_by_barcode(barcode)
 
         if not product_details_from_master and product_name_from_url:
             product_master_name, product_details_from_master = data_manager.get_product_from_master_by_name(
                 product_name_from_url)
             if product_details_from_master and not product_details_from_master.get('barcode') and barcode:
-                products_master_data = data_manager._load_db(data_manager.PRODUCTS_MASTER_DB)
-                products_master_data['products'][product_master_name]['barcode'] = barcode
-                data_manager._save_db(data_manager.PRODUCTS_MASTER_DB, products_master_data)
+                data_manager.add_product_to_master(product_master_name, barcode)
                 product_details_from_master['barcode'] = barcode
                 server_logger.info(
                     f"Updated barcode for product '{product_master_name}' in master list to '{barcode}'.")
 
         display_name = product_master_name if product_master_name else product_name_from_url if product_name_from_url else 'שם לא ידוע'
 
-        if not product_details_from_master or not product_details_from_master.get('barcode'):
-            server_logger.error(
-                f"Product with barcode '{barcode}' not found or has no associated barcode for tracking.")
-            return jsonify({"error": "Product not found or has no associated barcode for tracking"}), 404
+        if product_details_from_master:
+            product_id = product_details_from_master['id']
+            tracking_history, name_from_tracking_db = data_manager.get_tracking_history(product_id)
+        elif barcode:
+            # The product may have been deleted from the master list while its price history was kept
+            tracking_history, name_from_tracking_db = data_manager.get_tracking_history_by_barcode(barcode)
+        else:
+            tracking_history, name_from_tracking_db = data_manager.get_tracking_history(product_id)
 
-        tracking_history, name_from_tracking_db = data_manager.get_tracking_history_by_barcode(barcode)
+        if not product_details_from_master and not tracking_history:
+            server_logger.error(
+                f"Product (ID: {product_id}, Barcode: {barcode}) not found in master list or tracking data.")
+            return jsonify({"error": "Product not found"}), 404
 
         final_display_name = name_from_tracking_db if name_from_tracking_db != 'שם לא ידוע' else display_name
+        final_barcode = product_details_from_master.get('barcode', '') if product_details_from_master else barcode or ''
         server_logger.info(
-            f"Successfully retrieved tracking history for product '{final_display_name}' (Barcode: {barcode}).")
+            f"Successfully retrieved tracking history for product '{final_display_name}' (ID: {product_id}, Barcode: {final_barcode}).")
         return jsonify({
             "tracking": tracking_history,
             "name": final_display_name,
-            "barcode": barcode
+            "id": product_id,
+            "barcode": final_barcode
         })
     except Exception as e:
-        server_logger.error(f"Error retrieving product tracking for barcode '{barcode}': {e}", exc_info=True)
+        server_logger.error(
+            f"Error retrieving product tracking for product (ID: {product_id}, Barcode: {barcode}): {e}", exc_info=True)
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
 
 @app.route('/api/record_product_price', methods=['POST'])
 def record_product_price():
     payload = request.json
+    product_id = payload.get('id')
     barcode = payload.get('barcode')
     price = payload.get('price')
 
-    if not all([barcode, price is not None]):
-        server_logger.error("Failed to record product price: Missing barcode or price.")
-        return jsonify({"error": "Missing barcode or price"}), 400
+    if not all([product_id or barcode, price is not None]):
+        server_logger.error("Failed to record product price: Missing product ID/barcode or price.")
+        return jsonify({"error": "Missing product ID/barcode or price"}), 400
 
     try:
-        product_name, product_details = data_manager.get_product_from_master_by_barcode(barcode)
+        if product_id:
+            product_name, product_details = data_manager.get_product_from_master_by_id(product_id)
+        else:
+            product_name, product_details = data_manager.get_product_from_master_by_barcode(barcode)
         if not product_details:
-            server_logger.error(f"Failed to record price for barcode '{barcode}': Product not found in master list.")
-            return jsonify({"error": "Product not found with this barcode in master list"}), 404
+            server_logger.error(
+                f"Failed to record price for product (ID: {product_id}, Barcode: {barcode}): Product not found in master list.")
+            return jsonify({"error": "Product not found in master list"}), 404
 
-        success = data_manager.record_product_price_entry(product_name, barcode, price)
+        success = data_manager.record_product_price_entry(product_details['id'], price)
         if success:
             server_logger.info(
-                f"Price '{price}' recorded successfully for product '{product_name}' (Barcode: {barcode}).")
+                f"Price '{price}' recorded successfully for product '{product_name}' (ID: {product_details['id']}).")
             return jsonify({"success": True, "message": "Price recorded successfully"})
         else:
-            server_logger.error(f"Failed to record price '{price}' for product '{product_name}' (Barcode: {barcode}).")
+            server_logger.error(f"Failed to record price '{price}' for product '{product_name}' (ID: {product_details['id']}).")
             return jsonify({"error": "Failed to record price"}), 500
     except Exception as e:
-        server_logger.error(f"Error recording product price for barcode '{barcode}': {e}", exc_info=True)
+        server_logger.error(
+            f"Error recording product price for product (ID: {product_id}, Barcode: {barcode}): {e}", exc_info=True)
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
 
 
@@ -439,6 +619,9 @@ def get_all_products():
     try:
         products_data = data_manager.get_all_products_from_master()
         server_logger.info("Successfully retrieved all products from master list.")
+        if wire_format.wants_columnar(request.args):
+            return jsonify(wire_format.encode_columnar(products_data['products'], ['id', 'name', 'barcode', 'category'],
+                                                       dictionary_columns=['category']))
         return jsonify(products_data)
     except Exception as e:
         server_logger.error(f"Failed to retrieve all products from master list: {e}", exc_info=True)
@@ -519,12 +702,12 @@ def process_scanned_barcode():
                 "message": "Barcode already associated with an existing product."
             }
             server_logger.info(
-                f"Processed scanned barcode '{scanned_barcode}': Found existing product '{existing_product_name}'.")
+                f"Processed scanned barcode '{scanned_barcode}': Found existing product '{existing_product_name}'.", extra={'barcode': scanned_barcode})
             return jsonify(product)
         else:
             if not product_name:
                 server_logger.info(
-                    f"Processed scanned barcode '{scanned_barcode}': Barcode is new, product name required to add.")
+                    f"Processed scanned barcode '{scanned_barcode}': Barcode is new, product name required to add.", extra={'barcode': scanned_barcode})
                 return jsonify({
                     "success": True,
                     "exists": False,
@@ -536,7 +719,7 @@ def process_scanned_barcode():
                 success = data_manager.add_product_to_master(product_name, scanned_barcode, category=category)
                 if success:
                     server_logger.info(
-                        f"Processed scanned barcode '{scanned_barcode}': New product '{product_name}' added to master.")
+                        f"Processed scanned barcode '{scanned_barcode}': New product '{product_name}' added to master.", extra={'barcode': scanned_barcode})
                     return jsonify({
                         "success": True,
                         "exists": False,
@@ -547,13 +730,93 @@ def process_scanned_barcode():
                     })
                 else:
                     server_logger.error(
-                        f"Failed to process scanned barcode '{scanned_barcode}': Failed to add new product '{product_name}'.")
+                        f"Failed to process scanned barcode '{scanned_barcode}': Failed to add new product '{product_name}'.", extra={'barcode': scanned_barcode})
                     return jsonify({"success": False, "error": "Failed to add new product."}), 500
     except Exception as e:
-        server_logger.error(f"Error processing scanned barcode '{scanned_barcode}': {e}", exc_info=True)
+        server_logger.error(f"Error processing scanned barcode '{scanned_barcode}': {e}", exc_info=True, extra={'barcode': scanned_barcode})
         return jsonify({"success": False, "error": f"An unexpected error occurred: {e}"}), 500
 
 
+@app.route('/api/suggestions/restock')
+def get_restock_suggestions():
+    """Products that are probably running low, judging by how often they are usually bought. Query arg: limit."""
+    try:
+        limit = int(request.args.get('limit', 0)) or None
+        suggestions = data_manager.get_restock_suggestions(limit)
+        server_logger.info(f"Retrieved {len(suggestions)} restock suggestions.")
+        return jsonify({"suggestions": suggestions})
+    except ValueError as e:
+        return jsonify({"error": f"Invalid limit: {e}"}), 400
+    except Exception as e:
+        server_logger.error(f"Failed to retrieve restock suggestions: {e}", exc_info=True)
+        return jsonify({"error": f"Failed to retrieve restock suggestions: {e}"}), 500
+
+
+@app.route('/api/alerts')
+def get_price_alerts():
+    """Price alerts fired by the watchlist rules, oldest first. Query args: since (last alert ID seen), limit."""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', 0)) or None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid since or limit: {e}"}), 400
+    try:
+        alerts = data_manager.get_price_alerts(since, limit)
+        return jsonify({"alerts": alerts, "last_id": alerts[-1]['id'] if alerts else since})
+    except Exception as e:
+        server_logger.error(f"Failed to retrieve price alerts: {e}", exc_info=True)
+        return jsonify({"error": f"Failed to retrieve price alerts: {e}"}), 500
+
+
+@app.route('/api/alerts/rules', methods=['GET', 'POST'])
+def price_alert_rules():
+    """
+    GET lists the watchlist rules. POST adds one rule or a list of them (also as {"rules": [...]}):
+    {"product_id" or "barcode", "type": "change", "percent": X} fires when a recorded price differs from
+    the product's rolling average by X% or more; {"type": "above" | "below", "threshold": T} fires when
+    a recorded price crosses T in that direction.
+    """
+    if request.method == 'GET':
+        return jsonify({"rules": data_manager.get_price_alert_rules()})
+
+    payload = request.json
+    if isinstance(payload, dict) and 'rules' in payload:
+        payload = payload['rules']
+    payloads = payload if isinstance(payload, list) else [payload]
+    try:
+        rules = []
+        for rule in payloads:
+            if isinstance(rule, dict) and not rule.get('product_id') and rule.get('barcode'):
+                rule = dict(rule, product_id=data_manager.get_product_id_by_barcode(str(rule['barcode']).strip()) or '')
+                if not rule['product_id']:
+                    return jsonify({"success": False, "error": f"Unknown barcode: {rule['barcode']}"}), 404
+            rules.append(price_alerts.parse_rule(rule))
+    except ValueError as e:
+        server_logger.error(f"Failed to add price alert rules: {e}")
+        return jsonify({"success": False, "error": f"Invalid rule: {e}"}), 400
+
+    result = data_manager.add_price_alert_rules(rules)
+    if result is None:
+        server_logger.error(f"Failed to add {len(rules)} price alert rules.")
+        return jsonify({"success": False, "error": "Failed to add price alert rules"}), 500
+    server_logger.info(f"Added {len(result['added'])} price alert rules.")
+    return jsonify({"success": True, **result})
+
+
+@app.route('/api/alerts/delete_rule', methods=['POST'])
+def delete_price_alert_rule():
+    payload = request.json
+    rule_id = payload.get('id')
+    if not rule_id:
+        server_logger.error("Failed to delete price alert rule: Rule ID is missing.")
+        return jsonify({"success": False, "error": "Rule ID is missing"}), 400
+    if data_manager.delete_price_alert_rule(rule_id):
+        server_logger.info(f"Deleted price alert rule '{rule_id}'.")
+        return jsonify({"success": True, "message": "Rule deleted"})
+    server_logger.error(f"Failed to delete price alert rule '{rule_id}'.")
+    return jsonify({"success": False, "error": "Rule not found or could not be deleted"}), 404
+
+
 @app.route('/api/categories')
 def get_categories():
     try:
@@ -597,34 +860,101 @@ def update_product_name_category():
 @app.route('/logs/server')
 def get_server_logs_page():
     """Renders the HTML page for server logs."""
-    return render_template('server_logs.html', log_type='server')
+    return static_assets.render_page_shell('server_logs.html', log_type='server')
 
 
 @app.route('/logs/scanner')
 def get_scanner_logs_page():
     """Renders the HTML page for scanner logs."""
-    return render_template('scanner_logs.html', log_type='scanner')
+    return static_assets.render_page_shell('scanner_logs.html', log_type='scanner')
+
+
+@app.route('/logs/slow')
+def get_slow_request_logs_page():
+    """Renders the HTML page for slow request traces."""
+    return static_assets.render_page_shell('slow_logs.html', log_type='slow',
+                                           threshold_ms=tracing.SLOW_REQUEST_THRESHOLD_MS,
+                                           sample_rate=tracing.TRACE_SAMPLE_RATE)
 
 
 # --- API Endpoints for Log Data (New) ---
+# Query arguments the log endpoints filter on: the level and the structured fields records carry (from
+# extra= and the request context). Other arguments, such as format or tenant, are not log fields.
+LOG_FILTER_FIELDS = ('level', 'logger', 'barcode', 'product_id', 'route', 'method', 'status')
+
+
+def log_filters():
+    """Field filters for the log endpoints, from the query arguments named in LOG_FILTER_FIELDS."""
+    return {key: value for key, value in request.args.items() if key in LOG_FILTER_FIELDS}
+
+
+def logs_response(logs, columns=('timestamp', 'level', 'message', 'fields')):
+    """
+    Returns log entries as JSON, in the columnar shape if the client asked for it. The columnar shape
+    carries the same keys as the rows; a null "fields" stands for an entry without structured fields.
+    """
+    if wire_format.wants_columnar(request.args):
+        dictionary_columns = [column for column in ('level', 'source') if column in columns]
+        return jsonify(wire_format.encode_columnar(logs, columns, dictionary_columns=dictionary_columns))
+    return jsonify(logs)
+
+
 @app.route('/api/logs/server')
 def get_server_logs_json():
     """Reads server logs from file and returns as JSON."""
-    logs = read_logs_from_file(SERVER_LOG_FILE_PATH)
-    return jsonify(logs)
+    logs = read_logs_from_file(SERVER_LOG_FILE_PATH, log_filters())
+    return logs_response(logs)
 
 
 @app.route('/api/logs/scanner')
 def get_scanner_logs_json():
     """Reads scanner logs from file and returns as JSON."""
-    logs = read_logs_from_file(SCANNER_LOG_FILE_PATH)
-    return jsonify(logs)
+    logs = read_logs_from_file(SCANNER_LOG_FILE_PATH, log_filters())
+    return logs_response(logs)
+
+
+@app.route('/api/logs/search')
+def search_logs_json():
+    """
+    Searches the server, scanner and data manager logs through the log index.
+    Query args: q (words that must all appear), level, from/to (epoch seconds or ISO time),
+    source (comma-separated subset of server,scanner,data_manager) and limit.
+    """
+    try:
+        sources = [source for source in request.args.get('source', '').split(',') if source] or None
+        limit = min(int(request.args.get('limit', log_index.LOG_SEARCH_MAX_RESULTS)), log_index.LOG_SEARCH_MAX_RESULTS)
+        results = log_search_index.search(request.args.get('q', ''), level=request.args.get('level') or None,
+                                          start=log_index.parse_time_arg(request.args.get('from')),
+                                          end=log_index.parse_time_arg(request.args.get('to')),
+                                          sources=sources, limit=limit)
+        return logs_response(results, columns=('source', 'timestamp', 'level', 'message', 'fields'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid search parameter: {e}"}), 400
+    except Exception as e:
+        server_logger.error(f"Error searching logs: {e}", exc_info=True)
+        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+
+
+@app.route('/api/logs/slow')
+def get_slow_request_logs_json():
+    """Reads slow request traces from file and returns as JSON."""
+    logs = read_logs_from_file(tracing.SLOW_REQUEST_LOG_FILE_PATH, log_filters())
+    return logs_response(logs)
 
 
 if __name__ == '__main__':
     # Call to write initial logs if files are empty
     create_initial_logs_if_empty()
 
+    # Restore parsed databases and indexes from the binary snapshot (rebuilding only stale ones)
+    data_manager.warm_start()
+    atexit.register(data_manager.write_snapshot)
+    atexit.register(data_manager.close_tenant_stores)
+    atexit.register(scan_bursts.flush_all)
+    # docker stop (and restart: always) sends SIGTERM, which skips atexit; exit normally so the hooks above run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    log_search_index.start_tailing()
+
     server_logger.info("Flask application starting...")
     app.run(debug=True, host="0.0.0.0", port=5000)
     server_logger.info("Flask application shut down.")
@@ -0,0 +1,206 @@
+"""
+ASGI entry point. Serves the Flask routes of app.py plus a few ASGI-native endpoints for long-lived
+connections, e.g.:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Flask views still run in worker threads, but only for as long as the view itself runs: request bodies
+are received and responses are sent by the event loop, so a slow phone on store Wi-Fi holds a socket
+rather than a thread. Server-sent event listeners never use a thread at all.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import async_data_manager
+import data_manager
+import tenants
+from app import app, create_initial_logs_if_empty, log_search_index, scan_bursts, server_logger
+
+# --- ASGI Configuration ---
+# Worker threads running Flask views. Connections beyond this many wait on the event loop, not in a thread.
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '8'))
+# Seconds between keep-alive comments on idle event streams (keeps proxies from closing them).
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+
+
+class WsgiAdapter:
+    """Runs a WSGI application for ASGI HTTP requests, in a bounded pool of worker threads."""
+
+    def __init__(self, wsgi_app, max_workers=ASGI_WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        environ = self._environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(self.executor, self._run, environ)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _run(self, environ):
+        """Calls the WSGI application and collects its whole response (runs in a worker thread)."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+    @staticmethod
+    def _environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        client_host, client_port = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client_host,
+            'REMOTE_PORT': str(client_port),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+# --- ASGI-native Endpoints ---
+
+# One change feed per shopping list file that has listeners
+shopping_list_feeds = {}
+
+
+def request_tenant(scope):
+    """The tenant an ASGI request names, looked up like tenants.init_app does for Flask requests."""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    cookie = SimpleCookie(headers.get('cookie', '')).get(tenants.TENANT_COOKIE)
+    return (headers.get(tenants.TENANT_HEADER.lower()) or query.get('tenant', [None])[0]
+            or (cookie.value if cookie else None) or tenants.DEFAULT_TENANT)
+
+
+async def shopping_list_events(scope, receive, send):
+    """
+    Server-sent events with the grouped shopping list (the /api/shoppinglist/grouped payload):
+    sent once on connect and again after every change to the shopping list.
+    """
+    tenant = request_tenant(scope)
+    if not tenants.is_valid_tenant(tenant):
+        await send({'type': 'http.response.start', 'status': 400, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Invalid tenant ID'})
+        return
+    tenants.set_current_tenant(tenant)  # This task's context only; data calls made from it inherit the tenant
+    shopping_list_path = tenants.tenant_path(tenant, data_manager.SHOPPING_ITEMS_DB)
+    changes = shopping_list_feeds.get(shopping_list_path)
+    if changes is None:
+        changes = shopping_list_feeds[shopping_list_path] = async_data_manager.ChangeFeed(shopping_list_path)
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        async with changes:
+            while not disconnected.is_set():
+                token = changes.token()  # Before reading, so a change made meanwhile is sent next
+                grouped = await async_data_manager.get_grouped_shopping_items()
+                event = f"event: shoppinglist\ndata: {json.dumps(grouped, ensure_ascii=False)}\n\n"
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+                while not disconnected.is_set() and not await changes.wait(token, SSE_HEARTBEAT_SECONDS):
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+    except OSError:
+        pass  # Client went away mid-send
+    finally:
+        watcher.cancel()
+        if changes.listeners == 0:
+            shopping_list_feeds.pop(shopping_list_path, None)
+    server_logger.info("Shopping list event stream closed.")
+
+
+ASGI_ROUTES = {
+    '/api/events/shoppinglist': shopping_list_events,
+}
+
+
+# --- Application ---
+
+flask_adapter = WsgiAdapter(app)
+
+
+async def lifespan(receive, send):
+    """Runs the same startup and shutdown steps as `python app.py`."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            create_initial_logs_if_empty()
+            await async_data_manager.warm_start()
+            log_search_index.start_tailing()
+            server_logger.info("ASGI application starting...")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(scan_bursts.flush_all)
+            await async_data_manager.write_snapshot()
+            await asyncio.to_thread(data_manager.close_tenant_stores)
+            flask_adapter.executor.shutdown(wait=True)
+            server_logger.info("ASGI application shut down.")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return  # No websocket endpoints
+    handler = ASGI_ROUTES.get(scope['path'], flask_adapter)
+    await handler(scope, receive, send)
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import os
+import weakref
+
+import data_manager
+
+# --- Async Data Access Configuration ---
+# How often (seconds) change feeds check a database file for modifications made by any writer.
+CHANGE_POLL_INTERVAL_SECONDS = float(os.environ.get('CHANGE_POLL_INTERVAL_SECONDS', '1'))
+
+# Every call (file I/O included) runs in the default executor, so the event loop keeps serving other
+# connections meanwhile. data_manager is safe to enter from several threads: reads work on immutable
+# database versions without locking, and writes are serialized by its own write lock. Async writers
+# also queue on an asyncio lock first, so writers waiting their turn wait in the event loop instead of
+# each holding an executor thread blocked on the write lock.
+
+_write_locks = weakref.WeakKeyDictionary()  # event loop -> asyncio.Lock serializing its writers
+
+
+async def _call(func, *args, **kwargs):
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def _write_lock():
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+
+def _async_variant(func):
+    """Builds the awaitable counterpart of a data_manager function."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _call(func, *args, **kwargs)
+
+    return wrapper
+
+
+def _async_writer(func):
+    """Builds the awaitable counterpart of a data_manager function that modifies databases."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with _write_lock():
+            return await _call(func, *args, **kwargs)
+
+    return wrapper
+
+
+# --- Generic Load / Save ---
+
+async def load_db(db_path):
+    """Awaitable data_manager._load_db: returns the parsed (cached) database."""
+    return await _call(data_manager._load_db, db_path)
+
+
+async def save_db(db_path, data):
+    """Awaitable data_manager._save_db: writes the database and refreshes its cache entry."""
+    async with _write_lock():
+        return await _call(data_manager._save_db, db_path, data)
+
+
+# --- Awaitable Data Manager API ---
+# Same names, arguments and return values as the functions in data_manager. Functions that modify
+# databases are built with _async_writer.
+
+warm_start = _async_variant(data_manager.warm_start)
+write_snapshot = _async_variant(data_manager.write_snapshot)
+
+get_all_categories = _async_variant(data_manager.get_all_categories)
+add_category_if_not_exists = _async_writer(data_manager.add_category_if_not_exists)
+
+get_product_id_by_name = _async_variant(data_manager.get_product_id_by_name)
+get_product_id_by_barcode = _async_variant(data_manager.get_product_id_by_barcode)
+
+get_all_shopping_items = _async_variant(data_manager.get_all_shopping_items)
+get_grouped_shopping_items = _async_variant(data_manager.get_grouped_shopping_items)
+add_shopping_item = _async_writer(data_manager.add_shopping_item)
+update_shopping_item = _async_writer(data_manager.update_shopping_item)
+delete_shopping_item = _async_writer(data_manager.delete_shopping_item)
+clear_done_shopping_items = _async_writer(data_manager.clear_done_shopping_items)
+checkout_shopping_items = _async_writer(data_manager.checkout_shopping_items)
+
+get_product_from_master_by_barcode = _async_variant(data_manager.get_product_from_master_by_barcode)
+get_product_from_master_by_name = _async_variant(data_manager.get_product_from_master_by_name)
+get_product_from_master_by_id = _async_variant(data_manager.get_product_from_master_by_id)
+get_all_products_from_master = _async_variant(data_manager.get_all_products_from_master)
+add_product_to_master = _async_writer(data_manager.add_product_to_master)
+update_product_name_and_category = _async_writer(data_manager.update_product_name_and_category)
+update_product_in_master = _async_writer(data_manager.update_product_in_master)
+delete_product_from_master = _async_writer(data_manager.delete_product_from_master)
+
+record_product_price_entry = _async_writer(data_manager.record_product_price_entry)
+get_tracking_history = _async_variant(data_manager.get_tracking_history)
+get_tracking_history_by_barcode = _async_variant(data_manager.get_tracking_history_by_barcode)
+
+get_restock_suggestions = _async_variant(data_manager.get_restock_suggestions)
+
+
+# --- Change Notifications ---
+
+def _file_signature(db_path):
+    try:
+        st = os.stat(db_path)
+        return st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        return None
+
+
+class ChangeFeed:
+    """
+    Tells async listeners when a database file changes, whoever wrote it (a WSGI worker thread, this
+    module or another process). One polling task serves all listeners of a feed; it runs only while
+    somebody is listening.
+
+    A listener takes a token() before reading the file and then waits with it, so a change made while
+    it was reading (or sending what it read) ends its next wait at once instead of being missed.
+    """
+
+    def __init__(self, db_path, interval_seconds=CHANGE_POLL_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.interval_seconds = interval_seconds
+        self.signature = None
+        self._changed = None  # asyncio.Event set (and replaced) on every change
+        self._poller = None
+        self.listeners = 0
+
+    async def _poll(self):
+        while True:
+            signature = await asyncio.to_thread(_file_signature, self.db_path)
+            if signature != self.signature:
+                self.signature = signature
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+            await asyncio.sleep(self.interval_seconds)
+
+    def token(self):
+        """Marks the current state of the file, for wait() to wait for changes after it."""
+        return self._changed
+
+    async def wait(self, token=None, timeout=None):
+        """
+        Waits until the file changes after token was taken (after this call without a token).
+        Returns False if timeout (seconds) passed first.
+        """
+        changed = token if token is not None else self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def __aenter__(self):
+        if self.listeners == 0:
+            self.signature = _file_signature(self.db_path)
+            self._changed = asyncio.Event()
+            self._poller = asyncio.create_task(self._poll())
+        self.listeners += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.listeners -= 1
+        if self.listeners == 0:
+            self._poller.cancel()
+            self._poller = None
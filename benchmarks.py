@@ -0,0 +1,436 @@
+"""
+Performance benchmarks. Each one runs against a throwaway copy of the databases, never the real ones.
+
+    python benchmarks.py <benchmark> [options]
+
+Run `python benchmarks.py --help` for the list of benchmarks.
+"""
+import argparse
+import gc
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Helpers ---
+
+def make_workdir():
+    """Creates a temporary working directory holding a copy of the databases."""
+    workdir = tempfile.mkdtemp(prefix='shoppyscan-bench-')
+    source = os.path.join(REPO_DIR, 'databases')
+    if os.path.isdir(source):
+        shutil.copytree(source, os.path.join(workdir, 'databases'),
+                        ignore=shutil.ignore_patterns('state.snapshot*', '*.bak'))
+    return workdir
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def format_row(columns, widths):
+    return '  '.join(str(column).ljust(width) for column, width in zip(columns, widths))
+
+
+# --- Concurrent connections: threaded Werkzeug vs ASGI ---
+
+SERVER_COMMANDS = {
+    # Werkzeug's threaded server, as `python app.py` runs it (without the debug reloader)
+    'werkzeug': "from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)",
+    'asgi': "import uvicorn; uvicorn.run('asgi:application', host='127.0.0.1', port={port}, log_level='warning')",
+}
+
+
+def start_server(kind, port, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, LOG_INDEX_TAIL_INTERVAL_SECONDS='0')
+    process = subprocess.Popen([sys.executable, '-c', SERVER_COMMANDS[kind].format(port=port)], cwd=workdir,
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            get_request(port, '/test')
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def get_request(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def server_threads(process):
+    with open(f'/proc/{process.pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                return int(line.split()[1])
+    return None
+
+
+def open_slow_client(port):
+    """A client that sends its headers, then only part of its body, and keeps the connection open."""
+    client = socket.create_connection(('127.0.0.1', port), timeout=10)
+    client.sendall(b'POST /api/scanner/log HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n'
+                   b'Content-Length: 64\r\n\r\n{"content": "')
+    return client
+
+
+def bench_connections(args):
+    """
+    Holds N slow clients (partially sent request bodies, like phones on bad Wi-Fi) open against each
+    server, then measures the latency of regular requests and the number of server threads.
+    """
+    kinds = ['werkzeug', 'asgi']
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        print("uvicorn is not installed; only the Werkzeug server is measured (pip install uvicorn).")
+        kinds = ['werkzeug']
+
+    widths = [10, 14, 10, 15, 15]
+    print(format_row(['server', 'slow clients', 'threads', 'p50 latency', 'p95 latency'], widths))
+    for kind in kinds:
+        workdir = make_workdir()
+        port = free_port()
+        process = start_server(kind, port, workdir)
+        try:
+            for count in args.slow_clients:
+                clients = [open_slow_client(port) for _ in range(count)]
+                time.sleep(0.5)  # Let the server accept them all
+                latencies = []
+                for _ in range(args.requests):
+                    started = time.perf_counter()
+                    get_request(port, '/api/shoppinglist')
+                    latencies.append((time.perf_counter() - started) * 1000)
+                print(format_row([kind, count, server_threads(process), f"{statistics.median(latencies):.2f} ms",
+                                  f"{percentile(latencies, 0.95):.2f} ms"], widths))
+                for client in clients:
+                    client.close()
+                time.sleep(0.5)
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Memory: plain dict catalogue vs CompactCatalogue ---
+
+CATEGORIES = ['מוצרי חלב', 'ירקות', 'פירות', 'מאפים', 'בשר ודגים', 'שימורים', 'חטיפים', 'משקאות',
+              'חומרי ניקיון', 'היגיינה', 'קפואים', 'לא מקוטלג']
+
+
+def make_ean13(number):
+    digits = str(number).zfill(12)
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(digits)))
+    return digits + str((10 - total % 10) % 10)
+
+
+def make_master_json(count):
+    """products_master.json text with `count` synthetic products (every 20th without a valid EAN)."""
+    products = {}
+    for number in range(count):
+        barcode = make_ean13(729000000000 + number) if number % 20 else f"LOCAL-{number}"
+        products[uuid.uuid4().hex] = {"name": f"מוצר לדוגמה {number}", "barcode": barcode,
+                                      "category": CATEGORIES[number % len(CATEGORIES)]}
+    return json.dumps({"schema_version": 2, "products": products}, ensure_ascii=False)
+
+
+def measure_allocations(build):
+    """
+    Returns (result, bytes still allocated by build() once its temporaries are freed, seconds).
+    The time comes from a separate untraced run, as tracemalloc slows allocations down.
+    """
+    started = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated, elapsed
+
+
+def bench_memory(args):
+    """Bytes per product of the cached master list, as parsed dicts and as a CompactCatalogue."""
+    sys.path.insert(0, REPO_DIR)
+    import catalogue_store
+
+    text = make_master_json(args.products)
+    widths = [20, 16, 20, 12]
+    print(f"{args.products} products, {len(text.encode('utf-8')) / args.products:.0f} bytes per product on disk")
+    print(format_row(['store', 'bytes/product', 'with indexes', 'load'], widths))
+
+    products, allocated, elapsed = measure_allocations(lambda: json.loads(text)['products'])
+    indexes, index_bytes, _ = measure_allocations(lambda: (
+        {record['barcode']: product_id for product_id, record in products.items()},
+        {record['name']: product_id for product_id, record in products.items()}))
+    print(format_row(['dict per product', f"{allocated / args.products:.0f}",
+                      f"{(allocated + index_bytes) / args.products:.0f}", f"{elapsed:.2f} s"], widths))
+    del products, indexes
+
+    catalogue, allocated, elapsed = measure_allocations(
+        lambda: catalogue_store.CompactCatalogue(json.loads(text)['products']))
+    indexes, index_bytes, _ = measure_allocations(lambda: (catalogue.barcode_index(), catalogue.name_index()))
+    print(format_row(['CompactCatalogue', f"{allocated / args.products:.0f}",
+                      f"{(allocated + index_bytes) / args.products:.0f}", f"{elapsed:.2f} s"], widths))
+
+
+# --- Reads under writes: snapshot-isolated cache versions ---
+
+READ_OPERATIONS = {
+    'all_products': lambda dm: len(dm.get_all_products_from_master()['products']),
+    'shoppinglist': lambda dm: len(dm.get_all_shopping_items()['products']),
+    'grouped': lambda dm: dm.get_grouped_shopping_items()['total'],
+}
+
+
+def seed_catalogue(workdir, products, shopping_items):
+    """Writes a master list of synthetic products to the workdir, with the first ones on the shopping list."""
+    master = json.loads(make_master_json(products))
+    with open(os.path.join(workdir, 'databases', 'products_master.json'), 'w', encoding='utf-8') as f:
+        json.dump(master, f, ensure_ascii=False)
+    shopping = {product_id: {"quantity": 1, "done": False} for product_id in list(master['products'])[:shopping_items]}
+    with open(os.path.join(workdir, 'databases', 'shopping_items.json'), 'w', encoding='utf-8') as f:
+        json.dump({"schema_version": 2, "products": shopping}, f, ensure_ascii=False)
+    return [master['products'][product_id]['name'] for product_id in shopping]
+
+
+def run_readers(dm, readers, seconds):
+    """Runs each read operation in `readers` threads for `seconds`; returns {operation: (latencies, failures)}."""
+    results = {name: ([], [0]) for name in READ_OPERATIONS}
+    deadline = time.perf_counter() + seconds
+
+    def read(name, operation):
+        latencies, failures = results[name]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if not operation(dm):  # data_manager reports a failed read as an empty result
+                failures[0] += 1
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=read, args=item) for item in READ_OPERATIONS.items() for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def bench_reads(args):
+    """Read latency of the list views with and without a writer updating the databases meanwhile."""
+    workdir = make_workdir()
+    names = seed_catalogue(workdir, args.products, args.shopping_items)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import data_manager
+
+    data_manager.warm_start()  # Load (and if needed migrate) every database before measuring
+    widths = [16, 14, 10, 12, 12, 10]
+    print(f"{args.products} products, {args.shopping_items} on the list, {args.readers} reader threads per view")
+    print(format_row(['writer', 'view', 'reads', 'p50', 'p95', 'failed'], widths))
+    for with_writer in (False, True):
+        stop = threading.Event()
+        writes = []
+
+        def write():
+            number = 0
+            while not stop.is_set():
+                name = names[number % len(names)]
+                started = time.perf_counter()
+                data_manager.update_shopping_item(name, quantity=number % 5 + 1, done=number % 2 == 0)
+                data_manager.record_product_price_entry(data_manager.get_product_id_by_name(name), 5 + number % 7)
+                writes.append(time.perf_counter() - started)
+                number += 1
+                time.sleep(args.write_interval)
+
+        writer = threading.Thread(target=write)
+        if with_writer:
+            writer.start()
+        results = run_readers(data_manager, args.readers, args.seconds)
+        stop.set()
+        if with_writer:
+            writer.join()
+        label = f"{len(writes)} writes" if with_writer else 'none'
+        for name, (latencies, failures) in results.items():
+            if not latencies:
+                continue
+            print(format_row([label, name, len(latencies), f"{percentile(latencies, 0.5) * 1000:.2f} ms",
+                              f"{percentile(latencies, 0.95) * 1000:.2f} ms", failures[0]], widths))
+        if writes:
+            print(f"  write (update item + record price): p50 {percentile(writes, 0.5) * 1000:.2f} ms, "
+                  f"p95 {percentile(writes, 0.95) * 1000:.2f} ms")
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Database file formats: json, orjson and msgpack, indented or compact ---
+
+def best_of(repeat, operation):
+    """Fastest of `repeat` runs of operation(), in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_codecs(args):
+    """Save time, load time and file size of a products master list in every database format."""
+    sys.path.insert(0, REPO_DIR)
+    import serializers
+
+    data = json.loads(make_master_json(args.products))
+    workdir = tempfile.mkdtemp(prefix='shoppyscan-bench-')
+    widths = [18, 12, 12, 14]
+    print(f"{args.products} products, best of {args.repeat} runs (data_manager parses any JSON file with orjson "
+          f"when it is installed)")
+    print(format_row(['format', 'save', 'load', 'file size'], widths))
+    for name in serializers.CODECS:
+        if name not in serializers.available_codecs():
+            print(f"{name}: not installed (pip install {name})")
+            continue
+        for compact in ((True,) if name == 'msgpack' else (False, True)):
+            codec = serializers.get_codec(name, compact=compact)
+            file_path = os.path.join(workdir, f"{name}-{compact}.db")
+
+            def save():
+                with open(file_path, 'wb') as f:
+                    f.write(codec.dumps(data))
+
+            def load():
+                with open(file_path, 'rb') as f:
+                    return codec.loads(f.read())
+
+            save_seconds = best_of(args.repeat, save)
+            load_seconds = best_of(args.repeat, load)
+            label = name if name == 'msgpack' else f"{name} {'compact' if compact else 'indented'}"
+            print(format_row([label, f"{save_seconds * 1000:.0f} ms", f"{load_seconds * 1000:.0f} ms",
+                              f"{os.path.getsize(file_path) / 1024 / 1024:.1f} MB"], widths))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+# --- Price alerts: write latency with many active rules ---
+
+def bench_alerts(args):
+    """Latency of recording a price with growing numbers of active price alert rules."""
+    import random
+
+    workdir = make_workdir()
+    seed_catalogue(workdir, args.products, 0)
+    with open(os.path.join(workdir, 'databases', 'products_master.json'), encoding='utf-8') as f:
+        product_ids = list(json.load(f)['products'])
+    written = product_ids[:args.written]
+    # A few days of history for the products written to, so the rolling averages have something to go on
+    history = {f"{day:02d}/01/2024": {"price": 10.0} for day in range(1, 6)}
+    with open(os.path.join(workdir, 'databases', 'tracking_data.json'), 'w', encoding='utf-8') as f:
+        json.dump({"schema_version": 2, "products": {product_id: {"name": "", "barcode": "", "tracking": history}
+                                                     for product_id in written}}, f)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import data_manager
+
+    data_manager.warm_start()
+    rng = random.Random(1)
+    rule_types = [{"type": "change", "percent": 20.0}, {"type": "above", "threshold": 12.0},
+                  {"type": "below", "threshold": 9.0}]
+    widths = [10, 10, 12, 12, 10]
+    print(f"{args.products} products, {args.writes} price writes spread over {args.written} of them")
+    print(format_row(['rules', 'writes', 'p50', 'p95', 'alerts'], widths))
+    active = 0
+    for count in sorted(args.rules):
+        rules = []
+        for number in range(active, count):
+            # Every product written to is watched, the other rules watch products across the catalogue
+            product_id = written[number] if number < len(written) else rng.choice(product_ids)
+            rules.append(dict(rule_types[number % len(rule_types)], product_id=product_id))
+        if rules:
+            data_manager.add_price_alert_rules(rules)
+        active = count
+        last_alert = data_manager.get_price_alerts(limit=1)
+        since = last_alert[-1]['id'] if last_alert else 0
+        latencies = []
+        for number in range(args.writes):
+            product_id = written[number % len(written)]
+            started = time.perf_counter()
+            data_manager.record_product_price_entry(product_id, rng.choice([8.5, 10.0, 10.5, 12.5]))
+            latencies.append(time.perf_counter() - started)
+        fired = len(data_manager.get_price_alerts(since))
+        print(format_row([count, args.writes, f"{percentile(latencies, 0.5) * 1000:.2f} ms",
+                          f"{percentile(latencies, 0.95) * 1000:.2f} ms", fired], widths))
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'connections': bench_connections,
+    'memory': bench_memory,
+    'reads': bench_reads,
+    'codecs': bench_codecs,
+    'alerts': bench_alerts,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    connections = subparsers.add_parser('connections', help='Slow-client capacity of the Werkzeug and ASGI servers')
+    connections.add_argument('--slow-clients', type=int, nargs='+', default=[0, 100, 500])
+    connections.add_argument('--requests', type=int, default=200)
+
+    memory = subparsers.add_parser('memory', help=bench_memory.__doc__)
+    memory.add_argument('--products', type=int, default=200000)
+
+    reads = subparsers.add_parser('reads', help=bench_reads.__doc__)
+    reads.add_argument('--products', type=int, default=50000)
+    reads.add_argument('--shopping-items', type=int, default=40)
+    reads.add_argument('--readers', type=int, default=2)
+    reads.add_argument('--seconds', type=float, default=5)
+    reads.add_argument('--write-interval', type=float, default=0.02, help='pause between writes (seconds)')
+
+    codecs = subparsers.add_parser('codecs', help=bench_codecs.__doc__)
+    codecs.add_argument('--products', type=int, default=100000)
+    codecs.add_argument('--repeat', type=int, default=3)
+
+    alerts = subparsers.add_parser('alerts', help=bench_alerts.__doc__)
+    alerts.add_argument('--products', type=int, default=20000)
+    alerts.add_argument('--rules', type=int, nargs='+', default=[0, 1000, 10000])
+    alerts.add_argument('--written', type=int, default=200, help='number of products prices are recorded for')
+    alerts.add_argument('--writes', type=int, default=1000)
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
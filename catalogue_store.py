@@ -0,0 +1,349 @@
+import os
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+# --- Compact Catalogue Configuration ---
+# When true, the cached products master list is held in a CompactCatalogue instead of one dict per product.
+COMPACT_CATALOGUE = os.environ.get('COMPACT_CATALOGUE', 'true').lower() in ('1', 'true', 'yes')
+
+FIELDS = ('name', 'barcode', 'category')
+
+# --- Barcodes ---
+# Valid EAN/UPC barcodes (8, 12, 13 or 14 digits with a correct check digit) are stored as integers:
+# the digits' value with the length in the bits above them, so leading zeros survive the round trip.
+# Anything else stays a string. 0 stands for "no barcode". Barcodes read from a file as numbers are taken
+# as the string of their digits.
+_EAN_LENGTHS = (8, 12, 13, 14)
+_LENGTH_SHIFT = 48  # 10**14 < 2**47
+_NO_BARCODE = 0
+_STRING_BARCODE = -1
+
+
+def normalize_barcode(barcode):
+    """The barcode as a string ('' for no barcode), whatever type it was stored with."""
+    if not barcode:
+        return ''
+    return barcode if isinstance(barcode, str) else str(barcode)
+
+
+def is_valid_ean(barcode):
+    barcode = normalize_barcode(barcode)
+    if len(barcode) not in _EAN_LENGTHS or not barcode.isascii() or not barcode.isdigit():
+        return False
+    # Weights alternate 3, 1 from the digit left of the check digit (summed as ASCII codes, minus '0')
+    digits = barcode.encode('ascii')
+    weighted_three, weighted_one = digits[-2::-2], digits[-3::-2]
+    total = 3 * (sum(weighted_three) - 48 * len(weighted_three)) + sum(weighted_one) - 48 * len(weighted_one)
+    return (10 - total % 10) % 10 == digits[-1] - 48
+
+
+def encode_barcode(barcode):
+    """Returns the integer form of a valid EAN, 0 for no barcode, or None if it has to stay a string."""
+    barcode = normalize_barcode(barcode)
+    if not barcode:
+        return _NO_BARCODE
+    if is_valid_ean(barcode):
+        return (len(barcode) << _LENGTH_SHIFT) | int(barcode)
+    return None
+
+
+def decode_barcode(code):
+    if code == _NO_BARCODE:
+        return ''
+    return str(code & ((1 << _LENGTH_SHIFT) - 1)).zfill(code >> _LENGTH_SHIFT)
+
+
+# --- Categories ---
+# Category names are interned once per process and referenced by number, so every catalogue (and every
+# product in it) shares the same dozen strings.
+# New names are added under a lock, as catalogues are loaded by concurrent readers outside the write lock.
+_category_names = []
+_category_ids = {}
+_category_lock = threading.Lock()
+
+
+def intern_category(name):
+    category_id = _category_ids.get(name)
+    if category_id is None:
+        with _category_lock:
+            category_id = _category_ids.get(name)
+            if category_id is None:
+                # The name is in place before its number is published, so category_name never misses it
+                _category_names.append(name)
+                category_id = _category_ids[name] = len(_category_names) - 1
+    return category_id
+
+
+def category_name(category_id):
+    return _category_names[category_id]
+
+
+class ProductRow(MutableMapping):
+    """
+    Dict-like view of one product in a CompactCatalogue. Reads and writes go straight to the
+    catalogue's columns. A row view must not be kept after its product is deleted, because the row
+    is reused for the next product added.
+    """
+    __slots__ = ('_catalogue', '_row')
+
+    def __init__(self, catalogue, row):
+        self._catalogue = catalogue
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._catalogue._get_field(self._row, key)
+
+    def __setitem__(self, key, value):
+        self._catalogue._set_field(self._row, key, value)
+
+    def __delitem__(self, key):
+        self._catalogue._delete_field(self._row, key)
+
+    def __iter__(self):
+        return iter(self._catalogue._row_keys(self._row))
+
+    def __len__(self):
+        return len(self._catalogue._row_keys(self._row))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CompactCatalogue(MutableMapping):
+    """
+    The products of the master list ({product ID: {"name", "barcode", "category", ["deleted"]}}) stored
+    as columns instead of one dict per product: names in a list, barcodes and category numbers in
+    typed arrays, the deleted flags in a bytearray. Behaves like the dict it replaces; product[...]
+    returns a ProductRow view, and plain dicts may be assigned. Product IDs iterate in insertion order.
+    """
+
+    def __init__(self, products=None):
+        self._rows = {}  # product ID -> row number
+        self._names = []
+        self._barcodes = array('q')  # encoded barcode, see encode_barcode
+        self._categories = array('I')  # interned category number
+        self._deleted = bytearray()
+        self._string_barcodes = {}  # row number -> barcode that is not a valid EAN
+        self._extra_fields = {}  # row number -> {field: value} for fields other than FIELDS and 'deleted'
+        self._free_rows = []
+        if products:
+            self.update(products)
+
+    # --- Mapping interface ---
+
+    def __getitem__(self, product_id):
+        return ProductRow(self, self._rows[product_id])
+
+    def __setitem__(self, product_id, record):
+        row = self._rows.get(product_id)
+        if row is None:
+            row = self._allocate_row(product_id)
+        else:
+            self._extra_fields.pop(row, None)
+        self._names[row] = record.get('name', '')
+        self._store_barcode(row, record.get('barcode', ''))
+        self._categories[row] = intern_category(record.get('category', ''))
+        self._deleted[row] = 1 if record.get('deleted') else 0
+        if len(record) > ('name' in record) + ('barcode' in record) + ('category' in record) + ('deleted' in record):
+            self._extra_fields[row] = {key: value for key, value in record.items()
+                                       if key not in FIELDS and key != 'deleted'}
+
+    def __delitem__(self, product_id):
+        row = self._rows.pop(product_id)
+        self._names[row] = None
+        self._string_barcodes.pop(row, None)
+        self._extra_fields.pop(row, None)
+        self._free_rows.append(row)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, product_id):
+        return product_id in self._rows
+
+    def items(self):
+        return ((product_id, ProductRow(self, row)) for product_id, row in self._rows.items())
+
+    def __repr__(self):
+        return f"CompactCatalogue({len(self)} products)"
+
+    def to_dict(self):
+        """Plain {product ID: record dict} copy, as stored in products_master.json."""
+        return {product_id: self._row_dict(row) for product_id, row in self._rows.items()}
+
+    def copy(self):
+        """Independent catalogue with the same products (the columns are copied wholesale, not row by row)."""
+        clone = CompactCatalogue.__new__(CompactCatalogue)
+        clone._rows = dict(self._rows)
+        clone._names = list(self._names)
+        clone._barcodes = self._barcodes[:]
+        clone._categories = self._categories[:]
+        clone._deleted = bytearray(self._deleted)
+        clone._string_barcodes = dict(self._string_barcodes)
+        clone._extra_fields = {row: dict(fields) for row, fields in self._extra_fields.items()}
+        clone._free_rows = list(self._free_rows)
+        return clone
+
+    # --- Indexes ---
+
+    def barcode_index(self):
+        """BarcodeIndex of live products; the first product carrying a barcode wins."""
+        index = BarcodeIndex()
+        string_barcodes = self._string_barcodes
+        for product_id, row in self._rows.items():
+            if self._deleted[row]:
+                continue
+            code = self._barcodes[row]
+            if code == _STRING_BARCODE:
+                dict.setdefault(index, string_barcodes[row], product_id)
+            elif code != _NO_BARCODE:
+                dict.setdefault(index, code, product_id)
+        return index
+
+    def barcode_table(self):
+        """{barcode: (name, category)} of live products, keyed like barcode_index; the first product carrying a barcode wins."""
+        table = {}
+        names, barcodes, categories, string_barcodes = self._names, self._barcodes, self._categories, self._string_barcodes
+        for row in self._rows.values():
+            if self._deleted[row]:
+                continue
+            code = barcodes[row]
+            if code == _STRING_BARCODE:
+                code = string_barcodes[row]
+            elif code == _NO_BARCODE:
+                continue
+            if code not in table:
+                table[code] = (names[row], _category_names[categories[row]])
+        return table
+
+    def name_index(self):
+        return {self._names[row]: product_id for product_id, row in self._rows.items()}
+
+    # --- Rows ---
+
+    def _allocate_row(self, product_id):
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._names)
+            self._names.append(None)
+            self._barcodes.append(_NO_BARCODE)
+            self._categories.append(0)
+            self._deleted.append(0)
+        self._rows[product_id] = row
+        return row
+
+    def _store_barcode(self, row, barcode):
+        barcode = normalize_barcode(barcode)
+        code = encode_barcode(barcode)
+        if code is None:
+            self._barcodes[row] = _STRING_BARCODE
+            self._string_barcodes[row] = barcode
+        else:
+            self._barcodes[row] = code
+            self._string_barcodes.pop(row, None)
+
+    def _get_barcode(self, row):
+        code = self._barcodes[row]
+        if code == _STRING_BARCODE:
+            return self._string_barcodes[row]
+        return decode_barcode(code)
+
+    def _get_field(self, row, key):
+        if key == 'name':
+            return self._names[row]
+        if key == 'barcode':
+            return self._get_barcode(row)
+        if key == 'category':
+            return _category_names[self._categories[row]]
+        if key == 'deleted' and self._deleted[row]:
+            return True
+        return self._extra_fields.get(row, {})[key]
+
+    def _set_field(self, row, key, value):
+        if key == 'name':
+            self._names[row] = value
+        elif key == 'barcode':
+            self._store_barcode(row, value)
+        elif key == 'category':
+            self._categories[row] = intern_category(value)
+        elif key == 'deleted':
+            self._deleted[row] = 1 if value else 0
+        else:
+            self._extra_fields.setdefault(row, {})[key] = value
+
+    def _delete_field(self, row, key):
+        if key in FIELDS:
+            raise KeyError(f"{key} cannot be removed from a product")
+        if key == 'deleted':
+            if not self._deleted[row]:
+                raise KeyError(key)
+            self._deleted[row] = 0
+            return
+        extra_fields = self._extra_fields.get(row, {})
+        del extra_fields[key]
+        if not extra_fields:
+            self._extra_fields.pop(row, None)
+
+    def _row_keys(self, row):
+        keys = list(FIELDS)
+        if self._deleted[row]:
+            keys.append('deleted')
+        keys.extend(self._extra_fields.get(row, ()))
+        return keys
+
+    def _row_dict(self, row):
+        return {key: self._get_field(row, key) for key in self._row_keys(row)}
+
+    # --- Pickling (state snapshots) ---
+    # Category numbers are only meaningful within one process, so a pickled catalogue carries the
+    # names of its categories and re-interns them when it is loaded.
+
+    def __getstate__(self):
+        state = dict(vars(self))
+        state['_category_table'] = list(_category_names)
+        return state
+
+    def __setstate__(self, state):
+        table = [intern_category(name) for name in state.pop('_category_table')]
+        state['_categories'] = array('I', (table[category_id] for category_id in state['_categories']))
+        vars(self).update(state)
+
+
+class BarcodeIndex(dict):
+    """barcode -> product ID over a CompactCatalogue. Keys use the catalogue's barcode encoding."""
+
+    @staticmethod
+    def _key(barcode):
+        barcode = normalize_barcode(barcode)
+        code = encode_barcode(barcode)
+        return barcode if code is None else code
+
+    def get(self, barcode, default=None):
+        return dict.get(self, self._key(barcode), default)
+
+    def __getitem__(self, barcode):
+        return dict.__getitem__(self, self._key(barcode))
+
+    def __contains__(self, barcode):
+        return dict.__contains__(self, self._key(barcode))
+
+
+def compact(products):
+    """Returns products as a CompactCatalogue (unchanged if it already is one, or if compaction is off)."""
+    if not COMPACT_CATALOGUE or isinstance(products, CompactCatalogue):
+        return products
+    return CompactCatalogue(products)
+
+
+def to_json(value):
+    """json.dump default= hook for CompactCatalogue and ProductRow values."""
+    if isinstance(value, CompactCatalogue):
+        return value.to_dict()
+    if isinstance(value, ProductRow):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
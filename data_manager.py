@@ -1,13 +1,41 @@
-import json
+import bisect
+import functools
+import hashlib
+import itertools
 import os
+import pickle
+import shutil
+import struct
+import threading
+import time
+import uuid
 from datetime import datetime
 import logging  # Import logging module
 
+import catalogue_store
+import log_format
+import price_alerts
+import purchase_history
+import serializers
+import tenants
+import tracing
+
 # Define paths for the new database files
 SHOPPING_ITEMS_DB = 'databases/shopping_items.json'
 PRODUCTS_MASTER_DB = 'databases/products_master.json'
 TRACKING_DATA_DB = 'databases/tracking_data.json'
 CATEGORIES_DB = 'databases/categories.json'
+PURCHASE_EVENTS_LOG = 'databases/purchase_events.jsonl'
+PURCHASE_STATS_CHECKPOINT = 'databases/purchase_stats.json'
+PRICE_ALERT_RULES_DB = 'databases/price_alert_rules.json'
+PRICE_ALERTS_LOG = 'databases/price_alerts.json'
+
+# Databases holding products, keyed by product ID since schema version 2
+PRODUCT_DBS = [PRODUCTS_MASTER_DB, SHOPPING_ITEMS_DB, TRACKING_DATA_DB]
+# Files every tenant has its own copy of (see tenants.py); the product catalogue and categories are shared
+TENANT_FILES = [SHOPPING_ITEMS_DB, TRACKING_DATA_DB, PURCHASE_EVENTS_LOG, PURCHASE_STATS_CHECKPOINT, PRICE_ALERT_RULES_DB,
+                PRICE_ALERTS_LOG]
+SCHEMA_VERSION = 2
 
 # Ensure the databases directory exists
 if not os.path.exists('databases'):
@@ -20,57 +48,415 @@ if not os.path.exists(log_dir):
 
 data_manager_logger = logging.getLogger('data_manager_logs')
 data_manager_logger.setLevel(logging.INFO)
-data_manager_handler = logging.FileHandler(os.path.join(log_dir, 'data_manager_logs.txt'))
-data_manager_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-data_manager_handler.setFormatter(data_manager_formatter)
+data_manager_handler = logging.FileHandler(os.path.join(log_dir, 'data_manager_logs.txt'), encoding='utf-8')
+log_format.configure_handler(data_manager_handler)  # Text or JSONL, depending on LOG_FORMAT
+tracing.trace_handler(data_manager_handler)
 data_manager_logger.addHandler(data_manager_handler)
 
 
-# Generic function to load data from a specified JSON file
-def _load_db(db_path):
+# --- Tenant Stores ---
+# Everything kept per tenant: the files of its databases, their cache entries, its grouped shopping list
+# view, its purchase history and its price alerts. Open stores live in a bounded LRU; closing one only has to checkpoint
+# the purchase statistics, as every database change is already written through to its file.
+
+class TenantStore:
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.paths = {db_path: tenants.tenant_path(tenant, db_path) for db_path in TENANT_FILES}
+        self.cache = {}
+        self.grouped_view = {'versions': None, 'groups': {}, 'placement': {}}
+        self.purchase_log = purchase_history.PurchaseHistory(self.paths[PURCHASE_EVENTS_LOG],
+                                                             self.paths[PURCHASE_STATS_CHECKPOINT])
+        self.price_alerts = price_alerts.PriceAlerts(self.paths[PRICE_ALERTS_LOG])
+
+
+def _open_tenant_store(tenant):
+    store = TenantStore(tenant)
+    os.makedirs(os.path.dirname(store.paths[SHOPPING_ITEMS_DB]) or '.', exist_ok=True)
+    data_manager_logger.info(f"Opened store of tenant '{tenant}'.")
+    return store
+
+
+def _close_tenant_store(tenant, store):
+    store.purchase_log.checkpoint()
+    data_manager_logger.info(f"Closed store of tenant '{tenant}'.")
+
+
+_tenant_stores = tenants.StoreCache(_open_tenant_store, _close_tenant_store)
+
+
+def _tenant_store():
+    """The store of the tenant the current request works on."""
+    return _tenant_stores.get(tenants.get_current_tenant())
+
+
+def close_tenant_stores():
+    """Flushes and closes every open tenant store (used at shutdown)."""
+    _tenant_stores.close_all()
+
+
+# --- In-memory Cache ---
+# Parsed databases keyed by file path: shared databases in _db_cache, per-tenant ones in their tenant's
+# store. An entry is only used while the file's mtime and size still match, so edits made outside this
+# process are picked up on the next access.
+#
+# Each cache entry is an immutable, numbered version of its database. Readers take the current entry
+# without any lock and may keep using it for as long as they like. Writers are serialized by
+# _write_lock; they modify a copy (_load_db_for_update) and publish it with _save_db, which swaps in a
+# new entry with one reference assignment. A replaced version is freed once the last reader holding it
+# lets go of it.
+_db_cache = {}
+_write_lock = threading.RLock()
+_versions = itertools.count(1)
+# File path -> version the pending update of that file was copied from (only used under _write_lock)
+_update_bases = {}
+
+
+def _writer(func):
+    """Runs a function that modifies databases while holding the write lock."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _write_lock:
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _db_file(db_path):
+    """The file holding a database for the current tenant (shared databases have a single file)."""
+    return _tenant_store().paths[db_path] if db_path in TENANT_FILES else db_path
+
+
+def _cache_for(db_path):
+    return _tenant_store().cache if db_path in TENANT_FILES else _db_cache
+
+
+def _file_signature(file_path):
+    st = os.stat(file_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _cache_put(db_path, data, signature, base_version=None):
+    """Publishes data as the current version of a database. signature is the file's (mtime_ns, size) it matches."""
+    if db_path == PRODUCTS_MASTER_DB and 'products' in data:
+        # The master list can hold a very large catalogue; keep it in the compact columnar store
+        data['products'] = catalogue_store.compact(data['products'])
+    entry = {'mtime_ns': signature[0], 'size': signature[1], 'data': data, 'indexes': {},
+             'version': next(_versions), 'base_version': base_version}
+    _cache_for(db_path)[_db_file(db_path)] = entry
+    return entry
+
+
+def _published_entry(db_path, data):
+    """The cache entry holding data, or an uncached one if data is not (or no longer) the published version."""
+    entry = _cache_for(db_path).get(_db_file(db_path))
+    if entry is not None and entry['data'] is data:
+        return entry
+    return {'data': data, 'indexes': {}, 'version': None, 'base_version': None}
+
+
+def _invalidate_cache(*db_paths):
+    """Drops cached databases whose in-memory copy may no longer match the file (e.g. after a failed update)."""
+    for db_path in db_paths:
+        _cache_for(db_path).pop(_db_file(db_path), None)
+
+
+def _writable_copy(data):
+    """Copy of a database's top-level containers; the records in them are still shared with data."""
+    copy = dict(data)
+    products = data.get('products')
+    if isinstance(products, catalogue_store.CompactCatalogue):
+        copy['products'] = products.copy()
+    elif products is not None:
+        copy['products'] = dict(products)
+    if 'categories' in data:
+        copy['categories'] = list(data['categories'])
+    if 'rules' in data:
+        copy['rules'] = dict(data['rules'])
+    return copy
+
+
+def _writable_record(products, product_id):
+    """
+    A record of a database copy that may be modified in place. Plain dict records are still shared with
+    the published version, so they are copied first; CompactCatalogue rows already belong to the copy.
+    """
+    record = products[product_id]
+    if isinstance(record, dict):
+        record = products[product_id] = dict(record)
+    return record
+
+
+def _build_barcode_index(data):
+    if isinstance(data['products'], catalogue_store.CompactCatalogue):
+        return data['products'].barcode_index()
+    # The first live product carrying a barcode wins, matching the order a linear scan would find them in
+    index = {}
+    for product_id, record in data['products'].items():
+        if record.get('barcode') and not record.get('deleted'):
+            index.setdefault(catalogue_store.normalize_barcode(record['barcode']), product_id)
+    return index
+
+
+def _build_name_index(data):
+    if isinstance(data['products'], catalogue_store.CompactCatalogue):
+        return data['products'].name_index()
+    return {record['name']: product_id for product_id, record in data['products'].items()}
+
+
+def _build_barcode_table(data):
+    if isinstance(data['products'], catalogue_store.CompactCatalogue):
+        return data['products'].barcode_table()
+    table = {}
+    for record in data['products'].values():
+        if record.get('barcode') and not record.get('deleted'):
+            barcode = catalogue_store.normalize_barcode(record['barcode'])
+            code = catalogue_store.encode_barcode(barcode)
+            table.setdefault(barcode if code is None else code, (record['name'], record.get('category', '')))
+    return table
+
+
+def _build_category_set(data):
+    return set(data.get('categories', []))
+
+
+def _build_rules_by_product(data):
+    rules_by_product = {}
+    for rule in data.get('rules', {}).values():
+        rules_by_product.setdefault(rule['product_id'], []).append(rule)
+    return rules_by_product
+
+
+# Index builders per database: index name -> function building it from the parsed data
+_INDEX_BUILDERS = {
+    PRODUCTS_MASTER_DB: {'barcode': _build_barcode_index, 'name': _build_name_index, 'barcode_table': _build_barcode_table},
+    TRACKING_DATA_DB: {'barcode': _build_barcode_index},
+    CATEGORIES_DB: {'set': _build_category_set},
+    PRICE_ALERT_RULES_DB: {'product': _build_rules_by_product},
+}
+
+
+def _entry_index(db_path, entry, index_name):
+    index = entry['indexes'].get(index_name)
+    if index is None:
+        # Concurrent readers may both build it; they build the same index from the same immutable version
+        index = entry['indexes'][index_name] = _INDEX_BUILDERS[db_path][index_name](entry['data'])
+    return index
+
+
+def _get_index(db_path, index_name):
+    """Returns an index over the current version of a database, building it on first use."""
+    return _entry_index(db_path, _load_entry(db_path), index_name)
+
+
+def _initial_data(db_path):
+    if db_path in PRODUCT_DBS:
+        return {"schema_version": SCHEMA_VERSION, "products": {}}
+    elif db_path == CATEGORIES_DB:
+        return {"categories": []}
+    elif db_path == PRICE_ALERT_RULES_DB:
+        return {"rules": {}}
+    return {}
+
+
+# Generic function to load data from a specified JSON file: returns the current cache entry of the
+# database, (re)loading the file if it changed. The entry and its data must not be modified.
+@tracing.traced
+def _load_entry(db_path):
+    file_path = _db_file(db_path)
     try:
-        if not os.path.exists(db_path) or os.stat(db_path).st_size == 0:
-            initial_data = {}
-            if db_path in [SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB, TRACKING_DATA_DB]:
-                initial_data = {"products": {}}
-            elif db_path == CATEGORIES_DB:
-                initial_data = {"categories": []}
+        if not os.path.exists(file_path) or os.stat(file_path).st_size == 0:
+            initial_data = _initial_data(db_path)
             _save_db(db_path, initial_data)
-            data_manager_logger.info(f"Initialized empty database at {db_path}.")
-            return initial_data
-        with open(db_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            data_manager_logger.info(f"Successfully loaded data from {db_path}.")
-            return data
-    except json.JSONDecodeError as e:
-        data_manager_logger.error(f"JSON decoding error in {db_path}: {e}. Reinitializing database.", exc_info=True)
-        initial_data = {}
-        if db_path in [SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB, TRACKING_DATA_DB]:
-            initial_data = {"products": {}}
-        elif db_path == CATEGORIES_DB:
-            initial_data = {"categories": []}
+            data_manager_logger.info(f"Initialized empty database at {file_path}.")
+            return _published_entry(db_path, initial_data)
+        # Taken before reading, so a version written meanwhile is not cached under the newer signature
+        signature = _file_signature(file_path)
+        entry = _cache_for(db_path).get(file_path)
+        if entry is not None and (entry['mtime_ns'], entry['size']) == signature:
+            return entry
+        data = serializers.load_file(file_path)  # JSON or msgpack, whatever the file holds
+        if db_path in PRODUCT_DBS and data.get('schema_version', 1) < SCHEMA_VERSION:
+            if not migrate_to_product_ids():
+                raise RuntimeError(f"{file_path} uses schema version {data.get('schema_version', 1)} and could not be migrated")
+            return _load_entry(db_path)
+        entry = _cache_put(db_path, data, signature)
+        data_manager_logger.info(f"Successfully loaded data from {file_path}.")
+        return entry
+    except serializers.DecodeError as e:
+        data_manager_logger.error(f"Decoding error in {file_path}: {e}. Reinitializing database.", exc_info=True)
+        initial_data = _initial_data(db_path)
         _save_db(db_path, initial_data)
-        return initial_data
+        return _published_entry(db_path, initial_data)
     except Exception as e:
-        data_manager_logger.error(f"Error loading database from {db_path}: {e}", exc_info=True)
-        return {"products": {}} if db_path in [SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB, TRACKING_DATA_DB] else {
-            "categories": []}
+        data_manager_logger.error(f"Error loading database from {file_path}: {e}", exc_info=True)
+        # Readers see an empty database; writers are refused it (see _load_db_for_update)
+        return dict(_published_entry(db_path, _initial_data(db_path)), load_failed=True)
 
 
-# Generic function to save data to a specified JSON file
+def _load_db(db_path):
+    """The current version of a database, for reading only (see _load_db_for_update)."""
+    return _load_entry(db_path)['data']
+
+
+def _load_db_for_update(db_path):
+    """
+    A private copy of the current version of a database, for a writer to modify and publish with
+    _save_db. Only call it while holding the write lock (from a function decorated with @_writer).
+    Records inside the copy are shared with the published version; get them via _writable_record.
+    """
+    entry = _load_entry(db_path)
+    if entry.get('load_failed'):
+        # Saving a change to the empty stand-in would replace whatever the file really holds
+        raise RuntimeError(f"{_db_file(db_path)} could not be loaded; refusing to write over it")
+    _update_bases[_db_file(db_path)] = entry['version']
+    return _writable_copy(entry['data'])
+
+
+# Generic function to save data to a specified JSON file and publish it as the database's current version
+@tracing.traced
+@_writer
 def _save_db(db_path, data):
+    file_path = _db_file(db_path)
+    tmp_path = f"{file_path}.tmp"
+    base_version = _update_bases.pop(file_path, None)
     try:
-        with open(db_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        data_manager_logger.info(f"Successfully saved data to {db_path}.")
+        # Written next to the file and renamed over it, so a reader never parses a half-written file
+        with open(tmp_path, 'wb') as f:
+            f.write(serializers.dumps(data, default=catalogue_store.to_json))
+        os.replace(tmp_path, file_path)
+        _cache_put(db_path, data, _file_signature(file_path), base_version)
+        data_manager_logger.info(f"Successfully saved data to {file_path}.")
+        _schedule_snapshot(db_path)
         return True
     except Exception as e:
-        data_manager_logger.error(f"Error saving data to {db_path}: {e}", exc_info=True)
+        _invalidate_cache(db_path)
+        data_manager_logger.error(f"Error saving data to {file_path}: {e}", exc_info=True)
         return False
 
 
+# --- Binary Snapshot of In-memory State ---
+# On startup the parsed databases and their indexes are restored from a pickle snapshot instead of
+# re-parsing every JSON file. Each database in the snapshot is only reused if its source file still has
+# the mtime and size recorded when the snapshot was written; anything else is rebuilt from JSON.
+# The snapshot holds the shared databases and those of the current (at startup: the default) tenant.
+# It is rewritten in the background SNAPSHOT_DEBOUNCE_SECONDS after a change to one of them (several
+# changes in that time share one write), so a restart finds it fresh even if the process was killed.
+SNAPSHOT_PATH = 'databases/state.snapshot'
+# Seconds between a database change and the snapshot rewrite it triggers; 0 or less disables the rewrites.
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get('SNAPSHOT_DEBOUNCE_SECONDS', '5'))
+SNAPSHOT_FORMAT_VERSION = 3
+_SNAPSHOT_MAGIC = b'SHPYSNAP'
+# magic, format version, payload length, sha256 of payload
+_SNAPSHOT_HEADER = struct.Struct('<8sHQ32s')
+ALL_DBS = [SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB, TRACKING_DATA_DB, CATEGORIES_DB]
+_snapshot_timer = None
+_snapshot_timer_lock = threading.Lock()
+
+
+def _schedule_snapshot(db_path):
+    """Schedules a snapshot rewrite after a change to a database the snapshot holds."""
+    global _snapshot_timer
+    if SNAPSHOT_DEBOUNCE_SECONDS <= 0 or db_path not in ALL_DBS:
+        return
+    if db_path in TENANT_FILES and tenants.get_current_tenant() != tenants.DEFAULT_TENANT:
+        return  # Only the default tenant's databases are in the snapshot
+    with _snapshot_timer_lock:
+        if _snapshot_timer is not None:
+            return  # A rewrite is already due; it will include this change
+        _snapshot_timer = threading.Timer(SNAPSHOT_DEBOUNCE_SECONDS, _write_scheduled_snapshot)
+        _snapshot_timer.daemon = True
+        _snapshot_timer.start()
+
+
+def _write_scheduled_snapshot():
+    global _snapshot_timer
+    with _snapshot_timer_lock:
+        _snapshot_timer = None
+    write_snapshot()
+
+
+@tracing.traced
+def write_snapshot(snapshot_path=SNAPSHOT_PATH):
+    try:
+        dbs = {}
+        for db_path in ALL_DBS:
+            entry = _load_entry(db_path)
+            for index_name in _INDEX_BUILDERS.get(db_path, {}):
+                _entry_index(db_path, entry, index_name)
+            if entry['version'] is not None:
+                dbs[db_path] = entry
+        payload = pickle.dumps({'dbs': dbs}, protocol=pickle.HIGHEST_PROTOCOL)
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(payload),
+                                       hashlib.sha256(payload).digest())
+        tmp_path = f"{snapshot_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, snapshot_path)
+        data_manager_logger.info(f"Wrote state snapshot with {len(dbs)} databases to {snapshot_path}.")
+        return True
+    except Exception as e:
+        data_manager_logger.error(f"Error writing state snapshot to {snapshot_path}: {e}", exc_info=True)
+        return False
+
+
+@tracing.traced
+def load_snapshot(snapshot_path=SNAPSHOT_PATH):
+    """
+    Restores cached databases from the snapshot. Returns the list of database paths that were
+    restored; databases whose source file changed since the snapshot are left out.
+    """
+    if not os.path.exists(snapshot_path):
+        data_manager_logger.info(f"No state snapshot found at {snapshot_path}.")
+        return []
+    try:
+        # The whole snapshot is read and unpickled up front; what it saves is the JSON parsing and index building
+        with open(snapshot_path, 'rb') as f:
+            magic, version, length, digest = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+            if magic != _SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+                data_manager_logger.warning(f"Ignoring state snapshot {snapshot_path}: unknown format version {version}.")
+                return []
+            payload = f.read(length)
+        if len(payload) != length or hashlib.sha256(payload).digest() != digest:
+            data_manager_logger.warning(f"Ignoring state snapshot {snapshot_path}: checksum mismatch.")
+            return []
+        snapshot = pickle.loads(payload)
+    except Exception as e:
+        data_manager_logger.error(f"Error reading state snapshot {snapshot_path}: {e}", exc_info=True)
+        return []
+
+    restored = []
+    for db_path, entry in snapshot['dbs'].items():
+        file_path = _db_file(db_path)
+        if not os.path.exists(file_path) or (entry['mtime_ns'], entry['size']) != _file_signature(file_path):
+            data_manager_logger.info(f"State snapshot entry for {file_path} is stale; it will be rebuilt.")
+            continue
+        # Version numbers are only meaningful within the process that wrote the snapshot
+        _cache_for(db_path)[file_path] = dict(entry, version=next(_versions), base_version=None)
+        restored.append(db_path)
+    data_manager_logger.info(f"Restored {len(restored)} databases from state snapshot {snapshot_path}.")
+    return restored
+
+
+def warm_start(snapshot_path=SNAPSHOT_PATH):
+    """
+    Fills the in-memory cache at startup: reuses the snapshot where it is fresh, rebuilds the
+    remaining databases and indexes from JSON, and rewrites the snapshot if anything was rebuilt.
+    """
+    restored = load_snapshot(snapshot_path)
+    stale = [db_path for db_path in ALL_DBS if db_path not in restored]
+    if stale:
+        write_snapshot(snapshot_path)
+        data_manager_logger.info(f"Rebuilt {len(stale)} databases on warm start: {', '.join(stale)}.")
+    _schedule_purge()  # Deleted products the previous process did not get to purge
+    return restored
+
+
 # --- Categories DB Operations (NEW) ---
 
+@tracing.traced
 def get_all_categories():
     try:
         categories_data = _load_db(CATEGORIES_DB)
@@ -82,19 +468,18 @@ def get_all_categories():
         return []
 
 
+@tracing.traced
+@_writer
 def add_category_if_not_exists(category_name):
     if not category_name:
         data_manager_logger.warning("Attempted to add an empty category name.")
         return False
 
     try:
-        categories_data = _load_db(CATEGORIES_DB)
-        categories_list = categories_data.get('categories', [])
-
-        if category_name not in categories_list:
-            categories_list.append(category_name)
-            categories_list.sort()
-            categories_data['categories'] = categories_list
+        if category_name not in _get_index(CATEGORIES_DB, 'set'):
+            # The list is kept sorted, so the new category is inserted in place
+            categories_data = _load_db_for_update(CATEGORIES_DB)
+            bisect.insort(categories_data.setdefault('categories', []), category_name)
             if _save_db(CATEGORIES_DB, categories_data):
                 data_manager_logger.info(f"Category '{category_name}' added to categories database.")
                 return True
@@ -105,127 +490,574 @@ def add_category_if_not_exists(category_name):
             data_manager_logger.info(f"Category '{category_name}' already exists in categories database.")
             return True
     except Exception as e:
+        _invalidate_cache(CATEGORIES_DB)
         data_manager_logger.error(f"Error adding category '{category_name}': {e}", exc_info=True)
         return False
 
 
+# --- Product IDs ---
+# Every product has an immutable ID (products_master.json is keyed by it). The shopping list and the
+# tracking data refer to products by the same ID, so renaming a product or changing its barcode only
+# touches its record in the master list. Names and barcodes are looked up through indexes.
+
+def _new_product_id(barcode=None):
+    """
+    Returns the ID for a product being added to the master list. A product that was deleted but still
+    has price history keeps its old ID when it is added again with the same barcode.
+    """
+    if barcode:
+        tracked_id = _get_index(TRACKING_DATA_DB, 'barcode').get(barcode)
+        if tracked_id and tracked_id not in _load_db(PRODUCTS_MASTER_DB)['products']:
+            return tracked_id
+    return uuid.uuid4().hex
+
+
+def _public_product(product_id, record):
+    """Copy of a master record as returned to callers, so they cannot modify the cached record."""
+    return {"id": product_id, "name": record.get('name', ''), "barcode": record.get('barcode', ''),
+            "category": record.get('category', '')}
+
+
+@tracing.traced
+def get_product_id_by_name(name):
+    """Returns the ID of the product with this name (including deleted products still on the shopping list)."""
+    return _get_index(PRODUCTS_MASTER_DB, 'name').get(name)
+
+
+@tracing.traced
+def get_product_id_by_barcode(barcode):
+    """Returns the ID of the product carrying this barcode, or None."""
+    return _get_index(PRODUCTS_MASTER_DB, 'barcode').get(barcode) if barcode else None
+
+
+# --- Purging Deleted Products ---
+# A product deleted from the master list may still be on the shopping list of some tenant (the
+# catalogue is shared), so deleting only hides it. A background sweep, PURGE_DELAY_SECONDS after
+# the last delete or list change that may have freed one, reads every tenant's shopping list file and
+# then removes the deleted products none of them refers to. The lists are read without the write lock and
+# without opening tenant stores, so deletes cost the same however many tenants there are. A product deleted
+# again after the sweep started reading is left for the next sweep, as the lists it read may be stale.
+# Seconds between a change that may free deleted products and the sweep; 0 or less disables the sweeps.
+PURGE_DELAY_SECONDS = float(os.environ.get('PURGE_DELAY_SECONDS', '5'))
+_deletions = itertools.count(1)
+_deleted_at = {}  # product ID -> number of its deletion in this process (only used under _write_lock)
+_purge_timer = None
+_purge_timer_lock = threading.Lock()
+
+
+def _schedule_purge():
+    global _purge_timer
+    if PURGE_DELAY_SECONDS <= 0:
+        return
+    with _purge_timer_lock:
+        if _purge_timer is not None:
+            return  # A sweep is already due; it will see this change
+        _purge_timer = threading.Timer(PURGE_DELAY_SECONDS, _run_scheduled_purge)
+        _purge_timer.daemon = True
+        _purge_timer.start()
+
+
+def _run_scheduled_purge():
+    global _purge_timer
+    with _purge_timer_lock:
+        _purge_timer = None
+    purge_deleted_products()
+
+
+def _listed_product_ids():
+    """IDs of the products on any tenant's shopping list, read from the files; None if one cannot be read."""
+    listed = set()
+    for tenant in tenants.list_tenants():
+        file_path = tenants.tenant_path(tenant, SHOPPING_ITEMS_DB)
+        if not os.path.exists(file_path) or os.stat(file_path).st_size == 0:
+            continue
+        try:
+            listed.update(serializers.load_file(file_path).get('products', {}))
+        except Exception as e:
+            data_manager_logger.error(f"Error reading shopping list {file_path} while purging deleted products: {e}",
+                                      exc_info=True)
+            return None
+    return listed
+
+
+@tracing.traced
+def purge_deleted_products():
+    """Removes the products deleted from the master list that no tenant's shopping list refers to any more."""
+    try:
+        with _write_lock:
+            started = next(_deletions)
+        deleted = [product_id for product_id, record in _load_db(PRODUCTS_MASTER_DB)['products'].items()
+                   if record.get('deleted')]
+        if not deleted:
+            return 0
+        listed = _listed_product_ids()
+        if listed is None:
+            return 0
+        with _write_lock:
+            master_products = _load_db(PRODUCTS_MASTER_DB)['products']
+            purged = [product_id for product_id in deleted
+                      if product_id not in listed and master_products.get(product_id, {}).get('deleted')
+                      and _deleted_at.get(product_id, 0) < started]
+            if not purged:
+                return 0
+            products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
+            for product_id in purged:
+                del products_master_data['products'][product_id]
+                _deleted_at.pop(product_id, None)
+            if not _save_db(PRODUCTS_MASTER_DB, products_master_data):
+                return 0
+        data_manager_logger.info(f"Purged {len(purged)} deleted products no shopping list refers to.")
+        return len(purged)
+    except Exception as e:
+        _invalidate_cache(PRODUCTS_MASTER_DB)
+        data_manager_logger.error(f"Error purging deleted products: {e}", exc_info=True)
+        return 0
+
+
+@tracing.traced
+@_writer
+def migrate_to_product_ids():
+    """
+    Converts the master list and shopping list (keyed by product name) and the tracking data (keyed by
+    barcode) to the product ID schema. Each converted file is backed up with a '.v1.bak' suffix first.
+    Tracking history of products that are no longer in the master list keeps its own ID.
+    """
+    try:
+        raw = {}
+        for db_path in PRODUCT_DBS:
+            raw[db_path] = {"products": {}}
+            file_path = _db_file(db_path)
+            if os.path.exists(file_path) and os.stat(file_path).st_size > 0:
+                raw[db_path] = serializers.load_file(file_path)
+        legacy = [db_path for db_path in PRODUCT_DBS if raw[db_path].get('schema_version', 1) < SCHEMA_VERSION]
+        if not legacy:
+            return True
+        originals = {}
+        for db_path in PRODUCT_DBS:
+            file_path = _db_file(db_path)
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as f:
+                    originals[db_path] = f.read()
+        for db_path in legacy:
+            file_path = _db_file(db_path)
+            if os.path.exists(file_path):
+                shutil.copyfile(file_path, f"{file_path}.v1.bak")
+
+        # 1. Products master: name -> details becomes id -> {name, barcode, category}
+        if PRODUCTS_MASTER_DB in legacy:
+            master_products = {}
+            for name, details in raw[PRODUCTS_MASTER_DB]['products'].items():
+                master_products[uuid.uuid4().hex] = {"name": name, "barcode": details.get('barcode', ''),
+                                                     "category": details.get('category', '')}
+        else:
+            master_products = raw[PRODUCTS_MASTER_DB]['products']
+        name_to_id = {record['name']: product_id for product_id, record in master_products.items()}
+        barcode_to_id = {}
+        for product_id, record in master_products.items():
+            if record.get('barcode'):
+                barcode_to_id.setdefault(record['barcode'], product_id)
+
+        # 2. Shopping items: name -> details becomes id -> {quantity, done}
+        shopping_products = raw[SHOPPING_ITEMS_DB]['products']
+        if SHOPPING_ITEMS_DB in legacy:
+            shopping_products = {}
+            for name, details in raw[SHOPPING_ITEMS_DB]['products'].items():
+                product_id = name_to_id.get(name)
+                if product_id is None:
+                    product_id = name_to_id[name] = uuid.uuid4().hex
+                    master_products[product_id] = {"name": name, "barcode": details.get('barcode', ''),
+                                                   "category": details.get('category', '')}
+                shopping_products[product_id] = {"quantity": details.get('quantity', 1),
+                                                  "done": details.get('done', False)}
+
+        # 3. Tracking data: barcode -> {name, tracking} becomes id -> {name, barcode, tracking}
+        tracking_products = raw[TRACKING_DATA_DB]['products']
+        if TRACKING_DATA_DB in legacy:
+            tracking_products = {}
+            for barcode, details in raw[TRACKING_DATA_DB]['products'].items():
+                product_id = barcode_to_id.get(barcode) or name_to_id.get(details.get('name')) or uuid.uuid4().hex
+                entry = tracking_products.setdefault(
+                    product_id, {"name": details.get('name', ''), "barcode": barcode, "tracking": {}})
+                entry['tracking'].update(details.get('tracking', {}))
+
+        migrated = {PRODUCTS_MASTER_DB: master_products, SHOPPING_ITEMS_DB: shopping_products,
+                    TRACKING_DATA_DB: tracking_products}
+        saved = []
+        for db_path in PRODUCT_DBS:
+            if db_path in legacy or db_path == PRODUCTS_MASTER_DB:
+                if not _save_db(db_path, {"schema_version": SCHEMA_VERSION, "products": migrated[db_path]}):
+                    # The files already written refer to IDs the others do not have yet
+                    _restore_originals(saved, originals)
+                    data_manager_logger.error(f"Could not save {_db_file(db_path)}; product ID migration aborted.")
+                    return False
+                saved.append(db_path)
+        data_manager_logger.info(f"Migrated {', '.join(legacy)} to product ID schema version {SCHEMA_VERSION}.")
+        return True
+    except Exception as e:
+        _invalidate_cache(*PRODUCT_DBS)
+        data_manager_logger.error(f"Error migrating databases to product IDs: {e}", exc_info=True)
+        return False
+
+
+def _restore_originals(db_paths, originals):
+    """Puts back the files of db_paths as they were before the migration (removing those it created)."""
+    for db_path in db_paths:
+        file_path = _db_file(db_path)
+        try:
+            if db_path in originals:
+                with open(f"{file_path}.tmp", 'wb') as f:
+                    f.write(originals[db_path])
+                os.replace(f"{file_path}.tmp", file_path)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as e:
+            data_manager_logger.error(f"Error restoring {file_path} after a failed migration: {e}", exc_info=True)
+    _invalidate_cache(*PRODUCT_DBS)
+
+
 # --- Shopping Items DB Operations ---
 
+def _shopping_item_view(product_id, item, record):
+    """A shopping item as returned to callers, with name, barcode and category taken from the master record."""
+    return {
+        'id': product_id,
+        'quantity': item.get('quantity', 1),
+        'category': record.get('category', ''),
+        'barcode': record.get('barcode', ''),
+        'done': item.get('done', False)
+    }
+
+
+@tracing.traced
 def get_all_shopping_items():
+    """Returns the shopping list keyed by product name, with name, barcode and category taken from the master list."""
     try:
-        data = _load_db(SHOPPING_ITEMS_DB)
+        shopping_data = _load_db(SHOPPING_ITEMS_DB)
+        master_products = _load_db(PRODUCTS_MASTER_DB)['products']
+        products = {}
+        for product_id, item in shopping_data['products'].items():
+            record = master_products.get(product_id, {})
+            products[record.get('name', product_id)] = _shopping_item_view(product_id, item, record)
         data_manager_logger.info("Retrieved all shopping items.")
-        return data
+        return {"products": products}
     except Exception as e:
         data_manager_logger.error(f"Error retrieving all shopping items: {e}", exc_info=True)
         return {"products": {}}
 
 
+# --- Grouped Shopping List View ---
+# The shopping list grouped by category, with per-category item and done counts. It is built once from
+# the cached databases and then kept up to date by the mutations below, which re-place only the products
+# they touched. Like the databases, the view is copy-on-write: each update builds a new view that shares
+# the untouched groups with the previous one and is published by replacing it on the tenant's store.
+# Each view records the shopping list and master list versions it shows; if either database moved on by
+# more than the write being applied (e.g. it was reloaded from disk), the view is rebuilt.
+
+def _writable_group(grouped_view, category, copied):
+    """A group of a view being built that may be modified: groups shared with the previous view are copied first."""
+    groups = grouped_view['groups']
+    group = groups.get(category)
+    if group is None:
+        group = groups[category] = {'count': 0, 'done_count': 0, 'items': {}}
+    elif category not in copied:
+        group = groups[category] = {'count': group['count'], 'done_count': group['done_count'],
+                                    'items': dict(group['items'])}
+    copied.add(category)
+    return group
+
+
+def _place_in_grouped_view(grouped_view, product_id, shopping_products, master_products, copied):
+    """Moves one product to the group of its current category (or drops it if it left the list)."""
+    old_category = grouped_view['placement'].pop(product_id, None)
+    if old_category is not None:
+        group = _writable_group(grouped_view, old_category, copied)
+        _, entry = group['items'].pop(product_id)
+        group['count'] -= 1
+        group['done_count'] -= 1 if entry['done'] else 0
+        if not group['items']:
+            del grouped_view['groups'][old_category]
+
+    item = shopping_products.get(product_id)
+    if item is None:
+        return
+    record = master_products.get(product_id, {})
+    entry = _shopping_item_view(product_id, item, record)
+    group = _writable_group(grouped_view, entry['category'], copied)
+    group['items'][product_id] = (record.get('name', product_id), entry)
+    group['count'] += 1
+    group['done_count'] += 1 if entry['done'] else 0
+    grouped_view['placement'][product_id] = entry['category']
+
+
+def _refresh_grouped_view(*product_ids):
+    """
+    Returns the view of the current shopping list and master list versions. A view that is only behind
+    by the write that changed the given products is updated by re-placing them; any other stale view is
+    rebuilt. A published view is never modified.
+    """
+    shopping_entry = _load_entry(SHOPPING_ITEMS_DB)
+    master_entry = _load_entry(PRODUCTS_MASTER_DB)
+    store = _tenant_store()
+    grouped_view = store.grouped_view
+    versions = (shopping_entry['version'], master_entry['version'])
+    if grouped_view['versions'] == versions and None not in versions:
+        return grouped_view
+
+    bases = (shopping_entry['base_version'], master_entry['base_version'])
+    previous_versions = grouped_view['versions']
+    if product_ids and previous_versions and None not in previous_versions and all(
+            version in (current, base) for version, current, base in zip(previous_versions, versions, bases)):
+        grouped_view = {'versions': versions, 'groups': dict(grouped_view['groups']),
+                        'placement': dict(grouped_view['placement'])}
+    else:
+        grouped_view = {'versions': versions, 'groups': {}, 'placement': {}}
+        product_ids = shopping_entry['data']['products'].keys()
+    copied = set()
+    for product_id in product_ids:
+        _place_in_grouped_view(grouped_view, product_id, shopping_entry['data']['products'],
+                               master_entry['data']['products'], copied)
+    store.grouped_view = grouped_view
+    return grouped_view
+
+
+@tracing.traced
+def get_grouped_shopping_items():
+    """
+    Returns the shopping list grouped by category:
+    {"groups": {category: {"count", "done_count", "items": {name: item}}}, "total", "done_total"}
+    """
+    try:
+        grouped_view = _refresh_grouped_view()
+        groups = {}
+        total = done_total = 0
+        for category, group in grouped_view['groups'].items():
+            groups[category] = {"count": group['count'], "done_count": group['done_count'],
+                                "items": dict(group['items'].values())}
+            total += group['count']
+            done_total += group['done_count']
+        data_manager_logger.info("Retrieved grouped shopping items.")
+        return {"groups": groups, "total": total, "done_total": done_total}
+    except Exception as e:
+        data_manager_logger.error(f"Error retrieving grouped shopping items: {e}", exc_info=True)
+        return {"groups": {}, "total": 0, "done_total": 0}
+
+
+@tracing.traced
+@_writer
 def add_shopping_item(name, quantity, category, barcode):
     try:
-        shopping_data = _load_db(SHOPPING_ITEMS_DB)
+        # Ensure products_master.json has the product with full details; it owns name, barcode and category
+        if not add_product_to_master(name, barcode, category):
+            return False
+        product_id = get_product_id_by_name(name)
+        data_manager_logger.info(f"Product '{name}' details ensured in master list via shopping item add.")
 
-        if name in shopping_data['products']:
-            shopping_data['products'][name]['quantity'] += quantity
-            shopping_data['products'][name]['category'] = category
-            shopping_data['products'][name]['barcode'] = barcode
-            data_manager_logger.info(f"Updated shopping item '{name}' (quantity increased, category/barcode updated).")
+        shopping_data = _load_db_for_update(SHOPPING_ITEMS_DB)
+        if product_id in shopping_data['products']:
+            _writable_record(shopping_data['products'], product_id)['quantity'] += quantity
+            data_manager_logger.info(f"Updated shopping item '{name}' (quantity increased).")
         else:
-            shopping_data['products'][name] = {
-                'quantity': quantity,
-                'category': category,
-                'barcode': barcode,
-                'done': False
-            }
+            shopping_data['products'][product_id] = {'quantity': quantity, 'done': False}
             data_manager_logger.info(f"Added new shopping item '{name}'.")
 
         _save_db(SHOPPING_ITEMS_DB, shopping_data)
-
-        # Ensure products_master.json is updated with full details
-        add_product_to_master(name, barcode, category)
-        data_manager_logger.info(f"Product '{name}' details ensured in master list via shopping item add.")
+        _refresh_grouped_view(product_id)
         return True
     except Exception as e:
+        _invalidate_cache(SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error adding shopping item '{name}': {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
 def update_shopping_item(name, quantity=None, done=None, category=None):
     try:
-        shopping_data = _load_db(SHOPPING_ITEMS_DB)
-        if name in shopping_data['products']:
+        product_id = get_product_id_by_name(name)
+        shopping_data = _load_db_for_update(SHOPPING_ITEMS_DB)
+        if product_id in shopping_data['products']:
+            item = _writable_record(shopping_data['products'], product_id)
             if quantity is not None:
-                shopping_data['products'][name]['quantity'] = quantity
+                item['quantity'] = quantity
                 data_manager_logger.info(f"Updated quantity for shopping item '{name}' to {quantity}.")
+            was_done = item.get('done', False)
             if done is not None:
-                shopping_data['products'][name]['done'] = done
+                item['done'] = done
                 data_manager_logger.info(f"Updated done status for shopping item '{name}' to {done}.")
+            _save_db(SHOPPING_ITEMS_DB, shopping_data)
+            if done and not was_done:
+                get_purchase_log().record(product_id, item.get('quantity', 1))
             if category is not None:
-                shopping_data['products'][name]['category'] = category
+                products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
+                _writable_record(products_master_data['products'], product_id)['category'] = category
+                _save_db(PRODUCTS_MASTER_DB, products_master_data)
                 data_manager_logger.info(f"Updated category for shopping item '{name}' to '{category}'.")
-            _save_db(SHOPPING_ITEMS_DB, shopping_data)
+            _refresh_grouped_view(product_id)
             return True
         else:
             data_manager_logger.warning(f"Attempted to update non-existent shopping item '{name}'.")
             return False
     except Exception as e:
+        _invalidate_cache(SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error updating shopping item '{name}': {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
 def delete_shopping_item(name):
     try:
-        shopping_data = _load_db(SHOPPING_ITEMS_DB)
-        if name in shopping_data['products']:
-            del shopping_data['products'][name]
+        product_id = get_product_id_by_name(name)
+        shopping_data = _load_db_for_update(SHOPPING_ITEMS_DB)
+        if product_id in shopping_data['products']:
+            del shopping_data['products'][product_id]
             _save_db(SHOPPING_ITEMS_DB, shopping_data)
+            _schedule_purge()
+            _refresh_grouped_view(product_id)
             data_manager_logger.info(f"Deleted shopping item '{name}'.")
             return True
         else:
             data_manager_logger.warning(f"Attempted to delete non-existent shopping item '{name}'.")
             return False
     except Exception as e:
+        _invalidate_cache(SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error deleting shopping item '{name}': {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
 def clear_done_shopping_items():
     try:
-        shopping_data = _load_db(SHOPPING_ITEMS_DB)
-        products_to_keep = {name: details for name, details in shopping_data['products'].items() if
-                            not details.get('done', False)}
-        shopping_data['products'] = products_to_keep
+        shopping_data = _load_db_for_update(SHOPPING_ITEMS_DB)
+        done_ids = [product_id for product_id, details in shopping_data['products'].items()
+                    if details.get('done', False)]
+        for product_id in done_ids:
+            del shopping_data['products'][product_id]
         _save_db(SHOPPING_ITEMS_DB, shopping_data)
+        _schedule_purge()
+        _refresh_grouped_view(*done_ids)
         data_manager_logger.info("Cleared all done shopping items.")
         return True
     except Exception as e:
+        _invalidate_cache(SHOPPING_ITEMS_DB, PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error clearing done shopping items: {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
+def checkout_shopping_items(items, clear_done=False):
+    """
+    Finalizes a shopping trip in one go. items is a list of {"name", "price", "quantity"} (price and
+    quantity may be None): each product is marked done on the shopping list, with the quantity bought,
+    and its price is recorded for today. With clear_done, every done item then leaves the list.
+    The shopping list, the tracking data and the purchase log are each written once, however many items
+    there are. The trip is applied entirely or not at all: the tracking data is written first and put
+    back if the shopping list then cannot be saved.
+    Returns {"total", "checked_out", "priced", "cleared", "missing"} (missing: names not in the master
+    list), or None if the checkout failed.
+    """
+    try:
+        master_products = _load_db(PRODUCTS_MASTER_DB)['products']
+        shopping_data = _load_db_for_update(SHOPPING_ITEMS_DB)
+        tracking_data_db = None
+        previous_tracking = None
+        current_date = datetime.now().strftime('%d/%m/%Y')
+        purchases = []
+        written_ids = set()  # Products whose shopping list record this checkout changed
+        prices = []  # (product ID, name, price, tracking history before it)
+        missing = []
+        total = 0.0
+        priced = 0
+        for item in items:
+            product_id = get_product_id_by_name(item['name'])
+            record = master_products.get(product_id)
+            if record is None:
+                missing.append(item['name'])
+                continue
+            quantity = item.get('quantity')
+            if product_id in shopping_data['products']:
+                shopping_item = _writable_record(shopping_data['products'], product_id)
+                written_ids.add(product_id)
+                if quantity is not None:
+                    shopping_item['quantity'] = quantity
+                quantity = shopping_item.get('quantity', 1)
+                if not shopping_item.get('done', False):
+                    shopping_item['done'] = True
+                    purchases.append((product_id, quantity))
+            if item.get('price') is not None:
+                price = float(item['price'])
+                if tracking_data_db is None:
+                    previous_tracking = _load_db(TRACKING_DATA_DB)
+                    tracking_data_db = _load_db_for_update(TRACKING_DATA_DB)
+                prices.append((product_id, record['name'], price,
+                               tracking_data_db['products'].get(product_id, {}).get('tracking')))
+                _add_price_entry(tracking_data_db['products'], product_id, record, price, current_date)
+                total += price * (quantity if quantity is not None else 1)
+                priced += 1
+
+        cleared_ids = []
+        if clear_done:
+            cleared_ids = [product_id for product_id, details in shopping_data['products'].items()
+                           if details.get('done', False)]
+            for product_id in cleared_ids:
+                del shopping_data['products'][product_id]
+
+        if tracking_data_db is not None and not _save_db(TRACKING_DATA_DB, tracking_data_db):
+            data_manager_logger.error("Checkout failed: the tracking data could not be saved; nothing was changed.")
+            return None
+        if not _save_db(SHOPPING_ITEMS_DB, shopping_data):
+            if tracking_data_db is not None and not _save_db(TRACKING_DATA_DB, previous_tracking):
+                data_manager_logger.error("Checkout failed, and the prices it recorded could not be removed again.")
+            data_manager_logger.error("Checkout failed: the shopping list could not be saved.")
+            return None
+        for product_id, name, price, history in prices:
+            _check_price_alerts(product_id, name, current_date, price, history)
+        get_purchase_log().record_many(purchases)
+        if cleared_ids:
+            _schedule_purge()
+        _refresh_grouped_view(*written_ids, *cleared_ids)
+
+        data_manager_logger.info(
+            f"Checked out {len(items) - len(missing)} items ({priced} priced, total {total:.2f}), "
+            f"cleared {len(cleared_ids)} done items.")
+        return {"total": round(total, 2), "checked_out": len(items) - len(missing), "priced": priced,
+                "cleared": len(cleared_ids), "missing": missing}
+    except Exception as e:
+        _invalidate_cache(SHOPPING_ITEMS_DB, TRACKING_DATA_DB)
+        data_manager_logger.error(f"Error checking out shopping items: {e}", exc_info=True)
+        return None
+
+
 # --- Products Master DB Operations ---
 
+@tracing.traced
 def get_product_from_master_by_barcode(barcode):
     try:
         products_master_data = _load_db(PRODUCTS_MASTER_DB)
-        for name, details in products_master_data['products'].items():
-            if details.get('barcode') == barcode and barcode:
-                data_manager_logger.info(f"Found product '{name}' by barcode '{barcode}' in master list.")
-                return name, details
-        data_manager_logger.info(f"Product not found by barcode '{barcode}' in master list.")
+        product_id = get_product_id_by_barcode(barcode)
+        if product_id is not None:
+            record = products_master_data['products'][product_id]
+            data_manager_logger.info(f"Found product '{record['name']}' by barcode '{barcode}' in master list.",
+                                     extra={'barcode': barcode, 'product_id': product_id})
+            return record['name'], _public_product(product_id, record)
+        data_manager_logger.info(f"Product not found by barcode '{barcode}' in master list.", extra={'barcode': barcode})
         return None, None
     except Exception as e:
         data_manager_logger.error(f"Error getting product from master by barcode '{barcode}': {e}", exc_info=True)
         return None, None
 
 
+@tracing.traced
 def get_product_from_master_by_name(name_to_find):
     try:
         products_master_data = _load_db(PRODUCTS_MASTER_DB)
-        for name, details in products_master_data['products'].items():
-            if name == name_to_find:
-                data_manager_logger.info(f"Found product '{name_to_find}' by name in master list.")
-                return name, details
+        product_id = get_product_id_by_name(name_to_find)
+        record = products_master_data['products'].get(product_id)
+        if record is not None and not record.get('deleted'):
+            data_manager_logger.info(f"Found product '{name_to_find}' by name in master list.")
+            return name_to_find, _public_product(product_id, record)
         data_manager_logger.info(f"Product '{name_to_find}' not found by name in master list.")
         return None, None
     except Exception as e:
@@ -233,11 +1065,26 @@ def get_product_from_master_by_name(name_to_find):
         return None, None
 
 
+@tracing.traced
+def get_product_from_master_by_id(product_id):
+    try:
+        record = _load_db(PRODUCTS_MASTER_DB)['products'].get(product_id)
+        if record is not None and not record.get('deleted'):
+            return record['name'], _public_product(product_id, record)
+        data_manager_logger.info(f"Product ID '{product_id}' not found in master list.")
+        return None, None
+    except Exception as e:
+        data_manager_logger.error(f"Error getting product from master by ID '{product_id}': {e}", exc_info=True)
+        return None, None
+
+
+@tracing.traced
 def get_all_products_from_master():
     try:
         products_master_data = _load_db(PRODUCTS_MASTER_DB)
-        all_products = [{"name": name, "barcode": details.get("barcode", ""), "category": details.get("category", "")}
-                        for name, details in products_master_data['products'].items()]
+        all_products = [_public_product(product_id, record)
+                        for product_id, record in products_master_data['products'].items()
+                        if not record.get('deleted')]
         data_manager_logger.info("Retrieved all products from master list.")
         return {"products": all_products}
     except Exception as e:
@@ -245,12 +1092,33 @@ def get_all_products_from_master():
         return {"products": []}
 
 
+@tracing.traced
+def get_master_barcode_table():
+    """
+    Returns (version, {barcode: (name, category)}) for the live products of the master list that have a
+    barcode, the first product carrying a barcode winning. Valid EAN/UPC barcodes are keyed by their
+    integer form (catalogue_store.encode_barcode), other barcodes by the string. The table is built once
+    per version of the master list and must not be modified; version is None if the list is not cached.
+    """
+    try:
+        entry = _load_entry(PRODUCTS_MASTER_DB)
+        return entry['version'], _entry_index(PRODUCTS_MASTER_DB, entry, 'barcode_table')
+    except Exception as e:
+        data_manager_logger.error(f"Error building the barcode table of the master list: {e}", exc_info=True)
+        return None, {}
+
+
+@tracing.traced
+@_writer
 def add_product_to_master(product_name, barcode, category=None):
     try:
-        products_master_data = _load_db(PRODUCTS_MASTER_DB)
+        product_id = get_product_id_by_name(product_name)
+        new_product_id = _new_product_id(barcode) if product_id is None else None
+        products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
 
-        if product_name in products_master_data['products']:
-            master_product = products_master_data['products'][product_name]
+        if product_id is not None:
+            master_product = _writable_record(products_master_data['products'], product_id)
+            master_product.pop('deleted', None)
             if barcode:
                 master_product['barcode'] = barcode
             if category is not None:
@@ -258,7 +1126,8 @@ def add_product_to_master(product_name, barcode, category=None):
             data_manager_logger.info(
                 f"Updated existing product '{product_name}' in master list (barcode: {barcode}, category: {category}).")
         else:
-            products_master_data['products'][product_name] = {
+            products_master_data['products'][new_product_id] = {
+                "name": product_name,
                 "barcode": barcode,
                 "category": category if category is not None else ""
             }
@@ -266,150 +1135,172 @@ def add_product_to_master(product_name, barcode, category=None):
                 f"Added new product '{product_name}' to master list (barcode: {barcode}, category: {category}).")
 
         if _save_db(PRODUCTS_MASTER_DB, products_master_data):
+            _refresh_grouped_view(product_id or new_product_id)
             return True
         else:
             data_manager_logger.error(f"Failed to save product '{product_name}' to master database.")
             return False
     except Exception as e:
+        _invalidate_cache(PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error adding/updating product '{product_name}' to master: {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
 def update_product_name_and_category(old_name, new_name, new_category, barcode):
     try:
-        products_master_data = _load_db(PRODUCTS_MASTER_DB)
-        shopping_data = _load_db(SHOPPING_ITEMS_DB)
+        product_id = get_product_id_by_name(old_name)
+        products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
 
-        # 1. Update Products Master DB
-        if old_name not in products_master_data['products']:
+        if product_id is None or products_master_data['products'][product_id].get('deleted'):
             data_manager_logger.error(
                 f"Product '{old_name}' not found in master list for update_product_name_and_category.")
             return False
 
-        if old_name == new_name:
-            products_master_data['products'][old_name]['category'] = new_category
-            if barcode:
-                products_master_data['products'][old_name]['barcode'] = barcode
-            data_manager_logger.info(f"Updated category/barcode for master product '{old_name}' (no name change).")
-        else:
-            old_master_details = products_master_data['products'].pop(old_name)
-
-            if new_name in products_master_data['products']:
-                data_manager_logger.error(
-                    f"New product name '{new_name}' already exists in master list. Cannot rename '{old_name}'.")
-                products_master_data['products'][old_name] = old_master_details  # Re-add to maintain state
-                _save_db(PRODUCTS_MASTER_DB, products_master_data)  # Save previous state
-                return False
-
-            old_master_details['barcode'] = barcode if barcode else old_master_details.get('barcode', '')
-            old_master_details['category'] = new_category
-            products_master_data['products'][new_name] = old_master_details
-            data_manager_logger.info(f"Renamed and updated master product from '{old_name}' to '{new_name}'.")
+        if old_name != new_name and get_product_id_by_name(new_name) is not None:
+            data_manager_logger.error(
+                f"New product name '{new_name}' already exists in master list. Cannot rename '{old_name}'.")
+            return False
 
+        # The shopping list refers to the product by ID, so only the master record changes
+        record = _writable_record(products_master_data['products'], product_id)
+        record['name'] = new_name
+        record['category'] = new_category
+        if barcode:
+            record['barcode'] = barcode
         _save_db(PRODUCTS_MASTER_DB, products_master_data)
-
-        # 2. Update Shopping Items DB
-        if old_name in shopping_data['products']:
-            if old_name == new_name:
-                shopping_data['products'][old_name]['category'] = new_category
-                if barcode:
-                    shopping_data['products'][old_name]['barcode'] = barcode
-                data_manager_logger.info(f"Updated category/barcode for shopping item '{old_name}' (no name change).")
-            else:
-                old_shopping_details = shopping_data['products'].pop(old_name)
-                old_shopping_details['category'] = new_category
-                old_shopping_details['barcode'] = barcode if barcode else old_shopping_details.get('barcode', '')
-                shopping_data['products'][new_name] = old_shopping_details
-                data_manager_logger.info(f"Renamed and updated shopping item from '{old_name}' to '{new_name}'.")
-            _save_db(SHOPPING_ITEMS_DB, shopping_data)
-        else:
-            data_manager_logger.warning(
-                f"Product '{old_name}' not found in shopping list during update_product_name_and_category; master update proceeded.")
+        _refresh_grouped_view(product_id)
 
         data_manager_logger.info(
             f"Successfully updated product '{old_name}' to '{new_name}' with category '{new_category}'.")
         return True
     except Exception as e:
+        _invalidate_cache(PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error updating product name and category for '{old_name}': {e}", exc_info=True)
         return False
 
 
 # --- Tracking Data DB Operations ---
 
-def record_product_price_entry(name, barcode, price):
+def _add_price_entry(tracking_products, product_id, record, price, date):
+    """Sets a product's price for a date in a copy of the tracking data (see _load_db_for_update)."""
+    name, barcode = record['name'], record.get('barcode', '')
+    if product_id not in tracking_products:
+        tracking_products[product_id] = {'name': name, 'barcode': barcode, 'tracking': {}}
+        data_manager_logger.info(f"Initialized tracking for product '{name}' (ID: {product_id}).")
+    else:
+        # Keep a copy of name and barcode so the history stays readable if the product is deleted
+        tracked = _writable_record(tracking_products, product_id)
+        tracked['name'] = name
+        tracked['barcode'] = barcode
+        tracked['tracking'] = dict(tracked['tracking'])
+    tracking_products[product_id]['tracking'][date] = {"price": price}
+
+
+@tracing.traced
+@_writer
+def record_product_price_entry(product_id, price):
     try:
-        tracking_data_db = _load_db(TRACKING_DATA_DB)
-
-        if barcode not in tracking_data_db['products']:
-            tracking_data_db['products'][barcode] = {'name': name, 'tracking': {}}
-            data_manager_logger.info(f"Initialized tracking for new barcode '{barcode}' with product name '{name}'.")
-        else:
-            tracking_data_db['products'][barcode]['name'] = name  # Update name in case it changed
-            data_manager_logger.info(f"Updated name for existing tracking entry of barcode '{barcode}' to '{name}'.")
-
+        price = float(price)
+        record = _load_db(PRODUCTS_MASTER_DB)['products'].get(product_id)
+        if record is None:
+            data_manager_logger.error(f"Cannot record price for unknown product ID '{product_id}'.")
+            return False
+        name, barcode = record['name'], record.get('barcode', '')
+        tracking_data_db = _load_db_for_update(TRACKING_DATA_DB)
         current_date = datetime.now().strftime('%d/%m/%Y')
-        tracking_data_db['products'][barcode]['tracking'][current_date] = {"price": float(price)}
+        history = tracking_data_db['products'].get(product_id, {}).get('tracking')
+        _add_price_entry(tracking_data_db['products'], product_id, record, price, current_date)
 
         if _save_db(TRACKING_DATA_DB, tracking_data_db):
             data_manager_logger.info(
-                f"Recorded price '{price}' for product '{name}' (barcode: {barcode}) on {current_date}.")
+                f"Recorded price '{price}' for product '{name}' (barcode: {barcode}) on {current_date}.",
+                extra={'barcode': barcode, 'product_id': product_id})
+            _check_price_alerts(product_id, name, current_date, price, history)
             return True
         else:
             data_manager_logger.error(f"Failed to save price record for product '{name}' (barcode: {barcode}).")
             return False
     except Exception as e:
-        data_manager_logger.error(f"Error recording product price entry for '{name}' (barcode: {barcode}): {e}",
+        _invalidate_cache(TRACKING_DATA_DB)
+        data_manager_logger.error(f"Error recording product price entry for product ID '{product_id}': {e}",
                                   exc_info=True)
         return False
 
 
-def get_tracking_history_by_barcode(barcode):
+@tracing.traced
+def get_tracking_history(product_id):
     try:
-        tracking_data_db = _load_db(TRACKING_DATA_DB)
-        product_tracking_info = tracking_data_db['products'].get(barcode, {})
+        product_tracking_info = _load_db(TRACKING_DATA_DB)['products'].get(product_id, {})
 
         if 'tracking' in product_tracking_info:
             sorted_tracking = sorted(product_tracking_info['tracking'].items(),
                                      key=lambda item: datetime.strptime(item[0], '%d/%m/%Y'))
-            name_from_tracking = product_tracking_info.get('name', 'שם לא ידוע')
-            data_manager_logger.info(f"Retrieved tracking history for barcode '{barcode}'.")
+            record = _load_db(PRODUCTS_MASTER_DB)['products'].get(product_id, {})
+            name_from_tracking = record.get('name') or product_tracking_info.get('name') or 'שם לא ידוע'
+            data_manager_logger.info(f"Retrieved tracking history for product ID '{product_id}'.")
             return sorted_tracking, name_from_tracking
         else:
-            data_manager_logger.info(f"No tracking history found for barcode '{barcode}'.")
+            data_manager_logger.info(f"No tracking history found for product ID '{product_id}'.")
             return [], 'שם לא ידוע'
     except Exception as e:
-        data_manager_logger.error(f"Error getting tracking history for barcode '{barcode}': {e}", exc_info=True)
+        data_manager_logger.error(f"Error getting tracking history for product ID '{product_id}': {e}", exc_info=True)
         return [], 'שם לא ידוע'
 
 
+@tracing.traced
+def get_tracking_history_by_barcode(barcode):
+    # Fall back to the tracking data's own barcode index for products no longer in the master list
+    product_id = get_product_id_by_barcode(barcode) or _get_index(TRACKING_DATA_DB, 'barcode').get(barcode)
+    return get_tracking_history(product_id)
+
+
 # --- Products Master DB Operations (Existing functions) ---
 
+@tracing.traced
+@_writer
 def delete_product_from_master(name):
     try:
-        products_master_data = _load_db(PRODUCTS_MASTER_DB)
-        if name in products_master_data['products']:
-            del products_master_data['products'][name]
-            _save_db(PRODUCTS_MASTER_DB, products_master_data)
+        product_id = get_product_id_by_name(name)
+        products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
+        record = products_master_data['products'].get(product_id)
+        if record is not None and not record.get('deleted'):
+            # Hidden until the purge sweep finds it on no tenant's shopping list (see purge_deleted_products)
+            _writable_record(products_master_data['products'], product_id)['deleted'] = True
+            if not _save_db(PRODUCTS_MASTER_DB, products_master_data):
+                return False
+            _deleted_at[product_id] = next(_deletions)
+            _schedule_purge()
             data_manager_logger.info(f"Deleted product '{name}' from master list.")
             return True
         else:
             data_manager_logger.warning(f"Attempted to delete non-existent product '{name}' from master list.")
             return False
     except Exception as e:
+        _invalidate_cache(PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error deleting product '{name}' from master list: {e}", exc_info=True)
         return False
 
 
+@tracing.traced
+@_writer
 def update_product_in_master(old_name, new_name, new_category, new_barcode):
     try:
-        products_master_data = _load_db(PRODUCTS_MASTER_DB)
+        product_id = get_product_id_by_name(old_name)
+        products_master_data = _load_db_for_update(PRODUCTS_MASTER_DB)
 
-        if old_name not in products_master_data['products']:
+        if product_id is None or products_master_data['products'][product_id].get('deleted'):
             data_manager_logger.error(f"Product '{old_name}' not found in master list for update_product_in_master.")
             return False
 
+        if old_name != new_name and get_product_id_by_name(new_name) is not None:
+            data_manager_logger.error(
+                f"New product name '{new_name}' already exists in master list. Cannot update '{old_name}'.")
+            return False
+
         # Get current data for the product before any changes
-        current_product_data = products_master_data['products'][old_name]
+        current_product_data = _writable_record(products_master_data['products'], product_id)
         current_barcode = current_product_data.get('barcode', '')
         current_category = current_product_data.get('category', '')
 
@@ -420,31 +1311,143 @@ def update_product_in_master(old_name, new_name, new_category, new_barcode):
         # If new_category is provided, use it; otherwise, retain the current category
         category_to_use = new_category if new_category is not None else current_category
 
-
-        if old_name != new_name:
-            if new_name in products_master_data['products']:
-                data_manager_logger.error(
-                    f"New product name '{new_name}' already exists in master list. Cannot update '{old_name}'.")
-                return False
-
-            # Delete the old entry and add the new one with updated details
-            del products_master_data['products'][old_name]
-            products_master_data['products'][new_name] = {'barcode': barcode_to_use, 'category': category_to_use}
-            data_manager_logger.info(
-                f"Renamed master product from '{old_name}' to '{new_name}', updated barcode to '{barcode_to_use}', and category to '{category_to_use}'.")
-        else:
-            # If the name hasn't changed, just update barcode and category in place
-            products_master_data['products'][new_name]['barcode'] = barcode_to_use
-            products_master_data['products'][new_name]['category'] = category_to_use
-            data_manager_logger.info(
-                f"Updated barcode to '{barcode_to_use}' and category to '{category_to_use}' for master product '{new_name}'.")
-
+        # The product keeps its ID, so a rename only rewrites this one record
+        current_product_data['name'] = new_name
+        current_product_data['barcode'] = barcode_to_use
+        current_product_data['category'] = category_to_use
+        data_manager_logger.info(
+            f"Updated master product '{old_name}' to name '{new_name}', barcode '{barcode_to_use}' and category '{category_to_use}'.")
 
         if _save_db(PRODUCTS_MASTER_DB, products_master_data):
+            _refresh_grouped_view(product_id)
             return True
         else:
             data_manager_logger.error(f"Failed to save updated product '{new_name}' to master database.")
             return False
     except Exception as e:
+        _invalidate_cache(PRODUCTS_MASTER_DB)
         data_manager_logger.error(f"Error updating product in master from '{old_name}': {e}", exc_info=True)
         return False
+
+
+# --- Purchase History and Restock Suggestions ---
+# Every shopping item marked done is a purchase event. The events are appended to a log, and per-product
+# purchase statistics (usual interval, last purchase, typical quantity) are updated as they arrive.
+# Each tenant has its own purchase log, held in its store.
+
+def get_purchase_log():
+    """The purchase history of the current tenant."""
+    return _tenant_store().purchase_log
+
+
+@tracing.traced
+def get_restock_suggestions(limit=None):
+    """
+    Returns products that are probably running low: bought regularly, not on the shopping list, and
+    due (or overdue) by their usual interval between purchases. Most overdue first.
+    """
+    try:
+        now = time.time()
+        shopping_products = _load_db(SHOPPING_ITEMS_DB)['products']
+        master_products = _load_db(PRODUCTS_MASTER_DB)['products']
+        suggestions = []
+        purchase_log = get_purchase_log()
+        for product_id, stats, due_in_days in purchase_log.due_products(now, purchase_history.RESTOCK_DUE_FRACTION):
+            record = master_products.get(product_id)
+            if product_id in shopping_products or record is None or record.get('deleted'):
+                continue
+            suggestion = _public_product(product_id, record)
+            suggestion.update({
+                "quantity": max(1, round(stats.quantity_ewma)),
+                "last_purchase": datetime.fromtimestamp(stats.last_purchase).strftime('%d/%m/%Y'),
+                "interval_days": round(stats.interval_ewma / purchase_history.SECONDS_PER_DAY, 1),
+                "due_in_days": round(due_in_days, 1),
+            })
+            suggestions.append(suggestion)
+        suggestions.sort(key=lambda suggestion: suggestion['due_in_days'])
+        data_manager_logger.info(f"Computed {len(suggestions)} restock suggestions.")
+        return suggestions[:limit] if limit else suggestions
+    except Exception as e:
+        data_manager_logger.error(f"Error computing restock suggestions: {e}", exc_info=True)
+        return []
+
+
+# --- Price Alerts ---
+# Rules watching product prices are stored per tenant in PRICE_ALERT_RULES_DB ({"rules": {rule ID: rule}}).
+# Each recorded price is checked against the rules of its product only (found through the 'product'
+# index), using running aggregates held in the tenant's store, so a write's cost does not depend on how
+# many rules there are. Fired alerts, up to price_alerts.PRICE_ALERTS_KEPT per tenant, are written to
+# PRICE_ALERTS_LOG as they fire, so they outlive restarts and the tenant's store being closed.
+
+def _check_price_alerts(product_id, name, date, price, history):
+    """Evaluates the rules watching a product against a price just recorded (history: its tracking before)."""
+    try:
+        rules = _get_index(PRICE_ALERT_RULES_DB, 'product').get(product_id)
+        if rules:
+            _tenant_store().price_alerts.observe(product_id, name, date, price, rules, history)
+    except Exception as e:
+        data_manager_logger.error(f"Error checking price alerts for product ID '{product_id}': {e}", exc_info=True)
+
+
+@tracing.traced
+def get_price_alert_rules():
+    try:
+        return list(_load_db(PRICE_ALERT_RULES_DB)['rules'].values())
+    except Exception as e:
+        data_manager_logger.error(f"Error retrieving price alert rules: {e}", exc_info=True)
+        return []
+
+
+@tracing.traced
+@_writer
+def add_price_alert_rules(rules):
+    """
+    Adds rules validated by price_alerts.parse_rule, in one write. Returns {"added": [rules with their
+    IDs], "missing": [product IDs not in the master list]}, or None if the rules could not be saved.
+    """
+    try:
+        master_products = _load_db(PRODUCTS_MASTER_DB)['products']
+        rules_data = _load_db_for_update(PRICE_ALERT_RULES_DB)
+        added, missing = [], []
+        for rule in rules:
+            record = master_products.get(rule['product_id'])
+            if record is None or record.get('deleted'):
+                missing.append(rule['product_id'])
+                continue
+            rule = dict(rule, id=uuid.uuid4().hex, created=datetime.now().isoformat(timespec='seconds'))
+            rules_data['rules'][rule['id']] = rule
+            added.append(rule)
+        if added and not _save_db(PRICE_ALERT_RULES_DB, rules_data):
+            return None
+        data_manager_logger.info(f"Added {len(added)} price alert rules ({len(missing)} for unknown products).")
+        return {"added": added, "missing": missing}
+    except Exception as e:
+        _invalidate_cache(PRICE_ALERT_RULES_DB)
+        data_manager_logger.error(f"Error adding price alert rules: {e}", exc_info=True)
+        return None
+
+
+@tracing.traced
+@_writer
+def delete_price_alert_rule(rule_id):
+    try:
+        rules_data = _load_db_for_update(PRICE_ALERT_RULES_DB)
+        rule = rules_data['rules'].pop(rule_id, None)
+        if rule is None:
+            data_manager_logger.info(f"Price alert rule '{rule_id}' not found for deletion.")
+            return False
+        if not _save_db(PRICE_ALERT_RULES_DB, rules_data):
+            return False
+        if not _get_index(PRICE_ALERT_RULES_DB, 'product').get(rule['product_id']):
+            _tenant_store().price_alerts.forget(rule['product_id'])
+        data_manager_logger.info(f"Deleted price alert rule '{rule_id}' (product ID: {rule['product_id']}).")
+        return True
+    except Exception as e:
+        _invalidate_cache(PRICE_ALERT_RULES_DB)
+        data_manager_logger.error(f"Error deleting price alert rule '{rule_id}': {e}", exc_info=True)
+        return False
+
+
+def get_price_alerts(since=0, limit=None):
+    """Alerts fired for the current tenant with an ID above since, oldest first."""
+    return _tenant_store().price_alerts.recent(since, limit)
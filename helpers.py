@@ -1,5 +1,6 @@
 import os
-import json
+
+import serializers
 
 
 DB_FILE = 'databases/db.json'
@@ -9,18 +10,17 @@ DB_FILE = 'databases/db.json'
 def load_data():
     if not os.path.exists(DB_FILE) or os.stat(DB_FILE).st_size == 0:
         return {"products": {}, "total": 0}
-    with open(DB_FILE, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            # Handle empty or malformed JSON gracefully
-            return {"products": {}, "total": 0}
+    try:
+        return serializers.load_file(DB_FILE)  # JSON or msgpack, see serializers.py
+    except serializers.DecodeError:
+        # Handle empty or malformed JSON gracefully
+        return {"products": {}, "total": 0}
 
 
-# Save shopping list data to JSON
+# Save shopping list data in the configured database format
 def save_data(data):
-    with open(DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    with open(DB_FILE, 'wb') as f:
+        f.write(serializers.dumps(data))
 
 
 # Helper function to find a product by its barcode
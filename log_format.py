@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import time
+
+# --- Log Format Configuration ---
+# 'text' writes the classic "timestamp - LEVEL - message" lines; 'jsonl' writes one JSON object per line.
+# Readers accept both, so the setting can be switched without converting existing log files.
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is written as a field
+_STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON line:
+    {"ts": 1750106535.123, "time": "2025-06-16 23:42:15,123", "level": "info", "logger": "server_logs",
+     "message": "...", "barcode": "...", "route": "/api/...", "exc": "Traceback ..."}
+    "ts" is the epoch timestamp; "time" is the same instant in the text format's layout, so readers can
+    display and sort entries without parsing dates.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": int(record.created * 1000) / 1000,
+            "time": self.formatTime(record),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the HTTP method and route of the current Flask request (if any) to every record."""
+
+    def filter(self, record):
+        try:
+            from flask import has_request_context, request
+            if has_request_context():
+                record.method = request.method
+                record.route = request.path
+        except ImportError:
+            pass
+        return True
+
+
+def make_formatter():
+    """Returns the formatter for the configured LOG_FORMAT."""
+    if LOG_FORMAT == 'jsonl':
+        return JsonLinesFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def configure_handler(handler):
+    """Applies the configured format (and request context fields) to a log handler."""
+    handler.setFormatter(make_formatter())
+    handler.addFilter(RequestContextFilter())
+    return handler
+
+
+def parse_log_line(line):
+    """
+    Parses one log line in either format. Returns a dict with timestamp, level, message and any extra
+    fields, or None for a line that does not start an entry (e.g. a traceback line in a text log).
+    """
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        fields = {key: value for key, value in entry.items()
+                  if key not in ('ts', 'time', 'level', 'logger', 'message', 'exc')}
+        message = entry.get('message', '')
+        if entry.get('exc'):
+            message = f"{message}\n{entry['exc']}"
+        return {"timestamp": entry.get('time') or _format_epoch(entry.get('ts', 0)), "ts": entry.get('ts'),
+                "level": entry.get('level', 'info'), "message": message, "fields": fields}
+
+    # Text format: "YYYY-MM-DD HH:MM:SS,mmm - LEVEL - message". The timestamp string is kept as is; its
+    # layout sorts chronologically as a plain string.
+    parts = line.split(' - ', 2)
+    if len(parts) != 3 or len(parts[0]) != 23 or parts[0][4] != '-' or parts[0][19] != ',':
+        return None
+    return {"timestamp": parts[0], "ts": None, "level": parts[1].lower(), "message": parts[2], "fields": {}}
+
+
+def _format_epoch(ts):
+    seconds = int(ts)
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))},{int((ts - seconds) * 1000):03d}"
@@ -0,0 +1,275 @@
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+import log_format
+
+# --- Log Index Configuration ---
+# How often (seconds) the background tailer picks up new log lines; 0 disables it (queries still refresh).
+LOG_INDEX_TAIL_INTERVAL_SECONDS = float(os.environ.get('LOG_INDEX_TAIL_INTERVAL_SECONDS', '5'))
+# Maximum number of log entries returned by one search.
+LOG_SEARCH_MAX_RESULTS = int(os.environ.get('LOG_SEARCH_MAX_RESULTS', '500'))
+
+# "2025-06-16 23:42:15,123 - INFO - message" (the text format; JSONL records start with "{")
+_ENTRY_START = re.compile(rb'^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d),(\d{3}) - ([A-Z]+) - ')
+# Words, numbers and barcodes, in any script (product names are mostly Hebrew)
+_TOKEN = re.compile(r'\w+')
+
+LEVELS = ['debug', 'info', 'warning', 'error', 'critical']
+
+
+def tokenize(text):
+    return {token.lower() for token in _TOKEN.findall(text)}
+
+
+def _contains(posting, entry_id):
+    position = bisect_left(posting, entry_id)
+    return position < len(posting) and posting[position] == entry_id
+
+
+class LogFileIndex:
+    """
+    Inverted index over one log file. Entries (a log line plus any traceback lines following it) are
+    numbered in file order; for each entry only its byte range, timestamp and level are kept in memory,
+    and messages are read back from the file when they are returned. Each refresh() indexes only the
+    bytes appended since the previous one.
+    """
+
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+        self._reset()
+
+    def _reset(self):
+        self.inode = None
+        self.offset = 0  # bytes of the file consumed so far (always at a line boundary)
+        self.starts = array('Q')  # byte offset where each entry starts
+        self.ends = array('Q')  # byte offset just past each entry
+        self.timestamps = array('d')  # epoch seconds per entry
+        self.levels = array('B')  # index into LEVELS per entry
+        self.postings = {}  # token -> array of entry ids, ascending
+        self.level_postings = {level: array('I') for level in range(len(LEVELS))}
+        self.time_sorted = True  # False if some entry is older than the one before it
+        self._minute_cache = {}  # b"YYYY-MM-DD HH:MM" -> epoch seconds
+
+    def refresh(self):
+        """Indexes whatever was appended to the file since the last refresh. Starts over if it was rotated."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self._reset()
+            self.inode = st.st_ino
+        if st.st_size == self.offset:
+            return 0
+
+        added = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            position = self.offset
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Partially written line; picked up on the next refresh
+                added += self._index_line(line, position)
+                position += len(line)
+            self.offset = position
+        return added
+
+    def _index_line(self, line, position):
+        if line.startswith(b'{'):
+            return self._index_json_line(line, position)
+        match = _ENTRY_START.match(line)
+        if match is None:
+            # Continuation of the previous entry (e.g. a traceback from exc_info=True)
+            if self.starts:
+                entry_id = len(self.starts) - 1
+                self.ends[entry_id] = position + len(line)
+                self._add_tokens(entry_id, line.decode('utf-8', errors='replace'))
+            return 0
+
+        # Lines from the same minute share the expensive part of the timestamp conversion
+        minute_start = self._minute_cache.get(line[:16])
+        if minute_start is None:
+            year, month, day, hour, minute = (int(group) for group in match.groups()[:5])
+            minute_start = self._minute_cache[line[:16]] = datetime(year, month, day, hour, minute).timestamp()
+            if len(self._minute_cache) > 4096:
+                self._minute_cache.clear()
+        timestamp = minute_start + int(match.group(6)) + int(match.group(7)) / 1000
+        level_name = match.group(8).decode('ascii').lower()
+        level = LEVELS.index(level_name) if level_name in LEVELS else LEVELS.index('info')
+
+        self._add_entry(position, line, timestamp, level, line[match.end():].decode('utf-8', errors='replace'))
+        return 1
+
+    def _index_json_line(self, line, position):
+        """Indexes a JSONL record (see log_format.py): its epoch timestamp, level, message and field values."""
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return 0
+        level_name = str(entry.get('level', 'info')).lower()
+        level = LEVELS.index(level_name) if level_name in LEVELS else LEVELS.index('info')
+        text = ' '.join(str(value) for key, value in entry.items() if key not in ('ts', 'time', 'level'))
+        self._add_entry(position, line, float(entry.get('ts', 0)), level, text)
+        return 1
+
+    def _add_entry(self, position, line, timestamp, level, text):
+        entry_id = len(self.starts)
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            self.time_sorted = False
+        self.starts.append(position)
+        self.ends.append(position + len(line))
+        self.timestamps.append(timestamp)
+        self.levels.append(level)
+        self.level_postings[level].append(entry_id)
+        self._add_tokens(entry_id, text)
+
+    def _add_tokens(self, entry_id, text):
+        for token in tokenize(text):
+            posting = self.postings.get(token)
+            if posting is None:
+                self.postings[token] = array('I', [entry_id])
+            elif posting[-1] != entry_id:
+                posting.append(entry_id)
+
+    def search(self, tokens, level=None, start=None, end=None, limit=None):
+        """
+        Returns ids (ascending) of entries containing all tokens, at the given level, with
+        start <= timestamp < end. While entries are in time order only the newest `limit` are returned.
+        """
+        level_id = LEVELS.index(level) if level is not None else None
+        low = start if start is not None else float('-inf')
+        high = end if end is not None else float('inf')
+
+        if not tokens and self.time_sorted:
+            # Entries are in time order, so a time range is a contiguous id range
+            first = bisect_left(self.timestamps, start) if start is not None else 0
+            last = bisect_left(self.timestamps, end) if end is not None else len(self.timestamps)
+            if level_id is None:
+                ids = range(first, last)
+            else:
+                posting = self.level_postings[level_id]
+                ids = posting[bisect_left(posting, first):bisect_left(posting, last)]
+            return ids[-limit:] if limit else ids
+
+        if tokens:
+            postings = [self.postings.get(token) for token in tokens]
+            if any(posting is None for posting in postings):
+                return []
+            postings.sort(key=len)
+            candidates, others = postings[0], postings[1:]
+        else:
+            candidates = self.level_postings[level_id] if level_id is not None else range(len(self.starts))
+            others = []
+
+        if self.time_sorted and limit:
+            # Walk the shortest posting list from the newest entry and stop once enough are found
+            candidates = reversed(candidates)
+        ids = []
+        for entry_id in candidates:
+            if level_id is not None and self.levels[entry_id] != level_id:
+                continue
+            if not low <= self.timestamps[entry_id] < high:
+                continue
+            if all(_contains(other, entry_id) for other in others):
+                ids.append(entry_id)
+                if self.time_sorted and limit and len(ids) >= limit:
+                    break
+        if self.time_sorted and limit:
+            ids.reverse()
+        return ids
+
+    def read_entries(self, entry_ids):
+        """Reads the given entries back from the log file."""
+        results = []
+        with open(self.path, 'rb') as f:
+            for entry_id in entry_ids:
+                f.seek(self.starts[entry_id])
+                raw = f.read(self.ends[entry_id] - self.starts[entry_id]).decode('utf-8', errors='replace')
+                first_line, _, continuation = raw.rstrip('\n').partition('\n')
+                parsed = log_format.parse_log_line(first_line) or {"timestamp": "", "message": first_line, "fields": {}}
+                result = {
+                    "source": self.source,
+                    "timestamp": parsed['timestamp'],
+                    "level": LEVELS[self.levels[entry_id]],
+                    "message": f"{parsed['message']}\n{continuation}" if continuation else parsed['message']
+                }
+                if parsed['fields']:
+                    result['fields'] = parsed['fields']
+                results.append(result)
+        return results
+
+
+class LogIndex:
+    """Search index over several log files, kept up to date by tailing them."""
+
+    def __init__(self, files):
+        self.indexes = {source: LogFileIndex(source, path) for source, path in files.items()}
+        self._lock = threading.Lock()
+        self._tailer = None
+
+    def refresh(self):
+        with self._lock:
+            return sum(index.refresh() for index in self.indexes.values())
+
+    def search(self, query='', level=None, start=None, end=None, sources=None, limit=LOG_SEARCH_MAX_RESULTS):
+        """
+        Returns matching entries from all (or the given) sources, newest first. Every word of the query
+        must appear in the entry; level is a name from LEVELS; start/end are epoch seconds.
+        """
+        tokens = tokenize(query or '')
+        level = level.lower() if level else None
+        if level is not None and level not in LEVELS:
+            return []
+        with self._lock:
+            for index in self.indexes.values():
+                index.refresh()
+            matches = []
+            for source, index in self.indexes.items():
+                if sources and source not in sources:
+                    continue
+                for entry_id in index.search(tokens, level, start, end, limit):
+                    matches.append((index.timestamps[entry_id], source, entry_id))
+            matches.sort(reverse=True)
+            matches = matches[:limit]
+
+            by_source = {}
+            for _, source, entry_id in matches:
+                by_source.setdefault(source, []).append(entry_id)
+            entries = {}
+            for source, entry_ids in by_source.items():
+                for entry_id, entry in zip(entry_ids, self.indexes[source].read_entries(entry_ids)):
+                    entries[(source, entry_id)] = entry
+        return [entries[(source, entry_id)] for _, source, entry_id in matches]
+
+    def start_tailing(self, interval_seconds=LOG_INDEX_TAIL_INTERVAL_SECONDS):
+        """Starts a daemon thread that indexes new log lines every interval_seconds."""
+        if interval_seconds <= 0 or self._tailer is not None:
+            return
+
+        def tail():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Warning: Log index refresh failed: {e}")
+                time.sleep(interval_seconds)
+
+        self._tailer = threading.Thread(target=tail, name='log-index-tailer', daemon=True)
+        self._tailer.start()
+
+
+def parse_time_arg(value):
+    """Parses a from/to query argument: epoch seconds or an ISO date/time. Returns epoch seconds or None."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# --- Price Alert Configuration ---
+# Number of recorded prices (one per day) a product's rolling average is taken over.
+PRICE_ALERT_WINDOW = int(os.environ.get('PRICE_ALERT_WINDOW', '5'))
+# Number of fired alerts kept per tenant; older ones are dropped as new ones arrive.
+PRICE_ALERTS_KEPT = int(os.environ.get('PRICE_ALERTS_KEPT', '1000'))
+
+# Rule types: 'change' fires when a price differs from the product's rolling average by at least
+# 'percent' percent; 'above' and 'below' fire when a price crosses 'threshold' in that direction.
+RULE_TYPES = ('change', 'above', 'below')
+
+price_alerts_logger = logging.getLogger('data_manager_logs')
+
+
+def parse_rule(payload):
+    """
+    Validates a rule from an API request ({"product_id", "type", "percent" or "threshold"}) and returns it
+    normalized, without an ID. Raises ValueError describing the first problem found.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("A rule must be an object")
+    product_id = payload.get('product_id')
+    if not product_id or not isinstance(product_id, str):
+        raise ValueError("product_id is missing")
+    rule_type = payload.get('type')
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"type must be one of: {', '.join(RULE_TYPES)}")
+    field = 'percent' if rule_type == 'change' else 'threshold'
+    try:
+        value = float(payload.get(field))
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number") from None
+    if value <= 0:
+        raise ValueError(f"{field} must be greater than 0")
+    return {"product_id": product_id, "type": rule_type, field: value}
+
+
+class PriceAggregate:
+    """Running state of one watched product's prices, updated in constant time per recorded price."""
+    __slots__ = ('last_date', 'last_price', 'window', 'window_sum')
+
+    def __init__(self):
+        self.last_date = None
+        self.last_price = None
+        self.window = deque()  # Last PRICE_ALERT_WINDOW prices, oldest first
+        self.window_sum = 0.0
+
+    def update(self, date, price, window_size=PRICE_ALERT_WINDOW):
+        """
+        Adds the price recorded for a date and returns (previous price, rolling average before this price).
+        A second price on the same date replaces the first, as it does in the tracking data.
+        """
+        if date == self.last_date and self.window:
+            self.window_sum -= self.window.pop()
+        previous_price = self.last_price
+        average = self.window_sum / len(self.window) if self.window else None
+        self.window.append(price)
+        self.window_sum += price
+        if len(self.window) > window_size:
+            self.window_sum -= self.window.popleft()
+        self.last_date, self.last_price = date, price
+        return previous_price, average
+
+
+def evaluate(rule, price, previous_price, average):
+    """Returns the fields describing why the rule fires for this price, or None if it does not."""
+    if rule['type'] == 'change':
+        if not average:
+            return None
+        change_percent = (price - average) / average * 100
+        if abs(change_percent) < rule['percent']:
+            return None
+        return {"average": round(average, 2), "change_percent": round(change_percent, 1)}
+    if previous_price is None:
+        return None  # Nothing to cross from yet
+    threshold = rule['threshold']
+    if rule['type'] == 'above' and previous_price < threshold <= price:
+        return {"threshold": threshold}
+    if rule['type'] == 'below' and previous_price > threshold >= price:
+        return {"threshold": threshold}
+    return None
+
+
+class PriceAlerts:
+    """
+    Price aggregates of the watched products of one tenant and the alerts fired for them. A product's
+    aggregate is seeded from its tracking history the first time one of its prices is observed, and
+    from then on updated incrementally, so evaluating a write costs the same however long the history
+    and however many rules watch other products. Fired alerts are numbered, newest last.
+
+    The fired alerts are written to alerts_path (when given) each time one fires, and read back on first
+    use, so they and their numbering survive restarts. Aggregates are not written: reseeding one from the
+    tracking history gives the same aggregate, as it only holds the last few prices.
+    """
+
+    def __init__(self, alerts_path=None, max_alerts=PRICE_ALERTS_KEPT):
+        self.alerts_path = alerts_path
+        self.aggregates = {}  # product ID -> PriceAggregate
+        self.alerts = deque(maxlen=max_alerts)
+        self.last_alert_id = 0
+        self._loaded = alerts_path is None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if os.path.exists(self.alerts_path):
+                with open(self.alerts_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                self.alerts.extend(saved.get('alerts', []))
+                self.last_alert_id = max([saved.get('last_alert_id', 0)] + [alert['id'] for alert in self.alerts])
+        except Exception as e:
+            price_alerts_logger.error(f"Error reading fired price alerts {self.alerts_path}: {e}. "
+                                      f"Starting with none.", exc_info=True)
+            self.alerts.clear()
+
+    def _write(self):
+        tmp_path = f"{self.alerts_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"last_alert_id": self.last_alert_id, "alerts": list(self.alerts)}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.alerts_path)
+
+    @staticmethod
+    def _seed(history):
+        """Aggregate of a product's tracking history ({date: {"price": ...}}), from its last few prices only."""
+        aggregate = PriceAggregate()
+        dated = sorted(((datetime.strptime(date, '%d/%m/%Y'), date, entry['price']) for date, entry in history.items()
+                        if entry.get('price') is not None))
+        for _, date, price in dated[-PRICE_ALERT_WINDOW:]:
+            aggregate.update(date, float(price))
+        return aggregate
+
+    def observe(self, product_id, name, date, price, rules, history):
+        """
+        Evaluates the rules watching a product against a price just recorded for it and returns the alerts
+        fired. history is the product's tracking data from before this price, used to seed its aggregate.
+        """
+        fired = []
+        with self._lock:
+            self._load()
+            aggregate = self.aggregates.get(product_id)
+            if aggregate is None:
+                aggregate = self.aggregates[product_id] = self._seed(history or {})
+            previous_price, average = aggregate.update(date, price)
+            for rule in rules:
+                reason = evaluate(rule, price, previous_price, average)
+                if reason is None:
+                    continue
+                self.last_alert_id += 1
+                alert = {"id": self.last_alert_id, "rule_id": rule['id'], "type": rule['type'],
+                         "product_id": product_id, "name": name, "date": date, "price": price,
+                         "previous_price": previous_price, "ts": round(time.time(), 3), **reason}
+                self.alerts.append(alert)
+                fired.append(alert)
+            if fired and self.alerts_path:
+                try:
+                    self._write()
+                except OSError as e:
+                    price_alerts_logger.error(f"Error writing fired price alerts {self.alerts_path}: {e}",
+                                              exc_info=True)
+        for alert in fired:
+            price_alerts_logger.warning(f"Price alert ({alert['type']}) for '{name}': price {price} on {date}.",
+                                        extra={'product_id': product_id})
+        return fired
+
+    def forget(self, product_id):
+        """Drops a product's aggregate once no rule watches it, as it is no longer kept up to date."""
+        with self._lock:
+            self.aggregates.pop(product_id, None)
+
+    def recent(self, since=0, limit=None):
+        """Alerts with an ID above since, oldest first (the newest `limit` of them when limit is given)."""
+        with self._lock:
+            self._load()
+            alerts = [alert for alert in self.alerts if alert['id'] > since]
+        return alerts[-limit:] if limit else alerts
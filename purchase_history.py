@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# --- Purchase History Configuration ---
+# Weight of the newest observation in the running averages (exponentially weighted moving averages).
+PURCHASE_EWMA_ALPHA = float(os.environ.get('PURCHASE_EWMA_ALPHA', '0.3'))
+# Purchases of the same product closer together than this (hours) count as one purchase, e.g. an item
+# marked done, undone and done again during the same trip.
+PURCHASE_MERGE_WINDOW_HOURS = float(os.environ.get('PURCHASE_MERGE_WINDOW_HOURS', '12'))
+# The statistics are checkpointed to disk after this many events (and at shutdown), so a restart only
+# replays the events logged after the last checkpoint.
+PURCHASE_STATS_CHECKPOINT_EVENTS = int(os.environ.get('PURCHASE_STATS_CHECKPOINT_EVENTS', '50'))
+# A product is suggested for restocking once this fraction of its usual interval between purchases has passed.
+RESTOCK_DUE_FRACTION = float(os.environ.get('RESTOCK_DUE_FRACTION', '0.9'))
+
+SECONDS_PER_DAY = 86400
+
+purchase_logger = logging.getLogger('data_manager_logs')
+
+
+class ProductPurchaseStats:
+    """Running purchase statistics of one product, updated in constant time per purchase."""
+    __slots__ = ('purchases', 'last_purchase', 'interval_ewma', 'quantity_ewma')
+
+    def __init__(self, purchases=0, last_purchase=None, interval_ewma=None, quantity_ewma=None):
+        self.purchases = purchases
+        self.last_purchase = last_purchase  # epoch seconds
+        self.interval_ewma = interval_ewma  # seconds between purchases
+        self.quantity_ewma = quantity_ewma
+
+    def update(self, timestamp, quantity, alpha=PURCHASE_EWMA_ALPHA,
+               merge_window_seconds=PURCHASE_MERGE_WINDOW_HOURS * 3600):
+        if self.last_purchase is not None and timestamp - self.last_purchase < merge_window_seconds:
+            return  # Same purchase as the previous event
+        if self.last_purchase is not None:
+            interval = timestamp - self.last_purchase
+            self.interval_ewma = interval if self.interval_ewma is None else \
+                alpha * interval + (1 - alpha) * self.interval_ewma
+        self.quantity_ewma = quantity if self.quantity_ewma is None else \
+            alpha * quantity + (1 - alpha) * self.quantity_ewma
+        self.last_purchase = timestamp
+        self.purchases += 1
+
+    def to_list(self):
+        return [self.purchases, self.last_purchase, self.interval_ewma, self.quantity_ewma]
+
+
+class PurchaseHistory:
+    """
+    Append-only log of purchase events (one JSON line per product marked done:
+    {"ts": epoch seconds, "product_id": ..., "quantity": ...}) plus per-product statistics derived from
+    it. The statistics are never recomputed from the whole history: each event updates them
+    incrementally, and on startup only the events after the last checkpoint are replayed.
+    """
+
+    def __init__(self, events_path, checkpoint_path):
+        self.events_path = events_path
+        self.checkpoint_path = checkpoint_path
+        self.stats = {}  # product ID -> ProductPurchaseStats
+        self.offset = 0  # bytes of the event log reflected in self.stats
+        self._events_since_checkpoint = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        log_size = os.path.getsize(self.events_path) if os.path.exists(self.events_path) else 0
+        try:
+            if os.path.exists(self.checkpoint_path):
+                with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+                if checkpoint.get('offset', 0) <= log_size:
+                    self.offset = checkpoint['offset']
+                    self.stats = {product_id: ProductPurchaseStats(*values)
+                                  for product_id, values in checkpoint['stats'].items()}
+        except Exception as e:
+            purchase_logger.error(f"Error reading purchase statistics checkpoint {self.checkpoint_path}: {e}. "
+                                  f"Replaying the whole purchase log.", exc_info=True)
+            self.stats, self.offset = {}, 0
+        replayed = self._replay(log_size)
+        if replayed:
+            purchase_logger.info(f"Replayed {replayed} purchase events from {self.events_path}.")
+
+    def _replay(self, log_size):
+        if self.offset >= log_size:
+            return 0
+        replayed = 0
+        with open(self.events_path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Torn write from a crash; dropped below
+                try:
+                    event = json.loads(line)
+                    self._apply(event['product_id'], event['ts'], event.get('quantity', 1))
+                    replayed += 1
+                except (ValueError, KeyError) as e:
+                    purchase_logger.warning(f"Skipping malformed purchase event at byte {self.offset}: {e}")
+                self.offset += len(line)
+        if self.offset < log_size:
+            with open(self.events_path, 'r+b') as f:
+                f.truncate(self.offset)
+        self._events_since_checkpoint += replayed
+        return replayed
+
+    def _apply(self, product_id, timestamp, quantity):
+        stats = self.stats.get(product_id)
+        if stats is None:
+            stats = self.stats[product_id] = ProductPurchaseStats()
+        stats.update(timestamp, quantity)
+
+    def record(self, product_id, quantity=1, timestamp=None):
+        """Appends a purchase event and updates the product's statistics."""
+        return self.record_many([(product_id, quantity)], timestamp)
+
+    def record_many(self, purchases, timestamp=None):
+        """Appends the events of several purchases ((product ID, quantity) pairs) to the log in one write."""
+        timestamp = time.time() if timestamp is None else timestamp
+        try:
+            events = [(product_id, int(quantity) if quantity else 1) for product_id, quantity in purchases]
+            if not events:
+                return True
+            data = b''.join(json.dumps({"ts": round(timestamp, 3), "product_id": product_id, "quantity": quantity},
+                                       ensure_ascii=False).encode('utf-8') + b'\n' for product_id, quantity in events)
+            with self._lock:
+                self._load()
+                with open(self.events_path, 'ab') as f:
+                    f.write(data)
+                self.offset += len(data)
+                for product_id, quantity in events:
+                    self._apply(product_id, timestamp, quantity)
+                self._events_since_checkpoint += len(events)
+                if self._events_since_checkpoint >= PURCHASE_STATS_CHECKPOINT_EVENTS:
+                    self._write_checkpoint()
+            for product_id, quantity in events:
+                purchase_logger.info(f"Recorded purchase of product ID '{product_id}' (quantity: {quantity}).",
+                                     extra={'product_id': product_id})
+            return True
+        except Exception as e:
+            purchase_logger.error(f"Error recording {len(purchases)} purchases: {e}", exc_info=True)
+            return False
+
+    def _write_checkpoint(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"offset": self.offset,
+                       "stats": {product_id: stats.to_list() for product_id, stats in self.stats.items()}}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._events_since_checkpoint = 0
+
+    def checkpoint(self):
+        """Writes the statistics to disk if any event arrived since the last checkpoint."""
+        try:
+            with self._lock:
+                if self._loaded and self._events_since_checkpoint:
+                    self._write_checkpoint()
+            return True
+        except Exception as e:
+            purchase_logger.error(f"Error writing purchase statistics checkpoint {self.checkpoint_path}: {e}",
+                                  exc_info=True)
+            return False
+
+    def get_stats(self, product_id):
+        with self._lock:
+            self._load()
+            return self.stats.get(product_id)
+
+    def due_products(self, now=None, due_fraction=1.0):
+        """
+        Yields (product ID, stats, days until due) for every product bought at least twice whose time since
+        its last purchase has reached due_fraction of its usual interval. Negative days are overdue.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._load()
+            candidates = [(product_id, stats) for product_id, stats in self.stats.items()
+                          if stats.interval_ewma is not None]
+        for product_id, stats in candidates:
+            elapsed = now - stats.last_purchase
+            if elapsed >= due_fraction * stats.interval_ewma:
+                yield product_id, stats, (stats.interval_ewma - elapsed) / SECONDS_PER_DAY
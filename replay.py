@@ -0,0 +1,320 @@
+"""
+Replays a traffic capture (see traffic_capture.py) and reports latency and response differences.
+
+    python replay.py logs/captures/requests.jsonl.1 logs/captures/requests.jsonl
+    python replay.py capture.jsonl --speed 10 --concurrency 4
+    python replay.py capture.jsonl --url http://localhost:5000
+
+By default the requests run in-process against a fresh copy of a data directory (--data, default
+databases/), so every replay starts from the same state and never touches the real databases. With
+--url they are sent to a running server instead, which should be started on a fresh snapshot too.
+
+Products and alert rules created during the replay get new IDs. The ID a replayed response returns
+where the captured one had another (under an "id" or "product_id" key) is substituted for the captured
+ID in the path and body of every later request, so lookups, updates and deletes by ID reach the object
+the replay created. With --concurrency above 1 a request may be sent before the response holding its
+ID came back; such requests show up as differences.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import tenants
+import traffic_capture
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Response fields that legitimately differ between runs (new product IDs, timestamps)
+DEFAULT_IGNORED_KEYS = ('id', 'timestamp', 'ts', 'last_purchase')
+# Response fields holding the IDs of created objects, mapped from their captured to their replayed value
+ID_KEYS = ('id', 'product_id')
+
+
+def load_capture(paths):
+    """Reads capture files (oldest first, e.g. the rotated requests.jsonl.N before requests.jsonl)."""
+    records = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print(f"Warning: Skipping malformed capture line {path}:{line_number}")
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def request_headers(record):
+    headers = dict(record.get('headers', {}))
+    if record.get('tenant'):
+        headers.setdefault(tenants.TENANT_HEADER, record['tenant'])
+    return headers
+
+
+class IdMap:
+    """Captured IDs and the IDs the replay created in their place (see the module docstring)."""
+
+    def __init__(self):
+        self._replayed = {}
+        self._lock = threading.Lock()
+
+    def learn(self, record, status, body):
+        """Pairs up the IDs of a captured response with those of its replayed response."""
+        if status != record['status'] or ('response_body' not in record and 'response_body_b64' not in record):
+            return
+        try:
+            captured, replayed = json.loads(traffic_capture.decode_body(record, prefix='response_')), json.loads(body)
+        except ValueError:
+            return
+        pairs = {}
+        _collect_id_pairs(captured, replayed, pairs)
+        if pairs:
+            with self._lock:
+                self._replayed.update(pairs)
+
+    def rewrite(self, record):
+        """The record with captured IDs in its path and body replaced by the replayed ones."""
+        with self._lock:
+            replacements = list(self._replayed.items())
+        if not replacements:
+            return record
+        path, body = record['path'], traffic_capture.decode_body(record)
+        for captured_id, replayed_id in replacements:
+            path = path.replace(captured_id, replayed_id)
+            body = body.replace(captured_id.encode('utf-8'), replayed_id.encode('utf-8'))
+        if path == record['path'] and body == traffic_capture.decode_body(record):
+            return record
+        rewritten = {key: value for key, value in record.items() if key not in ('body', 'body_b64')}
+        return dict(rewritten, path=path, **traffic_capture.encode_body(body))
+
+
+def _collect_id_pairs(captured, replayed, pairs):
+    if isinstance(captured, dict) and isinstance(replayed, dict):
+        for key, value in captured.items():
+            if key not in replayed:
+                continue
+            if key in ID_KEYS and isinstance(value, str) and isinstance(replayed[key], str):
+                if value and value != replayed[key]:
+                    pairs[value] = replayed[key]
+            else:
+                _collect_id_pairs(value, replayed[key], pairs)
+    elif isinstance(captured, list) and isinstance(replayed, list) and len(captured) == len(replayed):
+        for captured_item, replayed_item in zip(captured, replayed):
+            _collect_id_pairs(captured_item, replayed_item, pairs)
+
+
+class InProcessTarget:
+    """Runs the Flask app in this process, on a copy of the data directory."""
+
+    def __init__(self, data_dir):
+        self.workdir = tempfile.mkdtemp(prefix='shoppyscan-replay-')
+        shutil.copytree(data_dir, os.path.join(self.workdir, 'databases'),
+                        ignore=shutil.ignore_patterns('state.snapshot*'))
+        # The app's modules resolve databases/ and logs/ against the working directory
+        os.chdir(self.workdir)
+        # The replayed requests must not be captured again (possibly into the very file being replayed)
+        traffic_capture.set_enabled(False)
+        sys.path.insert(0, REPO_DIR)
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, record):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(record['path'], method=record['method'], headers=request_headers(record),
+                               data=traffic_capture.decode_body(record))
+        return response.status_code, response.get_data()
+
+    def close(self):
+        os.chdir(REPO_DIR)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class HttpTarget:
+    """Sends the requests to a running server."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._local = threading.local()
+
+    def send(self, record):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(record['method'], record['path'], body=traffic_capture.decode_body(record),
+                               headers=request_headers(record))
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self._local.connection = None
+            connection.close()
+            raise
+
+    def close(self):
+        pass
+
+
+def replay(records, target, speed=1.0, concurrency=1):
+    """
+    Sends every record, keeping the original spacing divided by speed (0 = as fast as possible).
+    Returns one result dict per record, in capture order.
+    """
+    results = [None] * len(records)
+    ids = IdMap()
+
+    def run(position, record):
+        started = time.perf_counter()
+        try:
+            status, body = target.send(ids.rewrite(record))
+            error = None
+        except Exception as e:
+            status, body, error = None, b'', str(e)
+        results[position] = {"status": status, "body": body, "error": error,
+                             "latency_ms": (time.perf_counter() - started) * 1000}
+        if error is None:
+            ids.learn(record, status, body)
+
+    first_ts = records[0]['ts'] if records else 0
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for position, record in enumerate(records):
+            if speed > 0:
+                delay = replay_started + (record['ts'] - first_ts) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if concurrency == 1:
+                run(position, record)  # Strictly in order, for a deterministic replay
+            else:
+                executor.submit(run, position, record)
+    return results
+
+
+def _strip_keys(value, ignored_keys):
+    if isinstance(value, dict):
+        return {key: _strip_keys(item, ignored_keys) for key, item in value.items() if key not in ignored_keys}
+    if isinstance(value, list):
+        return [_strip_keys(item, ignored_keys) for item in value]
+    return value
+
+
+def response_diff(record, result, ignored_keys=DEFAULT_IGNORED_KEYS):
+    """Describes how a replayed response differs from the captured one, or returns None if it matches."""
+    if result['error']:
+        return f"request failed: {result['error']}"
+    if result['status'] != record['status']:
+        return f"status {record['status']} -> {result['status']}"
+    if 'response_body' not in record and 'response_body_b64' not in record:
+        return None  # Body too large to have been captured
+    captured = traffic_capture.decode_body(record, prefix='response_')
+    try:
+        captured_json, replayed_json = json.loads(captured), json.loads(result['body'])
+    except ValueError:
+        return None if captured == result['body'] else "response body differs"
+    if _strip_keys(captured_json, ignored_keys) != _strip_keys(replayed_json, ignored_keys):
+        return (f"response body differs: {json.dumps(captured_json, ensure_ascii=False)[:200]} -> "
+                f"{json.dumps(replayed_json, ensure_ascii=False)[:200]}")
+    return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def build_report(records, results, ignored_keys=DEFAULT_IGNORED_KEYS):
+    routes = {}
+    diffs = []
+    for record, result in zip(records, results):
+        route = routes.setdefault(f"{record['method']} {record.get('route') or record['path']}",
+                                  {"count": 0, "captured_ms": [], "replayed_ms": [], "diffs": 0})
+        route['count'] += 1
+        route['captured_ms'].append(record.get('duration_ms', 0.0))
+        route['replayed_ms'].append(result['latency_ms'])
+        diff = response_diff(record, result, ignored_keys)
+        if diff:
+            route['diffs'] += 1
+            diffs.append({"method": record['method'], "path": record['path'], "diff": diff})
+
+    summary = {}
+    for name, route in routes.items():
+        summary[name] = {
+            "count": route['count'], "diffs": route['diffs'],
+            "captured_p50_ms": round(statistics.median(route['captured_ms']), 3),
+            "replayed_p50_ms": round(statistics.median(route['replayed_ms']), 3),
+            "replayed_p95_ms": round(percentile(route['replayed_ms'], 0.95), 3),
+        }
+    all_latencies = [result['latency_ms'] for result in results]
+    return {
+        "requests": len(records),
+        "diffs": len(diffs),
+        "replayed_p50_ms": round(statistics.median(all_latencies), 3) if all_latencies else 0.0,
+        "replayed_p95_ms": round(percentile(all_latencies, 0.95), 3),
+        "replayed_p99_ms": round(percentile(all_latencies, 0.99), 3),
+        "routes": summary,
+        "diff_examples": diffs,
+    }
+
+
+def print_report(report, max_diffs):
+    print(f"{report['requests']} requests replayed, {report['diffs']} with differences. Latency p50 "
+          f"{report['replayed_p50_ms']} ms, p95 {report['replayed_p95_ms']} ms, p99 {report['replayed_p99_ms']} ms.")
+    widths = [50, 8, 8, 14, 14, 14]
+    print('  '.join(column.ljust(width) for column, width in zip(
+        ['route', 'count', 'diffs', 'captured p50', 'replayed p50', 'replayed p95'], widths)))
+    for name, route in sorted(report['routes'].items(), key=lambda item: -item[1]['count']):
+        columns = [name, route['count'], route['diffs'], f"{route['captured_p50_ms']} ms",
+                   f"{route['replayed_p50_ms']} ms", f"{route['replayed_p95_ms']} ms"]
+        print('  '.join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for diff in report['diff_examples'][:max_diffs]:
+        print(f"DIFF {diff['method']} {diff['path']}: {diff['diff']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='+', help='capture files, oldest first')
+    parser.add_argument('--data', default=os.path.join(REPO_DIR, 'databases'),
+                        help='data directory copied for an in-process replay (default: databases/)')
+    parser.add_argument('--url', help='replay against a running server instead of in-process')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='1 = original pace, 10 = ten times faster, 0 = as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='requests in flight at once (1 keeps the replay deterministic)')
+    parser.add_argument('--ignore-keys', default=','.join(DEFAULT_IGNORED_KEYS),
+                        help='comma-separated JSON keys left out when comparing responses')
+    parser.add_argument('--max-diffs', type=int, default=20, help='differences printed in full')
+    parser.add_argument('--report', help='also write the full report as JSON to this file')
+    args = parser.parse_args()
+
+    records = load_capture(args.captures)
+    if not records:
+        print("The capture is empty.")
+        return
+    report_path = os.path.abspath(args.report) if args.report else None
+    target = HttpTarget(args.url) if args.url else InProcessTarget(os.path.abspath(args.data))
+    try:
+        results = replay(records, target, speed=args.speed, concurrency=max(1, args.concurrency))
+    finally:
+        target.close()
+    report = build_report(records, results, set(filter(None, args.ignore_keys.split(','))))
+    print_report(report, args.max_diffs)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --- Scanner Deduplication Configuration ---
+# Repeated scans of the same barcode within this window (seconds) are treated as one burst.
+SCAN_COALESCE_WINDOW_SECONDS = float(os.environ.get('SCAN_COALESCE_WINDOW_SECONDS', '1.5'))
+# When true (the default), every scan in a burst adds one to the quantity, flushed as a single update at
+# the end of the window. When false, the extra scans of a burst are treated as scanner misfires and dropped.
+SCAN_BURST_SUMS_QUANTITY = os.environ.get('SCAN_BURST_SUMS_QUANTITY', 'true').lower() in ('1', 'true', 'yes')
+# How long (seconds) the response to an idempotency key is remembered, and how many keys are kept.
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+# How long (seconds) a resend waits for the response of the original request while it is still being processed.
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+
+
+class RequestInProgress(Exception):
+    """The request holding an idempotency key did not finish within the wait."""
+
+
+class IdempotencyStore:
+    """
+    Remembers the response sent for each idempotency key, for a limited time and number of keys. A key is
+    reserved before its request is processed, so a resend arriving meanwhile waits for that request's
+    response instead of being processed a second time.
+    """
+
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_keys=IDEMPOTENCY_MAX_KEYS,
+                 wait_seconds=IDEMPOTENCY_WAIT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.wait_seconds = wait_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, response), oldest first
+        self._in_progress = {}  # key -> threading.Event set once its request finished
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+
+    def get(self, key):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            return entry[1] if entry else None
+
+    def reserve(self, key):
+        """
+        Claims a key for the request about to be processed. Returns None if the caller now holds the key
+        and must finish with put() or release(), or the response stored for the key. A key held by a request
+        still in progress is waited for; RequestInProgress is raised if that takes longer than wait_seconds.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            with self._lock:
+                self._expire(time.monotonic())
+                entry = self._entries.get(key)
+                if entry:
+                    return entry[1]
+                finished = self._in_progress.get(key)
+                if finished is None:
+                    self._in_progress[key] = threading.Event()
+                    return None
+            # Woken by put() (the response is then replayed) or release() (the key may be claimed again)
+            if not finished.wait(deadline - time.monotonic()):
+                raise RequestInProgress(key)
+
+    def put(self, key, response):
+        """Stores the response of a key's request and hands it to the resends waiting for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl_seconds, response)
+            self._expire(now)
+            finished = self._in_progress.pop(key, None)
+        if finished is not None:
+            finished.set()
+
+    def release(self, key):
+        """Gives up a reserved key without a response (the request failed), so a resend is processed again."""
+        with self._lock:
+            finished = self._in_progress.pop(key, None)
+        if finished is not None:
+            finished.set()
+
+
+class ScanCoalescer:
+    """
+    Collapses bursts of scans of the same barcode. The first scan of a burst is handled normally by the
+    caller; later scans within the window are only counted in memory. When the window closes,
+    flush_callback(barcode, extra_scans) is called once for bursts that had extra scans.
+    """
+
+    def __init__(self, flush_callback, window_seconds=SCAN_COALESCE_WINDOW_SECONDS):
+        self.flush_callback = flush_callback
+        self.window_seconds = window_seconds
+        self._bursts = {}  # barcode -> {'extra': int, 'timer': threading.Timer}
+        self._lock = threading.Lock()
+
+    def submit(self, barcode):
+        """Registers a scan. Returns True if it opened a new burst, False if it joined an open one."""
+        if self.window_seconds <= 0:
+            return True
+        with self._lock:
+            burst = self._bursts.get(barcode)
+            if burst is not None:
+                burst['extra'] += 1
+                return False
+            timer = threading.Timer(self.window_seconds, self._close, args=(barcode,))
+            timer.daemon = True
+            self._bursts[barcode] = {'extra': 0, 'timer': timer}
+            timer.start()
+            return True
+
+    def discard(self, barcode):
+        """Closes a burst without flushing, e.g. when its first scan failed."""
+        with self._lock:
+            burst = self._bursts.pop(barcode, None)
+        if burst is not None:
+            burst['timer'].cancel()
+
+    def _close(self, barcode):
+        with self._lock:
+            burst = self._bursts.pop(barcode, None)
+        if burst is not None and burst['extra']:
+            self.flush_callback(barcode, burst['extra'])
+
+    def flush_all(self):
+        """Closes every open burst immediately (used at shutdown)."""
+        with self._lock:
+            barcodes = list(self._bursts)
+        for barcode in barcodes:
+            with self._lock:
+                burst = self._bursts.get(barcode)
+            if burst is not None:
+                burst['timer'].cancel()
+                self._close(barcode)
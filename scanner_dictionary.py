@@ -0,0 +1,191 @@
+"""
+Barcode dictionary for scanner clients.
+
+A scanner downloads the barcodes of the master list once (GET /api/scanner/dictionary) and afterwards
+only the changes (?since=<version it holds>), so it can name a scanned product without a round trip.
+The dictionary is gzipped JSON in a columnar layout:
+
+    {"format": 1, "version": "<hash>", "base_version": null | "<hash>",
+     "categories": ["category", ...],
+     "keys": [delta-encoded integer barcodes], "names": [...], "category_ids": [...],
+     "other": [["barcode", name, category id], ...],
+     "removed_keys": [delta-encoded integer barcodes], "removed_other": ["barcode", ...]}
+
+- Valid EAN/UPC barcodes are keys: integers holding the digits' value plus the barcode's length times
+  2**48 (so leading zeros survive), sorted and sent as differences from the previous key. names and
+  category_ids hold the product of each key, in the same order. Other barcodes are listed in "other".
+- Categories are sent once and referenced by their position in "categories". Positions do not change
+  between versions served by the same process; a diff's "categories" replaces the client's list.
+- base_version null is a full dictionary: it replaces whatever the client had. Otherwise the entries
+  are added or replace existing ones, and the removed barcodes are dropped. A version the server no
+  longer remembers (or one from before a restart) gets the full dictionary.
+
+Versions are hashes of the dictionary's content (category positions included), so a restarted server
+recognises the version a client holds unless categories were added while the previous process ran.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import data_manager
+import tracing
+
+# --- Scanner Dictionary Configuration ---
+# Number of past versions diffs can be computed from; clients holding an older one get the full dictionary.
+DICTIONARY_HISTORY_SIZE = int(os.environ.get('SCANNER_DICTIONARY_HISTORY', '16'))
+# Number of gzipped diffs kept in memory.
+DICTIONARY_DIFF_CACHE_SIZE = int(os.environ.get('SCANNER_DICTIONARY_DIFF_CACHE', '64'))
+DICTIONARY_FORMAT = 1
+GZIP_LEVEL = 9
+
+# A gzipped dictionary (full when base_version is None, a diff otherwise)
+Artifact = namedtuple('Artifact', ['version', 'base_version', 'body'])
+
+
+class DictionaryVersion:
+    """One version of the dictionary: its entries ({barcode key: (name, category id)}) and categories."""
+    __slots__ = ('version', 'source_version', 'categories', 'entries', 'full')
+
+    def __init__(self, version, source_version, categories, entries, full):
+        self.version = version
+        self.source_version = source_version  # Version of the master list cache entry it was built from
+        self.categories = categories
+        self.entries = entries
+        self.full = full  # Artifact of the full dictionary
+
+
+_history = OrderedDict()  # version -> DictionaryVersion, oldest first
+_diffs = OrderedDict()  # (base version, version) -> Artifact
+_lock = threading.Lock()
+
+
+# --- Encoding ---
+
+def _delta_encode(sorted_keys):
+    previous = 0
+    deltas = []
+    for key in sorted_keys:
+        deltas.append(key - previous)
+        previous = key
+    return deltas
+
+
+def _encode_entries(entries, keys):
+    """The keys/names/category_ids/other sections for the given keys of entries."""
+    integer_keys = sorted(key for key in keys if isinstance(key, int))
+    string_keys = sorted(key for key in keys if isinstance(key, str))
+    return {
+        "keys": _delta_encode(integer_keys),
+        "names": [entries[key][0] for key in integer_keys],
+        "category_ids": [entries[key][1] for key in integer_keys],
+        "other": [[key, *entries[key]] for key in string_keys],
+    }
+
+
+def _encode_removals(keys):
+    return {
+        "removed_keys": _delta_encode(sorted(key for key in keys if isinstance(key, int))),
+        "removed_other": sorted(key for key in keys if isinstance(key, str)),
+    }
+
+
+def _compress(payload):
+    return gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                         GZIP_LEVEL, mtime=0)
+
+
+@tracing.traced
+def _build(source_version, table, previous):
+    """A DictionaryVersion of the master list's barcode table, keeping the category positions of previous."""
+    if previous is not None:
+        categories = list(previous.categories)
+    else:
+        categories = sorted({category for _, category in table.values()})
+    category_ids = {category: position for position, category in enumerate(categories)}
+    entries = {}
+    for key, (name, category) in table.items():
+        category_id = category_ids.get(category)
+        if category_id is None:
+            category_id = category_ids[category] = len(categories)
+            categories.append(category)
+        entries[key] = (name, category_id)
+
+    content = {"format": DICTIONARY_FORMAT, "categories": categories, **_encode_entries(entries, entries)}
+    content_json = json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    version = hashlib.sha256(content_json).hexdigest()[:16]
+    full = _compress({**content, "version": version, "base_version": None, **_encode_removals(())})
+    return DictionaryVersion(version, source_version, categories, entries, Artifact(version, None, full))
+
+
+@tracing.traced
+def _diff(base, current):
+    """Artifact with the changes from base to current, or current's full dictionary if that is smaller."""
+    changed = [key for key, value in current.entries.items() if base.entries.get(key) != value]
+    removed = [key for key in base.entries if key not in current.entries]
+    body = _compress({"format": DICTIONARY_FORMAT, "version": current.version, "base_version": base.version,
+                      "categories": current.categories, **_encode_entries(current.entries, changed),
+                      **_encode_removals(removed)})
+    if len(body) >= len(current.full.body):
+        return current.full
+    return Artifact(current.version, base.version, body)
+
+
+# --- Versions ---
+
+def current_version():
+    """The DictionaryVersion of the current master list, built when the list changed since the last call."""
+    source_version, table = data_manager.get_master_barcode_table()
+    with _lock:
+        latest = next(reversed(_history.values()), None)
+        if latest is not None and source_version is not None and latest.source_version == source_version:
+            return latest
+        built = _build(source_version, table, latest)
+        if latest is not None and built.version == latest.version:
+            latest.source_version = source_version  # The master list changed, but none of its barcodes did
+            return latest
+        _history.pop(built.version, None)  # The list went back to an earlier version's barcodes
+        _history[built.version] = built
+        while len(_history) > DICTIONARY_HISTORY_SIZE:
+            _history.popitem(last=False)
+        return built
+
+
+def get_artifact(since=None):
+    """The full dictionary, or the changes since the given version when that version is still remembered."""
+    current = current_version()
+    with _lock:
+        base = _history.get(since) if since else None
+        if base is None:
+            return current.full
+        key = (base.version, current.version)
+        artifact = _diffs.get(key)
+        if artifact is None:
+            artifact = _diffs[key] = _diff(base, current)
+            while len(_diffs) > DICTIONARY_DIFF_CACHE_SIZE:
+                _diffs.popitem(last=False)
+        else:
+            _diffs.move_to_end(key)
+        return artifact
+
+
+def serve_dictionary(since=None):
+    """Flask response with the dictionary (see get_artifact), gzipped unless the client cannot take gzip."""
+    from flask import Response, request
+
+    artifact = get_artifact(since)
+    etag = f"{artifact.base_version}-{artifact.version}" if artifact.base_version else artifact.version
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip'] > 0:
+        response = Response(artifact.body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(artifact.body), mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True  # Clients revalidate with If-None-Match
+    response.headers['X-Dictionary-Version'] = artifact.version
+    return response
@@ -0,0 +1,138 @@
+import json
+import os
+
+try:
+    import orjson  # Optional: much faster JSON encoding and parsing when installed
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # Optional: enables the binary 'msgpack' format when installed
+except ImportError:
+    msgpack = None
+
+# --- Database File Format Configuration ---
+# Format databases are written in: 'json' (standard library), 'orjson' (same JSON, faster) or 'msgpack'
+# (binary). Files are recognised by their content when loaded, so switching formats needs no
+# conversion step: each database is rewritten in the new format the next time it is saved.
+DB_FORMAT = os.environ.get('DB_FORMAT', 'json').lower()
+# When true, JSON is written without indentation or spaces (msgpack is always compact).
+DB_COMPACT = os.environ.get('DB_COMPACT', 'false').lower() in ('1', 'true', 'yes')
+
+
+class DecodeError(ValueError):
+    """A database file that none of the codecs can parse."""
+
+
+class JsonCodec:
+    name = 'json'
+
+    def __init__(self, compact=DB_COMPACT):
+        self.compact = compact
+
+    def dumps(self, data, default=None):
+        if self.compact:
+            text = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=default)
+        else:
+            text = json.dumps(data, ensure_ascii=False, indent=4, default=default)
+        return text.encode('utf-8')
+
+    @staticmethod
+    def loads(raw):
+        return json.loads(raw)
+
+
+class OrjsonCodec:
+    """JSON through orjson. Indented files use two spaces, the only indentation orjson writes."""
+    name = 'orjson'
+
+    def __init__(self, compact=DB_COMPACT):
+        self.options = 0 if compact else orjson.OPT_INDENT_2
+
+    def dumps(self, data, default=None):
+        return orjson.dumps(data, default=default, option=self.options)
+
+    @staticmethod
+    def loads(raw):
+        return orjson.loads(raw)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def __init__(self, compact=True):
+        pass
+
+    @staticmethod
+    def dumps(data, default=None):
+        return msgpack.packb(data, default=default, use_bin_type=True)
+
+    @staticmethod
+    def loads(raw):
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+CODECS = {'json': JsonCodec, 'orjson': OrjsonCodec, 'msgpack': MsgpackCodec}
+
+
+def available_codecs():
+    """Names of the codecs usable in this environment."""
+    return [name for name in CODECS
+            if (name != 'orjson' or orjson is not None) and (name != 'msgpack' or msgpack is not None)]
+
+
+def get_codec(name=DB_FORMAT, compact=DB_COMPACT):
+    if name not in CODECS:
+        raise ValueError(f"Unknown database format '{name}' (expected one of: {', '.join(CODECS)})")
+    if name not in available_codecs():
+        raise ValueError(f"Database format '{name}' needs the {name} package (pip install {name})")
+    return CODECS[name](compact=compact)
+
+
+def _writer_codec():
+    try:
+        return get_codec()
+    except ValueError as e:
+        print(f"Warning: {e}; writing databases as JSON instead.")
+        return JsonCodec()
+
+
+# Codec every database is saved with
+codec = _writer_codec()
+
+
+def detect_format(raw):
+    """'json' or 'msgpack', from the first bytes of a file. Databases are JSON objects or msgpack maps."""
+    start = raw.lstrip(b' \t\r\n\xef\xbb\xbf')[:1]
+    return 'json' if start in (b'{', b'[') else 'msgpack'
+
+
+def dumps(data, default=None):
+    """Encodes a database in the configured format. default converts values the codec cannot encode itself."""
+    return codec.dumps(data, default=default)
+
+
+def loads(raw):
+    """Decodes a database file's content, whichever format it was written in."""
+    if detect_format(raw) == 'json':
+        if orjson is not None:
+            try:
+                return orjson.loads(raw)
+            except ValueError:
+                pass  # orjson is stricter (no NaN, no integers beyond 64 bits); let the standard parser decide
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            raise DecodeError(f"Invalid JSON: {e}") from e
+    if msgpack is None:
+        # Not a DecodeError: the file is probably fine, this process just cannot read it
+        raise RuntimeError("Not a JSON file, and msgpack is not installed to read it as msgpack (pip install msgpack)")
+    try:
+        return MsgpackCodec.loads(raw)
+    except Exception as e:
+        raise DecodeError(f"Invalid msgpack: {e}") from e
+
+
+def load_file(file_path):
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
@@ -0,0 +1,330 @@
+"""
+Static assets and page shells.
+
+Third-party CSS, JavaScript and fonts are vendored under static/vendor/ instead of being fetched from
+public CDNs on every cold load, so pages paint on store Wi-Fi without third-party round trips. The
+vendored files are committed together with their checksums (static/vendor/SHA256SUMS), so builds need
+no network access:
+
+    python static_assets.py build     # check static/vendor/ against SHA256SUMS, write .gz (and .br) variants
+    python static_assets.py vendor    # maintainers only: download missing VENDORED_ASSETS (and the fonts
+                                      # their CSS refers to), update SHA256SUMS, then build
+
+After running vendor, review and commit the new files and SHA256SUMS. build fails when a VENDORED_ASSETS
+file is missing or does not match its checksum, so a page never depends on a CDN at runtime.
+
+Templates link assets with {{ asset_url('vendor/...') }}, which adds a hash of the file's content to the
+name, so the URL changes whenever the file does and can be cached by browsers for a year.
+"""
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli  # Optional: enables .br variants when installed
+except ImportError:
+    brotli = None
+
+# --- Static Asset Configuration ---
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# Cache lifetime (seconds) of static URLs without a content hash, e.g. /static/beep.mp3.
+STATIC_MAX_AGE_SECONDS = int(os.environ.get('STATIC_MAX_AGE_SECONDS', '3600'))
+# Content-hashed URLs and files under static/vendor/ never change, so browsers may keep them for a year.
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+# Number of rendered page shells kept in memory.
+PAGE_SHELL_CACHE_SIZE = int(os.environ.get('PAGE_SHELL_CACHE_SIZE', '32'))
+
+# Precompressed variants, best first, by the Content-Encoding they are sent with
+PRECOMPRESSED_SUFFIXES = OrderedDict([('br', '.br'), ('gzip', '.gz')])
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.json', '.txt', '.ttf', '.eot', '.map'}
+
+# Vendored assets: path under static/ -> the CDN URL it is a copy of. Each library lives in a directory
+# named after its version, so a vendored file is never changed in place; upgrading adds a new directory.
+VENDORED_ASSETS = {
+    'vendor/bootstrap/5.3.3/css/bootstrap.rtl.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.rtl.min.css',
+    'vendor/bootstrap/5.3.3/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap/5.3.3/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'vendor/font-awesome/6.0.0-beta3/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css',
+    'vendor/font-awesome/6.5.0/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0/css/all.min.css',
+    'vendor/jquery/3.6.0/jquery.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'vendor/chart.js/4.4.0/chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js',
+    'vendor/html5-qrcode/2.3.8/html5-qrcode.min.js': 'https://unpkg.com/html5-qrcode@2.3.8/html5-qrcode.min.js',
+    'vendor/inter/css/inter.css':
+        'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap',
+}
+# sha256 of every vendored file (sha256sum format), committed with them
+VENDOR_CHECKSUMS = 'vendor/SHA256SUMS'
+# Google Fonts picks the font format by User-Agent; a current browser's gets woff2
+_DOWNLOAD_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+# name.<12 hex digits>.ext, as produced by asset_url
+_HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+_digests = {}  # path under static/ -> (mtime_ns, size, digest)
+
+
+# --- Content-hashed URLs ---
+
+def _static_path(filename):
+    return os.path.join(STATIC_DIR, *filename.split('/'))
+
+
+def file_digest(filename):
+    """First 12 hex digits of the sha256 of a static file, or None if it does not exist."""
+    try:
+        st = os.stat(_static_path(filename))
+    except FileNotFoundError:
+        return None
+    cached = _digests.get(filename)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    with open(_static_path(filename), 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _digests[filename] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def asset_url(filename):
+    """URL of a static file with its content hash in the name (its plain URL if the file is missing)."""
+    digest = file_digest(filename)
+    if digest is None:
+        return f"/static/{filename}"
+    stem, ext = os.path.splitext(filename)
+    return f"/static/{stem}.{digest}{ext}"
+
+
+def resolve_static(filename):
+    """Returns (path under static/, immutable) for a requested static filename, hashed or not."""
+    match = _HASHED_NAME.match(filename)
+    if match:
+        original = f"{match['stem']}{match['ext']}"
+        if file_digest(original) == match['digest']:
+            return original, True
+        if file_digest(original) is not None:
+            return original, False  # An older version was asked for; serve the current one, briefly cached
+    return filename, filename.startswith('vendor/')
+
+
+# --- Serving ---
+
+def serve_static(filename):
+    """Replacement for Flask's static view: hashed names, long-lived caching and precompressed variants."""
+    from flask import abort, request, send_from_directory
+
+    filename, immutable = resolve_static(filename)
+    if not os.path.isfile(_static_path(filename)):
+        abort(404)
+    variants = [encoding for encoding, suffix in PRECOMPRESSED_SUFFIXES.items()
+                if os.path.isfile(_static_path(filename + suffix))]
+    encoding = request.accept_encodings.best_match(variants) if variants else None
+    if encoding and request.accept_encodings[encoding] <= 0:
+        encoding = None
+
+    max_age = IMMUTABLE_MAX_AGE_SECONDS if immutable else STATIC_MAX_AGE_SECONDS
+    served = filename + PRECOMPRESSED_SUFFIXES[encoding] if encoding else filename
+    response = send_from_directory(STATIC_DIR, served, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=max_age, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if variants:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable or None
+    return response
+
+
+# --- Page Shells ---
+# The HTML pages are static shells that fetch their data from the API, so a page's output depends only
+# on its template and the arguments it is rendered with. Each is rendered once and then served from
+# memory; a changed template (when templates auto-reload) is rendered again.
+
+_page_shells = OrderedDict()  # (template name, arguments) -> (template, html)
+_page_shells_lock = threading.Lock()
+
+
+def render_page_shell(template_name, **context):
+    """render_template for pages whose output depends on nothing but their template and arguments."""
+    from flask import current_app, render_template
+
+    try:
+        key = (template_name, tuple(sorted(context.items())))
+        hash(key)
+    except TypeError:
+        return render_template(template_name, **context)  # Unhashable arguments: not cached
+    template = current_app.jinja_env.get_template(template_name)
+    with _page_shells_lock:
+        cached = _page_shells.get(key)
+        if cached is not None and cached[0] is template:
+            _page_shells.move_to_end(key)
+            return cached[1]
+    html = render_template(template, **context)
+    with _page_shells_lock:
+        _page_shells[key] = (template, html)
+        _page_shells.move_to_end(key)
+        while len(_page_shells) > PAGE_SHELL_CACHE_SIZE:
+            _page_shells.popitem(last=False)
+    return html
+
+
+def init_app(app):
+    """Serves /static/ through serve_static and makes asset_url available to templates."""
+    global STATIC_DIR
+    STATIC_DIR = app.static_folder
+    app.view_functions['static'] = serve_static
+    app.jinja_env.globals['asset_url'] = asset_url
+
+
+# --- Build Steps ---
+
+def _download(url):
+    request = urllib.request.Request(url, headers={'User-Agent': _DOWNLOAD_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.read()
+
+
+def _write_static(filename, content):
+    path = _static_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def vendor_assets(force=False):
+    """
+    Downloads every VENDORED_ASSETS entry that is missing (all of them with force), plus the fonts and
+    images their CSS refers to. Files a stylesheet refers to on another host are stored next to it and
+    the stylesheet is rewritten to point at the local copy.
+    """
+    for filename, url in VENDORED_ASSETS.items():
+        if not force and os.path.exists(_static_path(filename)):
+            continue
+        content = _download(url)
+        if filename.endswith('.css'):
+            css = content.decode('utf-8')
+            css_dir = os.path.dirname(filename)
+            for reference in sorted({match[1] for match in _CSS_URL.findall(css)}):
+                if reference.startswith('data:'):
+                    continue
+                source = urljoin(url, reference)
+                source_path = urlsplit(source).path
+                if urlsplit(reference).netloc:
+                    local_reference = f"files/{os.path.basename(source_path)}"
+                    css = css.replace(reference, local_reference)
+                else:
+                    local_reference = urlsplit(reference).path
+                local = os.path.normpath(os.path.join(css_dir, local_reference)).replace(os.sep, '/')
+                if force or not os.path.exists(_static_path(local)):
+                    _write_static(local, _download(source))
+                    print(f"  {local}")
+            content = css.encode('utf-8')
+        _write_static(filename, content)
+        print(f"Vendored {filename} from {url}")
+
+
+def _vendored_files():
+    """Paths under static/ of the vendored files, sorted, without precompressed variants or VENDOR_CHECKSUMS."""
+    vendor_dir = _static_path('vendor')
+    filenames = []
+    for directory, _, files in os.walk(vendor_dir):
+        for name in files:
+            filename = os.path.relpath(os.path.join(directory, name), STATIC_DIR).replace(os.sep, '/')
+            if filename != VENDOR_CHECKSUMS and not name.endswith(tuple(PRECOMPRESSED_SUFFIXES.values())):
+                filenames.append(filename)
+    return sorted(filenames)
+
+
+def _sha256(filename):
+    with open(_static_path(filename), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_checksums():
+    """Writes VENDOR_CHECKSUMS for the files currently in static/vendor/."""
+    relative = os.path.dirname(VENDOR_CHECKSUMS) + '/'
+    lines = [f"{_sha256(filename)}  {filename[len(relative):]}\n" for filename in _vendored_files()]
+    _write_static(VENDOR_CHECKSUMS, ''.join(lines).encode('utf-8'))
+    print(f"Wrote checksums of {len(lines)} vendored files to {VENDOR_CHECKSUMS}.")
+
+
+def verify_checksums():
+    """Returns the problems found comparing static/vendor/ with VENDOR_CHECKSUMS (an empty list if none)."""
+    relative = os.path.dirname(VENDOR_CHECKSUMS) + '/'
+    try:
+        with open(_static_path(VENDOR_CHECKSUMS), encoding='utf-8') as f:
+            entries = [line.rstrip('\n').split('  ', 1) for line in f if line.strip()]
+        expected = {relative + name: digest for digest, name in entries}
+    except FileNotFoundError:
+        return [f"{VENDOR_CHECKSUMS} is missing"]
+    problems = [f"{filename} is not listed in {VENDOR_CHECKSUMS}"
+                for filename in _vendored_files() if filename not in expected]
+    problems += [f"{filename} is not vendored (run `python static_assets.py vendor`)"
+                 for filename in VENDORED_ASSETS if filename not in expected]
+    for filename, digest in expected.items():
+        if not os.path.isfile(_static_path(filename)):
+            problems.append(f"{filename} is missing")
+        elif _sha256(filename) != digest:
+            problems.append(f"{filename} does not match its checksum")
+    return problems
+
+
+def precompress_static(force=False):
+    """Writes .gz (and, with brotli installed, .br) variants of compressible static files that changed."""
+    written = 0
+    for directory, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            path = os.path.join(directory, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                if encoding == 'br' and brotli is None:
+                    continue
+                variant = path + suffix
+                if not force and os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+                    continue
+                compressed = brotli.compress(content, quality=11) if encoding == 'br' else gzip.compress(content, 9, mtime=0)
+                if len(compressed) >= len(content):
+                    continue  # Already compressed (or too small to gain anything)
+                with open(variant, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    print(f"Wrote {written} precompressed files under {STATIC_DIR}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['vendor', 'build'])
+    parser.add_argument('--force', action='store_true', help='redo files that already exist')
+    args = parser.parse_args()
+    if args.command == 'vendor':
+        try:
+            vendor_assets(force=args.force)
+        except OSError as e:
+            print(f"Error: Failed to download vendored assets: {e}")
+            sys.exit(1)
+        write_checksums()
+    problems = verify_checksums()
+    if problems:
+        for problem in problems:
+            print(f"Error: {problem}")
+        sys.exit(1)
+    precompress_static(force=args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import contextvars
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# --- Tenant Configuration ---
+# Each tenant (a household / shopping list) keeps its own shopping list, price tracking and purchase
+# history in a directory under TENANTS_DIR. The product catalogue and categories are shared by all.
+# The default tenant uses the original files directly under databases/.
+TENANTS_DIR = os.environ.get('TENANTS_DIR', 'databases/tenants')
+# Number of tenant stores kept open in memory; the least recently used one is flushed and closed beyond it.
+MAX_OPEN_TENANTS = int(os.environ.get('MAX_OPEN_TENANTS', '256'))
+DEFAULT_TENANT = 'default'
+# Requests pick their tenant from this header, a 'tenant' query argument or the 'tenant' cookie, in that order.
+TENANT_HEADER = 'X-Tenant'
+TENANT_COOKIE = 'tenant'
+
+_TENANT_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# The tenant the current request (or thread) works on
+_current_tenant = contextvars.ContextVar('current_tenant', default=DEFAULT_TENANT)
+
+
+def is_valid_tenant(tenant):
+    """Tenant IDs become directory names, so only letters, digits, '-' and '_' are accepted."""
+    return bool(tenant) and _TENANT_ID.match(tenant) is not None
+
+
+def get_current_tenant():
+    return _current_tenant.get()
+
+
+def set_current_tenant(tenant):
+    """Switches the current context to a tenant. Returns the token needed to switch back."""
+    if not is_valid_tenant(tenant):
+        raise ValueError(f"Invalid tenant ID '{tenant}'")
+    return _current_tenant.set(tenant)
+
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
+
+
+@contextmanager
+def use_tenant(tenant):
+    """Runs the body of a with statement on behalf of a tenant."""
+    token = set_current_tenant(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
+
+
+def tenant_path(tenant, file_path):
+    """Where a tenant keeps its copy of a per-tenant file, e.g. databases/tenants/<tenant>/shopping_items.json."""
+    if tenant == DEFAULT_TENANT:
+        return file_path
+    return os.path.join(TENANTS_DIR, tenant, os.path.basename(file_path))
+
+
+def list_tenants():
+    """The default tenant and every other tenant that has stored data."""
+    try:
+        with os.scandir(TENANTS_DIR) as entries:
+            others = sorted(entry.name for entry in entries if entry.is_dir() and is_valid_tenant(entry.name))
+    except FileNotFoundError:
+        others = []
+    return [DEFAULT_TENANT] + [tenant for tenant in others if tenant != DEFAULT_TENANT]
+
+
+class StoreCache:
+    """
+    Bounded LRU of open tenant stores. open_store(tenant) builds a store on first use; when more than
+    max_open stores are open, close_store(tenant, store) flushes and releases the least recently used.
+    A request still holding an evicted store can finish with it; the store is simply not reused.
+    """
+
+    def __init__(self, open_store, close_store, max_open=MAX_OPEN_TENANTS):
+        self.open_store = open_store
+        self.close_store = close_store
+        self.max_open = max_open
+        self._stores = OrderedDict()  # tenant -> store, least recently used first
+        self._lock = threading.RLock()
+
+    def get(self, tenant):
+        with self._lock:
+            store = self._stores.get(tenant)
+            if store is not None:
+                self._stores.move_to_end(tenant)
+                return store
+            store = self._stores[tenant] = self.open_store(tenant)
+            while len(self._stores) > self.max_open:
+                evicted_tenant, evicted_store = self._stores.popitem(last=False)
+                self.close_store(evicted_tenant, evicted_store)
+            return store
+
+    def close_all(self):
+        """Flushes and closes every open store (used at shutdown)."""
+        with self._lock:
+            while self._stores:
+                self.close_store(*self._stores.popitem(last=False))
+
+    def __contains__(self, tenant):
+        return tenant in self._stores
+
+    def __len__(self):
+        return len(self._stores)
+
+
+def init_app(app):
+    """Registers request hooks that run every request on behalf of the tenant it names (default: DEFAULT_TENANT)."""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _select_tenant():
+        from_query = request.args.get('tenant')
+        tenant = request.headers.get(TENANT_HEADER) or from_query or request.cookies.get(TENANT_COOKIE) or DEFAULT_TENANT
+        if not is_valid_tenant(tenant):
+            return jsonify({"error": f"Invalid tenant ID '{tenant}'"}), 400
+        g.tenant_token = set_current_tenant(tenant)
+        # A page opened with ?tenant=... keeps that tenant for the API calls it makes
+        g.remember_tenant = from_query if from_query and from_query != request.cookies.get(TENANT_COOKIE) else None
+
+    @app.after_request
+    def _remember_tenant(response):
+        if g.get('remember_tenant'):
+            response.set_cookie(TENANT_COOKIE, g.remember_tenant, max_age=365 * 24 * 3600, samesite='Lax')
+        return response
+
+    @app.teardown_request
+    def _reset_tenant(exc):
+        token = g.pop('tenant_token', None)
+        if token is not None:
+            reset_current_tenant(token)
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# The app keeps its databases and logs under the working directory, so the tests run in a scratch one
+# (entered before the app's modules are imported, as they create their directories on import).
+WORKDIR = tempfile.mkdtemp(prefix='shoppyscan-tests-')
+os.chdir(WORKDIR)
+os.environ.setdefault('SNAPSHOT_DEBOUNCE_SECONDS', '0')
+os.environ.setdefault('PURGE_DELAY_SECONDS', '0')  # Tests run the purge sweep themselves
+
+
+@pytest.fixture
+def dm():
+    """data_manager over empty databases, with nothing cached from a previous test."""
+    import data_manager
+
+    data_manager.close_tenant_stores()
+    data_manager._db_cache.clear()
+    data_manager._deleted_at.clear()
+    shutil.rmtree(os.path.join(WORKDIR, 'databases'), ignore_errors=True)
+    os.makedirs(os.path.join(WORKDIR, 'databases'))
+    yield data_manager
+    data_manager.close_tenant_stores()
+    data_manager._db_cache.clear()
+
+
+@pytest.fixture
+def client(dm):
+    import app
+
+    app.app.config['TESTING'] = True
+    return app.app.test_client()
+
+
+def write_db(db_path, data):
+    """Writes a database file as the app would find it on disk."""
+    with open(os.path.join(WORKDIR, db_path), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def read_db(db_path):
+    with open(os.path.join(WORKDIR, db_path), encoding='utf-8') as f:
+        return json.load(f)
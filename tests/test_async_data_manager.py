@@ -0,0 +1,44 @@
+import asyncio
+import os
+
+import async_data_manager
+
+
+def test_concurrent_async_writers_hold_one_executor_thread_at_a_time(dm, monkeypatch):
+    running = 0
+    most_running = 0
+    call = async_data_manager._call
+
+    async def counting_call(func, *args, **kwargs):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        try:
+            return await call(func, *args, **kwargs)
+        finally:
+            running -= 1
+
+    monkeypatch.setattr(async_data_manager, '_call', counting_call)
+
+    async def add_items():
+        return await asyncio.gather(*(async_data_manager.add_shopping_item(f"item{number % 5}", 1, 'Food', '')
+                                      for number in range(20)))
+
+    assert all(asyncio.run(add_items()))
+    assert most_running == 1
+    quantities = {name: item['quantity'] for name, item in dm.get_all_shopping_items()['products'].items()}
+    assert quantities == {f"item{number}": 4 for number in range(5)}
+
+
+def test_change_made_while_a_listener_reads_is_not_missed(tmp_path):
+    path = tmp_path / 'shopping_items.json'
+    path.write_text('{}')
+
+    async def listen():
+        async with async_data_manager.ChangeFeed(str(path), interval_seconds=0.01) as changes:
+            token = changes.token()
+            path.write_text('{"products": {}}')  # Changed while the listener is busy reading
+            await asyncio.sleep(0.1)  # The poller notices and moves on to a new token
+            return await changes.wait(token, timeout=0.5), await changes.wait(changes.token(), timeout=0.05)
+
+    assert asyncio.run(listen()) == (True, False)
@@ -0,0 +1,139 @@
+from conftest import read_db, write_db
+
+
+def master(products):
+    return {"schema_version": 2, "products": products}
+
+
+def test_master_with_int_barcode_loads_and_survives_a_write(dm, client):
+    write_db(dm.PRODUCTS_MASTER_DB, master({
+        "p1": {"name": "Milk", "barcode": 7290000099999, "category": "Dairy"},
+        "p2": {"name": "Bread", "barcode": "7290000011115", "category": "Bakery"},
+        "p3": {"name": "Eggs", "barcode": 12345, "category": "Dairy"},
+    }))
+
+    products = client.get('/api/all_products').get_json()['products']
+    assert sorted(product['name'] for product in products) == ['Bread', 'Eggs', 'Milk']
+    assert dm.get_product_id_by_barcode('7290000099999') == 'p1'
+
+    response = client.post('/api/add_product', json={"name": "Butter", "category": "Dairy", "quantity": 1})
+    assert response.status_code == 200
+    saved = read_db(dm.PRODUCTS_MASTER_DB)['products']
+    assert len(saved) == 4
+    assert str(saved['p1']['barcode']) == '7290000099999'
+    assert str(saved['p3']['barcode']) == '12345'
+
+
+def test_scanner_accepts_a_numeric_barcode(dm, client):
+    write_db(dm.PRODUCTS_MASTER_DB, master({
+        "p1": {"name": "Milk", "barcode": "7290000099999", "category": "Dairy"},
+    }))
+
+    response = client.post('/api/scanner/add_product', json={"barcode": 7290000099999})
+    assert response.status_code == 200
+    assert list(read_db(dm.SHOPPING_ITEMS_DB)['products']) == ['p1']
+
+
+def test_unreadable_database_is_not_overwritten_by_a_writer(dm, monkeypatch):
+    write_db(dm.PRODUCTS_MASTER_DB, master({"p1": {"name": "Milk", "barcode": "", "category": "Dairy"}}))
+
+    def failing_load(file_path):
+        raise OSError("disk unavailable")
+
+    monkeypatch.setattr(dm.serializers, 'load_file', failing_load)
+    assert dm.get_all_products_from_master() == {"products": []}
+    assert not dm.add_product_to_master("Bread", "", "Bakery")
+    monkeypatch.undo()
+    assert list(read_db(dm.PRODUCTS_MASTER_DB)['products']) == ['p1']
+
+
+def rebuilt_grouped_view(dm):
+    """The grouped shopping list built from scratch, to compare the incrementally updated one with."""
+    store = dm._tenant_store()
+    kept = store.grouped_view
+    store.grouped_view = {'versions': None, 'groups': {}, 'placement': {}}
+    try:
+        return dm.get_grouped_shopping_items()
+    finally:
+        store.grouped_view = kept
+
+
+def test_checkout_updates_grouped_view_of_items_already_done(dm):
+    for name in ('milk2', 'bread2'):
+        assert dm.add_shopping_item(name, 1, 'Food', '')
+    assert dm.update_shopping_item('milk2', done=True)
+    dm.get_grouped_shopping_items()  # Builds the view the checkout then updates
+
+    result = dm.checkout_shopping_items([{"name": "milk2", "price": None, "quantity": 5},
+                                         {"name": "bread2", "price": 4.5, "quantity": None}])
+
+    assert result['checked_out'] == 2
+    grouped = dm.get_grouped_shopping_items()
+    assert grouped['groups']['Food']['items']['milk2']['quantity'] == 5
+    assert grouped == rebuilt_grouped_view(dm)
+
+
+def test_deleted_product_is_purged_once_no_tenant_lists_it(dm):
+    import tenants
+
+    write_db(dm.PRODUCTS_MASTER_DB, master({
+        "p1": {"name": "Milk", "barcode": "", "category": "Dairy"},
+        "p2": {"name": "Bread", "barcode": "", "category": "Bakery"},
+    }))
+    with tenants.use_tenant('shop2'):
+        assert dm.add_shopping_item('Milk', 1, 'Dairy', '')
+    dm.close_tenant_stores()
+
+    assert dm.delete_product_from_master('Milk')
+    assert dm.delete_product_from_master('Bread')
+    assert 'shop2' not in dm._tenant_stores  # Deleting does not look at other tenants' lists
+    assert dm.get_product_id_by_name('Bread') == 'p2'  # Hidden until the sweep
+
+    assert dm.purge_deleted_products() == 1
+    assert 'shop2' not in dm._tenant_stores
+    assert set(read_db(dm.PRODUCTS_MASTER_DB)['products']) == {'p1'}
+    assert dm.get_product_id_by_name('Bread') is None
+
+    with tenants.use_tenant('shop2'):
+        assert dm.delete_shopping_item('Milk')
+    assert dm.purge_deleted_products() == 1
+    assert read_db(dm.PRODUCTS_MASTER_DB)['products'] == {}
+
+
+def test_purge_skips_products_deleted_again_while_it_read_the_lists(dm, monkeypatch):
+    write_db(dm.PRODUCTS_MASTER_DB, master({"p1": {"name": "Milk", "barcode": "", "category": "Dairy"}}))
+    assert dm.delete_product_from_master('Milk')
+    listed_product_ids = dm._listed_product_ids
+
+    def relisted_meanwhile():
+        listed = listed_product_ids()
+        assert dm.add_shopping_item('Milk', 1, 'Dairy', '')  # Restores the product...
+        assert dm.delete_product_from_master('Milk')  # ...and deletes it again, while it is listed
+        return listed
+
+    monkeypatch.setattr(dm, '_listed_product_ids', relisted_meanwhile)
+    assert dm.purge_deleted_products() == 0
+    assert 'p1' in read_db(dm.PRODUCTS_MASTER_DB)['products']
+
+
+def test_failed_migration_leaves_the_v1_databases_as_they_were(dm, monkeypatch):
+    v1_master = {"Milk": {"barcode": "7290000099999", "category": "Dairy"}}
+    v1_shopping = {"Milk": {"quantity": 2, "done": False, "category": "Dairy", "barcode": "7290000099999"}}
+    write_db(dm.PRODUCTS_MASTER_DB, {"products": v1_master})
+    write_db(dm.SHOPPING_ITEMS_DB, {"products": v1_shopping})
+    save_db = dm._save_db
+
+    def failing_save(db_path, data):
+        if db_path == dm.PRODUCT_DBS[-1]:
+            return False
+        return save_db(db_path, data)
+
+    monkeypatch.setattr(dm, '_save_db', failing_save)
+    assert not dm.migrate_to_product_ids()
+    assert read_db(dm.PRODUCTS_MASTER_DB) == {"products": v1_master}
+    assert read_db(dm.SHOPPING_ITEMS_DB) == {"products": v1_shopping}
+    assert not dm.add_product_to_master("Bread", "", "Bakery")  # Refused over the unmigrated files
+
+    monkeypatch.undo()
+    assert dm.get_all_shopping_items()['products']['Milk']['quantity'] == 2
+    assert read_db(dm.PRODUCTS_MASTER_DB)['schema_version'] == dm.SCHEMA_VERSION
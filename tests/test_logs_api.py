@@ -0,0 +1,44 @@
+import json
+
+
+def rows_from_columnar(body):
+    """The rows a columnar log response encodes, with dictionary columns decoded and null fields dropped."""
+    columns, dictionaries = body['columns'], body['dictionaries']
+    rows = []
+    for i in range(body['length']):
+        row = {}
+        for column, values in columns.items():
+            value = values[i]
+            if column in dictionaries:
+                value = dictionaries[column][value]
+            if value is not None:
+                row[column] = value
+        rows.append(row)
+    return rows
+
+
+def test_columnar_server_logs_carry_every_key_of_the_rows(client, tmp_path, monkeypatch):
+    import app
+
+    log_file = tmp_path / 'server_logs.txt'
+    log_file.write_text(
+        '2026-01-02 10:00:00,000 - INFO - Plain text entry\n'
+        + json.dumps({"time": "2026-01-02 10:00:01,000", "level": "warning", "message": "Scan failed",
+                      "barcode": "7290000099999", "route": "/api/scanner/add_product"}) + '\n',
+        encoding='utf-8')
+    monkeypatch.setattr(app, 'SERVER_LOG_FILE_PATH', str(log_file))
+
+    rows = client.get('/api/logs/server').get_json()
+    assert rows[0]['fields'] == {"barcode": "7290000099999", "route": "/api/scanner/add_product"}
+    assert rows_from_columnar(client.get('/api/logs/server?format=columnar').get_json()) == rows
+
+
+def test_columnar_search_results_carry_their_source(dm):
+    import app
+
+    results = [{"source": "server", "timestamp": "t1", "level": "info", "message": "a"},
+               {"source": "scanner", "timestamp": "t2", "level": "error", "message": "b", "fields": {"barcode": "1"}}]
+    with app.app.test_request_context('/api/logs/search?format=columnar'):
+        body = app.logs_response(results, columns=('source', 'timestamp', 'level', 'message', 'fields')).get_json()
+    assert body['dictionaries']['source'] == ['server', 'scanner']
+    assert rows_from_columnar(body) == results
@@ -0,0 +1,48 @@
+import json
+import os
+import shutil
+
+from conftest import WORKDIR
+
+import replay
+import traffic_capture
+
+
+class ClientTarget:
+    """Replay target sending the requests to the app through a Flask test client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def send(self, record):
+        response = self.client.open(record['path'], method=record['method'], headers=replay.request_headers(record),
+                                    data=traffic_capture.decode_body(record))
+        return response.status_code, response.get_data()
+
+
+def captured(client, ts, method, path, json_body=None):
+    body = json.dumps(json_body).encode('utf-8') if json_body is not None else b''
+    headers = {"Content-Type": "application/json"} if json_body is not None else {}
+    response = client.open(path, method=method, headers=headers, data=body)
+    record = {"ts": ts, "method": method, "path": path, "status": response.status_code, "headers": headers}
+    record.update(traffic_capture.encode_body(body))
+    record.update({f"response_{key}": value for key, value in traffic_capture.encode_body(response.get_data()).items()})
+    return record
+
+
+def test_requests_by_id_reach_the_products_the_replay_created(dm, client):
+    records = [captured(client, 1, 'POST', '/api/add_product', {"name": "Milk", "category": "Dairy", "quantity": 1}),
+               captured(client, 2, 'GET', '/api/all_products')]
+    product_id = records[1]['response_body'].split('"id":')[1].split('"')[1]
+    records.append(captured(client, 3, 'GET', f'/api/product_tracking?id={product_id}'))
+    assert records[2]['status'] == 200
+
+    # The replay starts from the databases as they were before the capture
+    dm.close_tenant_stores()
+    dm._db_cache.clear()
+    shutil.rmtree(os.path.join(WORKDIR, 'databases'))
+    os.makedirs(os.path.join(WORKDIR, 'databases'))
+
+    results = replay.replay(records, ClientTarget(client), speed=0)
+    assert [result['status'] for result in results] == [200, 200, 200]
+    assert replay.build_report(records, results)['diffs'] == 0
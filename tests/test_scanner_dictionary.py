@@ -0,0 +1,16 @@
+from conftest import write_db
+
+
+def test_conditional_get_without_gzip_answers_304(dm, client):
+    write_db(dm.PRODUCTS_MASTER_DB, {"schema_version": 2, "products": {
+        "p1": {"name": "Milk", "barcode": "7290000099999", "category": "Dairy"},
+    }})
+
+    response = client.get('/api/scanner/dictionary', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    version = response.headers['X-Dictionary-Version']
+    assert response.headers['ETag'] == f'"{version}"'
+
+    response = client.get('/api/scanner/dictionary',
+                          headers={'Accept-Encoding': 'identity', 'If-None-Match': f'"{version}"'})
+    assert response.status_code == 304
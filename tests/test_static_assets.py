@@ -0,0 +1,24 @@
+import os
+import re
+
+from conftest import REPO_DIR
+
+import static_assets
+
+_ASSET_URL = re.compile(r"asset_url\('([^']+)'\)")
+
+
+def test_vendored_assets_are_committed_with_their_checksums():
+    assert static_assets.verify_checksums() == []
+
+
+def test_templates_only_link_static_files_that_exist():
+    templates_dir = os.path.join(REPO_DIR, 'templates')
+    linked = set()
+    for name in os.listdir(templates_dir):
+        with open(os.path.join(templates_dir, name), encoding='utf-8') as f:
+            linked.update(_ASSET_URL.findall(f.read()))
+    assert linked
+    missing = [filename for filename in sorted(linked) if static_assets.file_digest(filename) is None]
+    assert missing == []
+    assert all(static_assets.asset_url(filename).startswith('/static/') for filename in linked)
@@ -0,0 +1,167 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+import log_format
+
+# --- Tracing Configuration ---
+# Requests slower than this (in milliseconds) get their span tree written to the slow request log.
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '500'))
+# Fraction of requests that are traced at all (1.0 = every request, 0.0 = tracing disabled).
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+
+# --- Logging Setup for Slow Requests ---
+log_dir = 'logs'
+if not os.path.exists(log_dir):
+    os.makedirs(log_dir)
+
+SLOW_REQUEST_LOG_FILE_PATH = os.path.join(log_dir, 'slow_requests_logs.txt')
+
+slow_request_logger = logging.getLogger('slow_request_logs')
+slow_request_logger.setLevel(logging.INFO)
+slow_request_handler = logging.FileHandler(SLOW_REQUEST_LOG_FILE_PATH, encoding='utf-8')
+log_format.configure_handler(slow_request_handler)
+if not slow_request_logger.handlers:
+    slow_request_logger.addHandler(slow_request_handler)
+
+# The span currently open in this request (None when the request is not being traced)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration_ms', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration_ms = 0.0
+        self.children = []
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+
+    def to_dict(self):
+        """
+        Converts the span tree to plain dictionaries. Leaf children sharing a name
+        (e.g. the dozens of log writes of a single request) are folded into one
+        entry with a call count, so the tree stays readable.
+        """
+        children = []
+        folded = {}
+        for child in self.children:
+            if child.children:
+                children.append(child.to_dict())
+                continue
+            if child.name in folded:
+                folded[child.name]['duration_ms'] += child.duration_ms
+                folded[child.name]['count'] += 1
+            else:
+                folded[child.name] = {"name": child.name, "duration_ms": child.duration_ms, "count": 1}
+                children.append(folded[child.name])
+        for entry in children:
+            entry['duration_ms'] = round(entry['duration_ms'], 3)
+        result = {"name": self.name, "duration_ms": round(self.duration_ms, 3)}
+        if children:
+            result['children'] = children
+        return result
+
+
+def start_trace(name):
+    """Opens the root span of a trace and returns it together with the context token needed to close it."""
+    root = Span(name)
+    token = _current_span.set(root)
+    return root, token
+
+
+def finish_trace(root, token):
+    """Closes the root span and restores the previous (untraced) context."""
+    root.finish()
+    _current_span.reset(token)
+    return root
+
+
+@contextmanager
+def span(name):
+    """Records a child span of the current trace. Does nothing when the request is not traced."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def traced(func):
+    """Decorator that wraps every call of the function in a span named after it."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return func(*args, **kwargs)
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def trace_handler(handler, name='logging'):
+    """Wraps a logging handler so time spent writing log records shows up in the span tree."""
+    emit = handler.emit
+
+    def traced_emit(record):
+        if _current_span.get() is None:
+            return emit(record)
+        with span(name):
+            return emit(record)
+
+    handler.emit = traced_emit
+    return handler
+
+
+def log_if_slow(root, status_code=None):
+    """Writes the span tree of a finished trace to the slow request log if it crossed the threshold."""
+    if root.duration_ms < SLOW_REQUEST_THRESHOLD_MS:
+        return False
+    tree = json.dumps(root.to_dict(), ensure_ascii=False)
+    slow_request_logger.warning(f"{root.name} ({status_code}) took {root.duration_ms:.1f} ms | {tree}",
+                                extra={'duration_ms': round(root.duration_ms, 3), 'status': status_code})
+    return True
+
+
+def init_app(app):
+    """Registers the request hooks that open a trace per sampled request and close it at teardown."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_trace():
+        if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+            return
+        g.trace_root, g.trace_token = start_trace(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _record_response_status(response):
+        if 'trace_root' in g:
+            g.trace_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request_trace(exc):
+        root = g.pop('trace_root', None)
+        if root is None:
+            return
+        finish_trace(root, g.pop('trace_token'))
+        try:
+            log_if_slow(root, g.pop('trace_status', 500 if exc else None))
+        except Exception as e:
+            print(f"Warning: Failed to write slow request trace for {root.name}: {e}")
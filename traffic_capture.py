@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+
+import tenants
+
+# --- Traffic Capture Configuration ---
+# When true, every API request is recorded as one JSON line, for replay.py to run again later.
+TRAFFIC_CAPTURE = os.environ.get('TRAFFIC_CAPTURE', 'false').lower() in ('1', 'true', 'yes')
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH', os.path.join('logs', 'captures', 'requests.jsonl'))
+# The capture rotates at this size (bytes), keeping this many older files (requests.jsonl.1, .2, ...).
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.environ.get('TRAFFIC_CAPTURE_MAX_BYTES', str(50 * 1024 * 1024)))
+TRAFFIC_CAPTURE_BACKUPS = int(os.environ.get('TRAFFIC_CAPTURE_BACKUPS', '5'))
+# Response bodies up to this size (bytes) are stored, so a replay can diff them; larger ones only by hash.
+TRAFFIC_CAPTURE_MAX_RESPONSE_BYTES = int(os.environ.get('TRAFFIC_CAPTURE_MAX_RESPONSE_BYTES', '65536'))
+
+CAPTURED_PATH_PREFIXES = ('/api/', '/scan')
+# Request headers that change what the server does, and so are replayed
+CAPTURED_HEADERS = ('Content-Type', 'Idempotency-Key', tenants.TENANT_HEADER)
+
+capture_logger = logging.getLogger('traffic_capture')
+capture_logger.setLevel(logging.INFO)
+capture_logger.propagate = False
+
+
+def _open_capture_file():
+    os.makedirs(os.path.dirname(TRAFFIC_CAPTURE_PATH) or '.', exist_ok=True)
+    handler = RotatingFileHandler(TRAFFIC_CAPTURE_PATH, maxBytes=TRAFFIC_CAPTURE_MAX_BYTES,
+                                  backupCount=TRAFFIC_CAPTURE_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    if not capture_logger.handlers:
+        capture_logger.addHandler(handler)
+
+
+def encode_body(body):
+    """Request/response bodies are stored as text when they are UTF-8, and as base64 otherwise."""
+    try:
+        return {"body": body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {"body_b64": base64.b64encode(body).decode('ascii')}
+
+
+def decode_body(record, prefix=''):
+    if f'{prefix}body_b64' in record:
+        return base64.b64decode(record[f'{prefix}body_b64'])
+    return record.get(f'{prefix}body', '').encode('utf-8')
+
+
+def capture_record(request, response, started, tenant):
+    """The capture line of one request: what was asked, how long it took and what was answered."""
+    response_body = response.get_data()
+    record = {
+        "ts": round(started, 3),
+        "method": request.method,
+        "path": request.full_path.rstrip('?'),
+        "route": request.url_rule.rule if request.url_rule else None,
+        "tenant": tenant,
+        "headers": {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+        **encode_body(request.get_data()),
+        "status": response.status_code,
+        "duration_ms": round((time.time() - started) * 1000, 3),
+        "response_bytes": len(response_body),
+        "response_sha1": hashlib.sha1(response_body).hexdigest(),
+    }
+    if len(response_body) <= TRAFFIC_CAPTURE_MAX_RESPONSE_BYTES:
+        record.update({f"response_{key}": value for key, value in encode_body(response_body).items()})
+    return record
+
+
+def set_enabled(enabled):
+    """
+    Turns capturing on or off, overriding TRAFFIC_CAPTURE: for apps set up afterwards, and for requests
+    handled from now on by apps already capturing (e.g. replay.py turns it off before loading the app).
+    """
+    global TRAFFIC_CAPTURE
+    TRAFFIC_CAPTURE = bool(enabled)
+
+
+def init_app(app):
+    """
+    Registers the capture hooks when TRAFFIC_CAPTURE is on. Call it after every other init_app: Flask
+    runs after_request hooks in reverse order, so the capture then sees the response before it is
+    compressed.
+    """
+    if not TRAFFIC_CAPTURE:
+        return
+    from flask import g, request
+
+    _open_capture_file()
+
+    @app.before_request
+    def _start_capture():
+        if TRAFFIC_CAPTURE:
+            g.capture_started = time.time()
+
+    @app.after_request
+    def _capture_request(response):
+        started = g.pop('capture_started', None)
+        if started is None or not request.path.startswith(CAPTURED_PATH_PREFIXES) or response.is_streamed:
+            return response
+        try:
+            record = capture_record(request, response, started, tenants.get_current_tenant())
+            capture_logger.info(json.dumps(record, ensure_ascii=False))
+        except Exception as e:
+            print(f"Warning: Failed to capture request {request.method} {request.path}: {e}")
+        return response
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import tracing
+
+try:
+    import brotli  # Optional: enables 'br' encoding when installed
+except ImportError:
+    brotli = None
+
+# --- Compression Configuration ---
+# Responses smaller than this (in bytes) are sent uncompressed; compressing them costs more than it saves.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+# Number of compressed bodies kept in memory, keyed by the hash of the uncompressed body.
+COMPRESSION_CACHE_SIZE = int(os.environ.get('COMPRESSION_CACHE_SIZE', '64'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+_compressed_bodies = OrderedDict()
+_compressed_bodies_lock = threading.Lock()
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def get_compressed_body(body, digest, encoding):
+    """Returns the compressed body, reusing a cached copy when the same body was compressed before."""
+    key = (digest, encoding)
+    with _compressed_bodies_lock:
+        cached = _compressed_bodies.get(key)
+        if cached is not None:
+            _compressed_bodies.move_to_end(key)
+            return cached
+    # Compressed outside the lock; two requests compressing the same body just store the same result
+    with tracing.span(f'compress:{encoding}'):
+        compressed = _compress(body, encoding)
+    with _compressed_bodies_lock:
+        _compressed_bodies[key] = compressed
+        _compressed_bodies.move_to_end(key)
+        while len(_compressed_bodies) > COMPRESSION_CACHE_SIZE:
+            _compressed_bodies.popitem(last=False)
+    return compressed
+
+
+def choose_encoding(accept_encodings):
+    """Picks the best encoding supported by both sides, or None to send the body as is."""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = accept_encodings.best_match(offered)
+    if best and accept_encodings[best] > 0:
+        return best
+    return None
+
+
+def init_app(app):
+    """Registers an after_request hook that compresses large responses and answers conditional requests.
+
+    Responses that already carry an ETag are left alone: their view chose the validator (and the
+    encoding it belongs to), and replacing it would stop the client's If-None-Match from matching.
+    """
+    from flask import request
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or 'ETag' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        body = response.get_data()
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings) if len(body) >= COMPRESSION_MIN_SIZE else None
+        digest = hashlib.sha1(body).hexdigest()
+        etag = f"{digest}-{encoding}" if encoding else digest
+        response.set_etag(etag)
+
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b'')
+            return response
+
+        if encoding:
+            response.set_data(get_compressed_body(body, digest, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+# --- Columnar Encoding ---
+
+def wants_columnar(args):
+    """True when the client asked for the columnar shape (?format=columnar)."""
+    return args.get('format', '').lower() == 'columnar'
+
+
+def encode_columnar(records, columns, dictionary_columns=()):
+    """
+    Converts a list of dicts to one list per column. Columns named in dictionary_columns are
+    dictionary-encoded: their distinct values are sent once under "dictionaries" and each row
+    holds the index of its value.
+
+    Example: {"format": "columnar", "length": 2,
+              "columns": {"name": ["a", "b"], "category": [0, 0]},
+              "dictionaries": {"category": ["שימורים"]}}
+    """
+    encoded_columns = {column: [] for column in columns}
+    dictionaries = {column: [] for column in dictionary_columns}
+    positions = {column: {} for column in dictionary_columns}
+
+    for record in records:
+        for column in columns:
+            value = record.get(column)
+            if column in positions:
+                index = positions[column].get(value)
+                if index is None:
+                    index = positions[column][value] = len(dictionaries[column])
+                    dictionaries[column].append(value)
+                value = index
+            encoded_columns[column].append(value)
+
+    return {"format": "columnar", "length": len(records), "columns": encoded_columns, "dictionaries": dictionaries}
+
+
+def products_to_records(products):
+    """Flattens a {"name": {details}} mapping into a list of records carrying the name."""
+    return [{"name": name, **details} for name, details in products.items()]